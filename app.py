@@ -1,22 +1,26 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import pandas as pd
-import yfinance as yf
-import requests
-import re
-import numpy as np
+import functools
+import time
 from datetime import datetime, timedelta
-import plotly.graph_objects as go
-from google.oauth2 import service_account
-import gspread
-
-# --- 策略參數常數 ---
-VOL_SURGE_THRESHOLD = 1.2
-BIAS_STRONG_PCT     = 5.0
-NEAR_MA_RANGE       = 0.05
-SHORT_TARGET_MULT   = 1.10
-MEDIUM_TARGET_MULT  = 1.15
-LONG_TARGET_MULT    = 1.30
+
+# yfinance / plotly / gspread / google-auth 都改在用到的函式裡才 import，
+# 冷啟動不必先付這幾百毫秒（量測見 bench/coldstart.py）
+import radar
+import market_scan
+import live_quotes
+import snapshot
+import shared_cache
+import shared_panel
+import ranking_grid
+import correlation
+import screener
+import download_scheduler
+import rating_alerts
+import relative_strength
+import ta_chart
+from history_store import HistoryStore
+from radar import validate_and_add
 
 # --- 1. 頁面基本設定 ---
 st.set_page_config(
@@ -25,30 +29,6 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- 2. 靜態保底百大清單 ---
-MEGA_STOCKS = [
-    ("2330.TW", "台積電"), ("2317.TW", "鴻海"), ("2454.TW", "聯發科"), ("2382.TW", "廣達"), ("2308.TW", "台達電"),
-    ("2881.TW", "富邦金"), ("2882.TW", "國泰金"), ("2891.TW", "中信金"), ("2303.TW", "聯電"), ("3711.TW", "日月光投控"),
-    ("2886.TW", "兆豐金"), ("3231.TW", "緯創"), ("2884.TW", "玉山金"), ("2357.TW", "華碩"), ("2892.TW", "第一金"),
-    ("5880.TW", "合庫金"), ("2885.TW", "元大金"), ("2880.TW", "華南金"), ("2890.TW", "永豐金"), ("2883.TW", "凱基金"),
-    ("2887.TW", "台新金"), ("2801.TW", "彰銀"), ("2834.TW", "臺企銀"), ("2412.TW", "中華電"), ("3045.TW", "台灣大"),
-    ("4904.TW", "遠傳"), ("2603.TW", "長榮"), ("2609.TW", "陽明"), ("2615.TW", "萬海"), ("1216.TW", "統一"),
-    ("2002.TW", "中鋼"), ("1303.TW", "南亞"), ("1301.TW", "台塑"), ("1326.TW", "台化"), ("3008.TW", "大立光"),
-    ("2327.TW", "國巨"), ("2379.TW", "瑞昱"), ("3034.TW", "聯詠"), ("2376.TW", "技嘉"), ("2356.TW", "英業達"),
-    ("6669.TW", "緯穎"), ("3661.TW", "世芯-KY"), ("3443.TW", "創意"), ("2207.TW", "和泰車"), ("2912.TW", "統一超"),
-    ("1519.TW", "華城"), ("5871.TW", "中租-KY"), ("2301.TW", "光寶科"), ("3017.TW", "奇鋐"), ("2383.TW", "台光電"),
-    ("4953.TWO", "緯軟"), ("3293.TWO", "鈊象"), ("5274.TWO", "信驊"), ("3529.TWO", "力旺"), ("8299.TWO", "群聯"),
-    ("5347.TWO", "世界先進"), ("6488.TWO", "環球晶"), ("5483.TWO", "中美晶"), ("3105.TWO", "穩懋"), ("3324.TWO", "雙鴻"),
-    ("6274.TWO", "台燿"), ("8069.TWO", "元太"), ("2453.TW", "凌群"), ("1618.TW", "合機"), ("1513.TW", "中興電"),
-    ("1503.TW", "士電"), ("1514.TW", "亞力"), ("3583.TW", "辛耘"), ("8210.TW", "勤誠"), ("3533.TW", "嘉澤"),
-    ("0050.TW", "元大台灣50"), ("006208.TW", "富邦台50"), ("0056.TW", "元大高股息"), ("00878.TW", "國泰永續高股息"),
-    ("00919.TW", "群益台灣精選高息"), ("00929.TW", "復華台灣科技優息"), ("00940.TW", "元大台灣價值高息"),
-    ("00713.TW", "元大台灣高息低波"), ("00915.TW", "凱基優選高股息30"), ("00679B.TWO", "元大美債20年")
-]
-
-LOCAL_NAME_DICT = {n: (c, n) for c, n in MEGA_STOCKS}
-LOCAL_DICT = {c.split('.')[0]: (c, n) for c, n in MEGA_STOCKS}
-
 # =====================================================================
 # --- Google Sheets 持久化層 ---
 # 每個使用者以暱稱為 key，自選股存在 Sheet 的 "watchlist" 分頁。
@@ -58,15 +38,18 @@ LOCAL_DICT = {c.split('.')[0]: (c, n) for c, n in MEGA_STOCKS}
 @st.cache_resource
 def get_gsheet_client():
     """建立並快取 Google Sheets 連線（整個 app 生命週期只連一次）"""
+    import gspread
+    from google.oauth2 import service_account
     creds = service_account.Credentials.from_service_account_info(
         st.secrets["gcp_service_account"],
         scopes=["https://www.googleapis.com/auth/spreadsheets"]
     )
     return gspread.authorize(creds)
 
-def get_worksheet():
-    """取得工作表，若分頁不存在則自動建立並加上標題列"""
-    client = get_gsheet_client()
+def get_worksheet(client=None):
+    """取得工作表，若分頁不存在則自動建立並加上標題列；背景執行緒要傳入在腳本執行緒取好的 client"""
+    import gspread
+    client = client or get_gsheet_client()
     sheet = client.open_by_key(st.secrets["gcp_service_account"]["SHEET_ID"])
     try:
         ws = sheet.worksheet("watchlist")
@@ -130,100 +113,100 @@ def delete_all_user_stocks(user_id: str):
     except Exception as e:
         st.warning(f"⚠️ 清空雲端自選失敗：{e}")
 
+def sheets_configured() -> bool:
+    """有沒有設定 Google Sheets 憑證（沒有時不啟動任何會連 Sheets 的背景工作）"""
+    try:
+        return "gcp_service_account" in st.secrets
+    except Exception:
+        return False
+
+def load_all_watchlist_tickers(client=None) -> list:
+    """所有使用者自選股的聯集（背景預抓用），讀取失敗回傳空 list"""
+    try:
+        ws = get_worksheet(client)
+        return sorted({str(row["ticker"]).strip() for row in ws.get_all_records() if str(row.get("ticker", "")).strip()})
+    except Exception as e:
+        print(f"[load_all_watchlist_tickers] 失敗: {e}")
+        return []
+
 # =====================================================================
 # --- 使用者身份識別（側邊欄暱稱輸入）---
 # user_id 存在 session_state。
 # reload 後 session_state 清空，使用者重新輸入暱稱，即可從雲端還原自選。
 # =====================================================================
 
+@st.fragment
 def render_user_login():
-    with st.sidebar:
-        st.markdown("### 👤 我的帳號")
-        st.caption("輸入暱稱來識別你的自選清單。每次 reload 重新輸入暱稱，自選股就會自動還原。")
-        uid = st.text_input(
-            "暱稱",
-            value=st.session_state.get("user_id", ""),
-            placeholder="例如：阿明、trader01",
-            key="uid_input"
-        )
-        if st.button("確認暱稱", use_container_width=True):
-            if uid.strip():
-                st.session_state.user_id = uid.strip()
-                # 切換使用者時，重新從雲端載入該使用者的自選
-                st.session_state.custom_list = load_user_watchlist(st.session_state.user_id)
-                st.rerun()
-            else:
-                st.error("暱稱不能為空白")
-
-        if st.session_state.get("user_id"):
-            st.success(f"✅ 目前：**{st.session_state.user_id}**")
+    """側邊欄的暱稱設定；在 with st.sidebar 內呼叫。輸入暱稱只重跑這一塊，按下確認才重跑整頁"""
+    st.markdown("### 👤 我的帳號")
+    st.caption("輸入暱稱來識別你的自選清單。每次 reload 重新輸入暱稱，自選股就會自動還原。")
+    uid = st.text_input(
+        "暱稱",
+        value=st.session_state.get("user_id", ""),
+        placeholder="例如：阿明、trader01",
+        key="uid_input"
+    )
+    if st.button("確認暱稱", use_container_width=True):
+        if uid.strip():
+            st.session_state.user_id = uid.strip()
+            # 切換使用者時，重新從雲端載入該使用者的自選
+            st.session_state.custom_list = load_user_watchlist(st.session_state.user_id)
+            st.rerun()
         else:
-            st.info("尚未設定暱稱，自選股將不會被儲存。")
+            st.error("暱稱不能為空白")
+
+    if st.session_state.get("user_id"):
+        st.success(f"✅ 目前：**{st.session_state.user_id}**")
+    else:
+        st.info("尚未設定暱稱，自選股將不會被儲存。")
 
     return st.session_state.get("user_id", None)
 
+# --- 跨副本共用快取 ---
+# st.cache_data 是每個程序自己的第一層；沒命中時先查所有副本共用的第二層（shared_cache），
+# 都沒有才真的連上游。位置由 RADAR_CACHE_URL 決定，預設為本機 SQLite。
+@st.cache_resource
+def get_shared_cache():
+    return shared_cache.from_url()
+
+def cached_call(cache, dataset, ttl, fn, *args, cache_if=None):
+    """shared_call 的本體，cache 由呼叫端給。
+
+    背景執行緒與 thread pool 沒有 ScriptRunContext，不能碰 st.cache_*：
+    在腳本執行緒取好 get_shared_cache() 之後，用 functools.partial(cached_call, cache, ...) 交給它們。
+    """
+    if cache is None:
+        return shared_cache.flight.do((dataset, args), fn, *args, stale_ok=True)
+    return cache.call(dataset, ttl, fn, *args, cache_if=cache_if)
+
+def shared_call(dataset, ttl, fn, *args, cache_if=None):
+    """同一份資料同時只有一個呼叫連上游（其他 session 等結果或先拿舊值），見 shared_cache.SingleFlight"""
+    return cached_call(get_shared_cache(), dataset, ttl, fn, *args, cache_if=cache_if)
+
+def real_constituents(value):
+    """抓失敗時回傳的保底清單不寫進共用快取"""
+    return value != radar.MEGA_STOCKS[:50]
+
+def nonempty_panel(df):
+    return df is not None and not df.empty
+
 # --- 3. 動態抓取 0050 成分股 ---
 @st.cache_data(ttl=86400)
 def fetch_0050_constituents():
-    fallback_0050 = MEGA_STOCKS[:50]
-    try:
-        url = "https://www.yuantaetfs.com/api/StkWeights?date=&fundid=1066"
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url, headers=headers, timeout=5)
-        if r.status_code == 200:
-            data = r.json()
-            dynamic_0050 = []
-            for item in data:
-                code = str(item.get("stkCd", "")).strip()
-                name = str(item.get("stkNm", "")).strip()
-                if code.isdigit():
-                    dynamic_0050.append((f"{code}.TW", name))
-            if len(dynamic_0050) >= 40:
-                return dynamic_0050
-    except Exception as e:
-        print(f"[fetch_0050_constituents] 失敗: {e}")
-    return fallback_0050
+    return shared_call("constituents", 86400, radar.fetch_0050_constituents, cache_if=real_constituents)
 
-# --- 4. 動態抓取百大熱門股 ---
+# --- 4. 動態抓取上市櫃清單 / 百大熱門股 ---
 @st.cache_data(ttl=1800)
+def fetch_market_listings():
+    return shared_call("listings", 1800, radar.fetch_market_listings)
+
 def fetch_dynamic_hot_stocks():
-    stocks = []
-    try:
-        r_twse = requests.get("https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL", timeout=5)
-        if r_twse.status_code == 200:
-            for item in r_twse.json():
-                code = str(item.get("Code", ""))
-                if len(code) == 4 or code.startswith('00'):
-                    vol_str = str(item.get("TradeVolume", "0")).replace(',', '')
-                    if vol_str.isdigit():
-                        stocks.append({"code": f"{code}.TW", "name": str(item.get("Name", "")), "vol": int(vol_str)})
-
-        r_tpex = requests.get("https://www.tpex.org.tw/openapi/v1/tpex_mainboard_quotes", timeout=5)
-        if r_tpex.status_code == 200:
-            for item in r_tpex.json():
-                code = str(item.get("SecuritiesCompanyCode", ""))
-                if len(code) == 4 or code.startswith('00'):
-                    vol_str = str(item.get("TradingVolume", "0")).replace(',', '')
-                    if vol_str.isdigit():
-                        # TPEX 成交量單位為「千股」，TWSE 為「股」，統一換算為股才能公平排序
-                        stocks.append({"code": f"{code}.TWO", "name": str(item.get("CompanyName", "")), "vol": int(vol_str) * 1000})
-
-        if not stocks:
-            return None
-        stocks = sorted(stocks, key=lambda x: x['vol'], reverse=True)[:100]
-        return [(s["code"], s["name"]) for s in stocks]
-    except Exception as e:
-        print(f"[fetch_dynamic_hot_stocks] 失敗: {e}")
-        return None
+    return radar.fetch_dynamic_hot_stocks(fetch_market_listings())
 
 # --- 5. 初始化 Session State ---
 if 'watch_list' not in st.session_state:
     # 啟動時合併 0050 成分股 + 百大熱門股；抓不到熱門股才只用 0050
-    _base = {c: n for c, n in fetch_0050_constituents() + MEGA_STOCKS[50:]}
-    _hot = fetch_dynamic_hot_stocks()
-    if _hot:
-        _base.update({c: n for c, n in _hot})
-    st.session_state.watch_list = _base
+    st.session_state.watch_list = radar.build_watch_list(fetch_0050_constituents(), fetch_dynamic_hot_stocks())
 
 if 'custom_list' not in st.session_state:
     st.session_state.custom_list = {}
@@ -238,345 +221,601 @@ if 'user_id' not in st.session_state:
 if st.session_state.user_id and not st.session_state.custom_list:
     st.session_state.custom_list = load_user_watchlist(st.session_state.user_id)
 
-# --- 6. 搜尋系統 ---
-def probe_yfinance(symbol):
-    try:
-        t = yf.Ticker(symbol)
-        hist = t.history(period="1d")
-        if not hist.empty:
-            return True
-    except Exception as e:
-        print(f"[probe_yfinance] {symbol} 失敗: {e}")
-    return False
+# --- 7. 大盤技術分析圖 ---
+@st.cache_data(ttl=300)
+def fetch_taiex(period, interval):
+    return shared_call("taiex", 300, radar.fetch_taiex, period, interval,
+                       cache_if=lambda df: df is not None and not df.empty)
 
-def search_yahoo_api(query):
-    url = "https://tw.stock.yahoo.com/_td-stock/api/resource/AutocompleteService"
-    try:
-        r = requests.get(url, params={"query": query, "limit": 5}, headers={'User-Agent': 'Mozilla/5.0'}, timeout=3)
-        data = r.json()
-        for res in data.get('data', {}).get('result', []):
-            sym = str(res.get('symbol', '')).strip().upper()
-            name = str(res.get('name', '')).strip()
-            if query in sym or query in name:
-                if sym.endswith('.TW') or sym.endswith('.TWO'):
-                    return sym, name
-                exch = str(res.get('exchange', '')).upper()
-                if exch == 'TAI':
-                    return f"{sym}.TW", name
-                if 'TWO' in exch or 'TPEX' in exch or 'GRE TAI' in exch:
-                    return f"{sym}.TWO", name
-    except Exception as e:
-        print(f"[search_yahoo_api] 查詢 {query} 失敗: {e}")
-    return None, None
+@st.cache_resource(ttl=300, max_entries=24, show_spinner=False)
+def taiex_figure(period_opt, version, bars, webgl, _df):
+    """大盤圖依（週期, 資料版本, 長度, WebGL）快取一份給所有人共用 → (圖的 JSON, 摘要)
 
-def scrape_yahoo_name(symbol):
-    url = f"https://tw.stock.yahoo.com/quote/{symbol}"
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url, headers=headers, timeout=3)
-        if r.status_code == 200:
-            match = re.search(r'<title>(.*?)[\(（]', r.text)
-            if match and "Yahoo" not in match.group(1):
-                return match.group(1).strip()
-    except Exception as e:
-        print(f"[scrape_yahoo_name] {symbol} 失敗: {e}")
-    return None
-
-def validate_and_add(query):
-    raw_query = query.strip()  # 保留原始輸入（含中文）
-    query = raw_query.upper()  # 大寫版本用於英文/數字比對
-
-    for c, n in st.session_state.custom_list.items():
-        if query == c or raw_query == n or query == c.split('.')[0]:
-            return c, n, None
-
-    # 先用數字代碼查保底字典
-    if query in LOCAL_DICT:
-        return LOCAL_DICT[query][0], LOCAL_DICT[query][1], None
-
-    # 再用中文名稱查保底字典（支援輸入「鴻海」、「台積電」等）
-    if raw_query in LOCAL_NAME_DICT:
-        return LOCAL_NAME_DICT[raw_query][0], LOCAL_NAME_DICT[raw_query][1], None
-
-    s, n = search_yahoo_api(raw_query)
-    if s and n:
-        if probe_yfinance(s):
-            return s, n, None
-        alt_s = s.replace('.TW', '.TWO') if '.TW' in s else s.replace('.TWO', '.TW')
-        if probe_yfinance(alt_s):
-            return alt_s, n, None
-
-    if query.isdigit():
-        for ext in [".TW", ".TWO"]:
-            target = f"{query}{ext}"
-            if probe_yfinance(target):
-                name = scrape_yahoo_name(target)
-                if name:
-                    return target, name, None
-                return target, f"{query} (系統抓取)", None
-
-    if probe_yfinance(query):
-        return query, query, None
-
-    return None, None, f"在所有市場資料庫中都找不到「{query}」。請確認股票代碼是否正確。"
+    資料版本取自 ta_chart.data_version，_df 不參與雜湊；快取的是序列化後的字串，重跑時由
+    ta_chart.load_figure 還原，不必重算均線、重建 trace，各 session 也不會共用同一個可變的 Figure。
+    """
+    df = ta_chart.add_mas(_df)
+    return ta_chart.build_figure(ta_chart.window(df, bars), webgl=webgl).to_json(), ta_chart.summary(df)
 
-# --- 7. 大盤技術分析圖 ---
+@st.fragment
 def render_taiex_ta_chart():
+    """切換週期只重跑這張圖"""
     col_metric, col_controls = st.columns([2, 3])
     with col_controls:
-        period_opt = st.radio("選擇週期", ["日線", "週線", "月線"], horizontal=True, label_visibility="collapsed")
+        c1, c2, c3 = st.columns([3, 2, 1])
+        with c1:
+            period_opt = st.radio("選擇週期", ["日線", "週線", "月線"], horizontal=True, label_visibility="collapsed")
+        with c2:
+            history = st.selectbox("歷史長度", list(ta_chart.HISTORY_OPTIONS), label_visibility="collapsed",
+                                   help="預設只載入最近 300 根；要往回看再延長（「全部」時較舊的部分會合併成較粗的 K 棒）")
+        with c3:
+            webgl = st.toggle("WebGL", help="均線改用 WebGL 繪製，資料多時瀏覽器較順")
     with st.container():
         try:
-            if period_opt == "日線":
-                df = yf.download("^TWII", period="2y", interval="1d", progress=False)
-            elif period_opt == "週線":
-                df = yf.download("^TWII", period="10y", interval="1wk", progress=False)
-            else:
-                df = yf.download("^TWII", period="20y", interval="1mo", progress=False)
+            df = fetch_taiex(*radar.TAIEX_PERIODS[period_opt])
 
             if not df.empty:
-                if isinstance(df.columns, pd.MultiIndex):
-                    df.columns = df.columns.droplevel(1)
-                mas = [5, 10, 20, 60, 120, 240]
-                ma_colors = ['#f39c12', '#3498db', '#9b59b6', '#2ecc71', '#e74c3c', '#7f8c8d']
-                for ma in mas:
-                    df[f'MA{ma}'] = df['Close'].rolling(window=ma).mean()
-                current = df['Close'].iloc[-1]
-                prev_close = df['Close'].iloc[-2]
-                change = current - prev_close
-                change_pct = ((current - prev_close) / prev_close) * 100
-                cur_ma = {ma: df[f'MA{ma}'].iloc[-1] for ma in mas}
+                payload, info = taiex_figure(period_opt, ta_chart.data_version(df), ta_chart.HISTORY_OPTIONS[history],
+                                         webgl, df)
                 with col_metric:
-                    st.metric(label=f"台灣加權指數 ({period_opt})", value=f"{current:,.0f}", delta=f"{change:,.0f} ({change_pct:.2f}%)", delta_color="inverse")
+                    st.metric(label=f"台灣加權指數 ({period_opt})", value=f"{info['current']:,.0f}",
+                              delta=f"{info['change']:,.0f} ({info['change_pct']:.2f}%)", delta_color="inverse")
 
-                ma_html = "".join([f'<span style="color: {ma_colors[i]}; margin-right: 15px;">MA{mas[i]}: {cur_ma[mas[i]]:,.0f}</span>' for i in range(len(mas))])
+                ma_html = "".join(f'<span style="color: {color}; margin-right: 15px;">MA{ma}: {info["ma"][ma]:,.0f}</span>'
+                                  for ma, color in zip(ta_chart.MAS, ta_chart.MA_COLORS))
                 st.markdown(f'<div style="font-family: sans-serif; font-size: 14px; margin-bottom: 5px; padding: 10px; background: #f8f9fa; border-radius: 8px; font-weight: bold;">{ma_html}</div>', unsafe_allow_html=True)
-
-                fig = go.Figure()
-                fig.add_trace(go.Candlestick(x=df.index, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close'], name='K線', increasing_line_color='#dc3545', increasing_fillcolor='#dc3545', decreasing_line_color='#28a745', decreasing_fillcolor='#28a745'))
-                for ma, color in zip(mas, ma_colors):
-                    fig.add_trace(go.Scatter(x=df.index, y=df[f'MA{ma}'], mode='lines', name=f'MA{ma}', line=dict(color=color, width=1.2), hoverinfo='y'))
-
-                visible_points = 150
-                x_min = df.index[-visible_points] if len(df) > visible_points else df.index[0]
-                visible_df = df.iloc[-visible_points:]
-                y_min = float(visible_df['Low'].min())
-                y_max = float(visible_df['High'].max())
-                y_pad = (y_max - y_min) * 0.05
-                fig.update_layout(margin=dict(l=10, r=40, t=10, b=10), height=300, paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)", xaxis_rangeslider_visible=False, showlegend=False, xaxis=dict(showgrid=True, gridcolor='rgba(200,200,200,0.2)', range=[x_min, df.index[-1] + timedelta(days=5)], type="date"), yaxis=dict(showgrid=True, gridcolor='rgba(200,200,200,0.2)', side="right", tickformat=",", range=[y_min - y_pad, y_max + y_pad]), hovermode="x unified")
-                st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+                st.plotly_chart(ta_chart.load_figure(payload), use_container_width=True,
+                                config={'displayModeBar': False})
         except Exception as e:
             st.error(f"圖表載入失敗: {e}")
 
-# --- 8. 分析與繪圖組件 ---
-def calculate_rsi(series, period=14):
-    delta = series.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = np.where(loss == 0, np.inf, gain / loss)
-    return pd.Series(np.where(loss == 0, 100, 100 - (100 / (1 + rs))), index=series.index)
-
-def analyze_logic(cur_p, ma20, ma60, ma120, ma240, vol_ratio, rsi, strategy="short"):
-    if ma60 is None:
-        return "觀察", "tag-hold", 40, "資料不足", cur_p
-    bias_20 = ((cur_p - ma20) / ma20) * 100
-    if strategy == "short":
-        if cur_p > ma20 and bias_20 > BIAS_STRONG_PCT and vol_ratio > VOL_SURGE_THRESHOLD:
-            return "強力推薦", "tag-strong", 90, "站上月線且爆量攻擊", cur_p * SHORT_TARGET_MULT
-        return ("買進", "tag-buy", 70, "月線附近震盪", cur_p * SHORT_TARGET_MULT) if cur_p > ma20 else ("觀察", "tag-hold", 50, "月線附近震盪", cur_p * SHORT_TARGET_MULT)
-    elif strategy == "medium":
-        if ma120 and cur_p > ma120 and ma60 > ma120:
-            return "強力推薦", "tag-strong", 95, "中長多格局", cur_p * MEDIUM_TARGET_MULT
-        return "回檔佈局", "tag-buy", 80, "季線支撐", ma60
-    else:
-        if ma240 and abs((cur_p - ma240) / ma240) < NEAR_MA_RANGE:
-            return "長線買點", "tag-strong", 95, "年線價值區", ma240 * LONG_TARGET_MULT
-        return "長多續抱", "tag-buy", 80, "站穩年線", cur_p * LONG_TARGET_MULT
-
+# --- 8. 分析與繪圖組件（計算邏輯在 radar.py，這裡只加上快取）---
 @st.cache_data(ttl=3600)
 def fetch_fundamentals(ticker: str) -> dict:
     """抓取單一股票的基本面資料（每小時快取一次）"""
-    try:
-        info = yf.Ticker(ticker).info
-        def fmt(val, suffix="", decimals=2):
-            if val is None or val != val:  # None or NaN
-                return "N/A"
-            if isinstance(val, float):
-                return f"{val:.{decimals}f}{suffix}"
-            return f"{val}{suffix}"
-
-        # 營收年增率：用 trailingAnnualRevenue 和 revenueGrowth
-        rev_growth = info.get("revenueGrowth")
-        rev_str = f"{rev_growth*100:.1f}%" if rev_growth is not None else "N/A"
-
-        eps = info.get("trailingEps")
-        pe  = info.get("trailingPE")
-        pb  = info.get("priceToBook")
-        dy  = info.get("dividendYield")
-        mc  = info.get("marketCap")
-        gm  = info.get("grossMargins")
-        om  = info.get("operatingMargins")
-        eps_fwd = info.get("forwardEps")
-        pe_fwd  = info.get("forwardPE")
-
-        mc_str = "N/A"
-        if mc:
-            if mc >= 1e12:
-                mc_str = f"{mc/1e12:.2f}兆"
-            elif mc >= 1e8:
-                mc_str = f"{mc/1e8:.0f}億"
-            else:
-                mc_str = f"{mc:,.0f}"
+    return shared_call("fundamentals", 3600, radar.fetch_fundamentals, ticker)
 
-        return {
-            "EPS（近4季）":    fmt(eps, " 元"),
-            "EPS（預估）":     fmt(eps_fwd, " 元"),
-            "本益比（近4季）": fmt(pe, "x", 1),
-            "本益比（預估）":  fmt(pe_fwd, "x", 1),
-            "股價淨值比":      fmt(pb, "x", 2),
-            "殖利率":          f"{dy*100:.2f}%" if dy else "N/A",
-            "毛利率":          f"{gm*100:.1f}%" if gm else "N/A",
-            "營業利益率":      f"{om*100:.1f}%" if om else "N/A",
-            "營收年增率":      rev_str,
-            "市值":            mc_str,
-        }
-    except Exception as e:
-        print(f"[fetch_fundamentals] {ticker} 失敗: {e}")
-        return {}
+def download_panel(tickers: tuple):
+    return shared_call("panel", 300, radar.fetch_data, tickers, cache_if=nonempty_panel)
 
 @st.cache_data(ttl=300)
 def fetch_data(tickers: tuple):
-    if not tickers:
+    return download_panel(tickers)
+
+def universe_list():
+    """所有使用者共用的系統名單（0050 成分股 + 保底清單 + 百大熱門股），共用面板就是這份名單的日 K"""
+    return radar.build_watch_list(fetch_0050_constituents(), fetch_dynamic_hot_stocks())
+
+def load_universe(cache):
+    """universe_list 不經 st.cache_data 的版本（背景執行緒用）：成分股與上市櫃清單直接走共用快取"""
+    constituents = cached_call(cache, "constituents", 86400, radar.fetch_0050_constituents,
+                               cache_if=real_constituents)
+    listings = cached_call(cache, "listings", 1800, radar.fetch_market_listings)
+    return radar.build_watch_list(constituents, radar.fetch_dynamic_hot_stocks(listings))
+
+@st.cache_resource
+def get_extension_panel():
+    """系統名單以外的股票（自選）所有使用者共用一份，只下載還沒有的代號；共用快取以代號為單位存放，
+    各副本、各 session 的名單有重疊時只下載彼此沒有的那幾檔。
+    背景預抓也會呼叫 fetch，所以綁定已取好的共用快取，不經過 st.cache_*"""
+    fetch = functools.partial(shared_panel.cached_frames, get_shared_cache(), ttl=300)
+    return shared_panel.ExtensionPanel(fetch=fetch, ttl=300)
+
+def panel_view(tickers):
+    """fetch_data 的替代：任何名單都從共用面板取子集合，名單外的代號併入共用延伸集合，
+    不會因為每個人的名單不同而各自下載、各佔一個快取項目"""
+    panel = fetch_data(tuple(sorted(universe_list())))
+    return shared_panel.subset_frames(panel, get_extension_panel(), tickers)
+
+# 背景預抓所有使用者自選股的間隔（秒）；比延伸集合的 ttl 短，自選股的日 K 不會在使用者面前過期
+PREFETCH_SECONDS = 240
+
+@st.cache_resource
+def get_watchlist_prefetcher():
+    """整個程序只啟動一個：每 PREFETCH_SECONDS 秒批次預抓所有使用者的自選股（日 K 與基本面）
+
+    背景執行緒沒有 ScriptRunContext，交給它的都是未裝飾的載入函式：Sheets 連線與共用快取在這裡
+    （腳本執行緒）先取好，日 K 與基本面直接寫進共用快取，頁面上的 st.cache_data 沒命中時就從那裡拿。
+    """
+    cache = get_shared_cache()
+    return shared_panel.WatchlistPrefetcher(
+        get_extension_panel(), functools.partial(load_all_watchlist_tickers, get_gsheet_client()),
+        universe=functools.partial(load_universe, cache),
+        fundamentals_fn=functools.partial(cached_call, cache, "fundamentals", 3600, radar.fetch_fundamentals),
+        interval=PREFETCH_SECONDS).start()
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def resolve_symbol(query: str):
+    """代號 / 股名查詢，找到的結果所有使用者共用一天"""
+    return shared_call("symbol", 86400, radar.resolve_symbol, query)
+
+def process_display(stock_dict, strategy="short", top_n=None, filters=None, rs_reference=None):
+    keep = radar.make_row_filter(*filters) if filters else None
+    return radar.process_display(stock_dict, strategy, panel_view, fetch_fundamentals, top_n, keep, rs_reference)
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def ranked_rows(stock_items: tuple, strategy="short", top_n=None, filters=None):
+    """process_display 的結果依（名單, 策略, 篩選）快取，存活時間與 fetch_data 相同：
+    切回看過的 Tab 或其他使用者看同一份名單時直接取用，價格資料更新後自然失效"""
+    return process_display(dict(stock_items), strategy, top_n, filters)
+
+# 背景批次（snapshot.py）發佈的快照在這個秒數內都直接取用，超過就退回頁面自己算
+SNAPSHOT_MAX_AGE = 900
+
+@st.cache_resource(max_entries=4)
+def read_snapshot(path):
+    """快照檔名帶版本、內容不會再變，依路徑快取一份給所有使用者共用（唯讀）"""
+    return snapshot.read_snapshot(path)
+
+def latest_snapshot(universe):
+    path = snapshot.latest_path(universe, max_age=SNAPSHOT_MAX_AGE)
+    if path is None:
+        return None
+    try:
+        return read_snapshot(path)
+    except Exception as e:
+        print(f"[latest_snapshot] {path} 失敗: {e}")
         return None
-    return yf.download(list(tickers), period="2y", group_by='ticker', progress=False)
 
-def process_display(stock_dict, strategy="short"):
-    tickers = list(stock_dict.keys())
-    if not tickers:
-        return []
-    data = fetch_data(tuple(sorted(tickers)))
-    rows = []
+def snapshot_rows(strategy, stock_dict, top_n=None, filters=None):
+    """名單都在最新的 watch 快照裡時直接從快照取排行；有快照沒算到的股票（例如剛加的自選）回傳 None"""
+    snap = latest_snapshot("watch")
+    if snap is None or not snapshot.covers(snap, stock_dict):
+        return None
+    keep = radar.make_row_filter(*filters) if filters else None
+    return snapshot.select_rows(snap["strategies"][strategy], stock_dict, top_n, keep)
+
+def market_snapshot_rows(k, filters=None):
+    """全市場快照只存各策略前 top 名：篩選後仍湊得滿 k 名才與實際掃描結果相同，否則回傳 None"""
+    snap = latest_snapshot("market")
+    if snap is None:
+        return None
+    keep = radar.make_row_filter(*filters) if filters else None
+    result = {}
+    for s, rows in snap["strategies"].items():
+        picked = snapshot.select_rows(rows, None, k, keep)
+        if len(picked) < k and len(rows) >= snap["top"]:
+            return None
+        result[s] = picked
+    return result
+
+@st.cache_data(ttl=300, show_spinner="🌐 全市場掃描中（首次需下載歷史資料，之後讀本地倉庫）...")
+def scan_full_market(k, filters=None):
+    """全市場模式：三種策略各取前 k 名，一次掃描共用；有夠新的全市場快照時直接取用"""
+    published = market_snapshot_rows(k, filters)
+    if published is not None:
+        return published
+    listings = fetch_market_listings()
+    if not listings:
+        return None
+    keep = radar.make_row_filter(*filters) if filters else None
+    return market_scan.scan_market(listings, k=k, store=HistoryStore(), fundamentals_fn=fetch_fundamentals, keep=keep)
+
+# 盤中即時模式：所有使用者共用一份看板，報價來源最多每 LIVE_POLL_SECONDS 秒查一次
+LIVE_POLL_SECONDS = 10
+
+@st.cache_resource
+def get_live_board():
+    return live_quotes.LiveBoard(live_quotes.TwseMisSource(), min_interval=LIVE_POLL_SECONDS)
+
+def refresh_live(stock_dict):
+    """替還沒有狀態的股票用日 K 建立狀態，再輪詢一次即時報價（未到間隔時不會真的發請求）"""
+    board = get_live_board()
+    missing = board.missing(stock_dict)
+    if missing:
+        board.seed(panel_view(missing), missing)
+    board.refresh(list(stock_dict))
+    return board
+
+def live_display(stock_dict, strategy="short", top_n=None, filters=None, rs_reference=None):
+    """盤中模式的 process_display：指標取自只覆寫當天 K 棒的狀態"""
+    keep = radar.make_row_filter(*filters) if filters else None
+    return refresh_live(stock_dict).rank(stock_dict, strategy, fetch_fundamentals, top_n, keep, rs_reference)
+
+# 相關性分析：報酬視窗選項，以及逐檔熱力圖最多畫幾檔（再多只畫產業熱力圖）
+CORR_WINDOWS = {"60 日": 60, "120 日": 120, "240 日": 240}
+CORR_HEATMAP_MAX = 300
+
+def sector_map(tickers):
+    """{代號: 產業}，取自（已快取的）基本面；查不到的不放。
+    thread pool 裡不能碰 st.cache_data，改用綁定共用快取的未裝飾版本"""
+    plain = functools.partial(cached_call, get_shared_cache(), "fundamentals", 3600, radar.fetch_fundamentals)
+    fund = snapshot.prefetch_fundamentals(tickers, plain)
+    return {t: fund(t).get("產業") for t in tickers if fund(t).get("產業") not in (None, "N/A")}
+
+def correlation_of(tickers, window):
+    """名單的相關矩陣，價格取自共用面板，不另外下載"""
+    return correlation.compute(panel_view(tickers), tickers, sector_map(tickers), window)
+
+@st.cache_data(ttl=300, max_entries=8, show_spinner="📊 計算相關係數...")
+def universe_correlation(tickers: tuple, window: int):
+    """系統名單的相關矩陣所有使用者共用，存活時間與 fetch_data 相同：面板更新後自然失效"""
+    return correlation_of(tickers, window)
+
+def cached_sectors(tickers):
+    """{代號: 產業}，只看共用快取裡已經有的基本面，不發新的請求；查不到的不放"""
+    cache = get_shared_cache()
+    if cache is None:
+        return {}
+    sectors = {}
     for t in tickers:
-        try:
-            if isinstance(data.columns, pd.MultiIndex):
-                if t not in data.columns.get_level_values(0):
-                    continue
-                df = data[t]
-            else:
-                df = data
-
-            closes = df['Close'].dropna()
-            if len(closes) < 20:
-                continue
-            cur_p = closes.iloc[-1]
-            change = ((closes.iloc[-1] - closes.iloc[-2]) / closes.iloc[-2]) * 100
-            ma = [closes.rolling(window=m).mean().iloc[-1] for m in [20, 60, 120, 240]]
-            rsi = calculate_rsi(closes).iloc[-1]
-            vols = df['Volume'].dropna()
-            v_ratio = vols.iloc[-1] / vols.rolling(5).mean().iloc[-1] if len(vols) >= 5 else 1.0
-
-            rating, cls, score, reason, target = analyze_logic(cur_p, ma[0], ma[1], ma[2], ma[3], v_ratio, rsi, strategy)
-            hist_len = 60 if strategy == "short" else (120 if strategy == "medium" else 240)
-            trend_data = closes.iloc[-hist_len:].tolist()
-
-            fundamentals = fetch_fundamentals(t)
-            rows.append({
-                "code": t.split('.')[0], "name": stock_dict[t], "price": cur_p, "change": change,
-                "target": target, "rating": rating, "cls": cls, "reason": reason,
-                "trend": trend_data, "score": score,
-                "url": f"https://tw.stock.yahoo.com/quote/{t}",
-                "fundamentals": fundamentals,
-            })
-        except Exception as e:
-            print(f"[process_display] 處理 {t} 失敗: {e}")
-            continue
-    return sorted(rows, key=lambda x: x['score'], reverse=True)
-
-def render_table(rows, date_label):
-    html = f"""
-    <style>
-        table {{ width: 100%; border-collapse: collapse; font-family: sans-serif; font-size: 14px; }}
-        th {{ background: #f2f2f2; padding: 10px; text-align: left; position: sticky; top: 0; border-bottom: 2px solid #ddd; z-index: 10; }}
-        td {{ padding: 10px; border-bottom: 1px solid #eee; vertical-align: middle; }}
-        .up {{ color: #d62728; font-weight: bold; }} .down {{ color: #2ca02c; font-weight: bold; }}
-        .tag-strong {{ background: #ffebeb; color: #d62728; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
-        .tag-buy {{ background: #e6ffe6; color: #2ca02c; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
-        .tag-sell {{ background: #f1f3f5; color: #495057; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
-        .tag-hold {{ background: #fff; border: 1px solid #eee; color: #868e96; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
-        .tooltip-wrap {{ position: relative; display: inline-block; }}
-        .tooltip-box {{
-            display: none; position: fixed; z-index: 9999;
-            background: #1e2a3a; color: #f0f4f8;
-            padding: 12px 16px; border-radius: 10px;
-            font-size: 13px; line-height: 1.8;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.5);
-            min-width: 220px; pointer-events: none;
-            border: 1px solid #3a4f63;
-        }}
-        .tooltip-box table {{ background: transparent; width: 100%; font-size: 13px; }}
-        .tooltip-box td {{ padding: 2px 6px; border: none; color: #f0f4f8; }}
-        .tooltip-box td:first-child {{ color: #a0b4c8; white-space: nowrap; }}
-        .tooltip-box td:last-child {{ font-weight: bold; text-align: right; }}
-        .tooltip-title {{ font-size: 14px; font-weight: bold; color: #fff; margin-bottom: 6px; border-bottom: 1px solid #3a4f63; padding-bottom: 4px; }}
-    </style>
-    <div id="tt" class="tooltip-box"></div>
-    <script>
-    function bindTooltips() {{
-        var tt = document.getElementById("tt");
-        if (!tt) return;
-        document.querySelectorAll(".has-tip").forEach(function(el) {{
-            if (el._tipBound) return;
-            el._tipBound = true;
-            el.addEventListener("mouseenter", function(e) {{
-                tt.innerHTML = this.getAttribute("data-tip");
-                tt.style.display = "block";
-            }});
-            el.addEventListener("mousemove", function(e) {{
-                var x = e.clientX + 16;
-                var y = e.clientY + 8;
-                if (x + 220 > window.innerWidth) x = e.clientX - 236;
-                if (y + 260 > window.innerHeight) y = e.clientY - 270;
-                tt.style.left = x + "px";
-                tt.style.top  = y + "px";
-            }});
-            el.addEventListener("mouseleave", function() {{
-                tt.style.display = "none";
-            }});
-        }});
-    }}
-    // 確保 DOM 完全載入後才綁定
-    if (document.readyState === "loading") {{
-        document.addEventListener("DOMContentLoaded", bindTooltips);
-    }} else {{
-        bindTooltips();
-    }}
-    // 額外保險：用 MutationObserver 偵測動態插入的元素
-    var observer = new MutationObserver(function() {{ bindTooltips(); }});
-    observer.observe(document.body, {{ childList: true, subtree: true }});
-    </script>
-    <p style="font-family:sans-serif; font-size:12px; color:#888; margin:4px 0 8px;">
-        ⚠️ 以下評級與目標價為演算法估算，非投資建議，投資人應自行判斷。
-    </p>
-    <table>
-        <thead><tr><th>代號</th><th>股名</th><th>現價</th><th>漲跌</th><th>目標價({date_label})</th><th>AI評級</th><th>趨勢</th></tr></thead>
-        <tbody>
+        entry = cache.get_entry("fundamentals", (t,))
+        sector = (entry[0] or {}).get("產業") if entry is not None else None
+        if sector not in (None, "N/A"):
+            sectors[t] = sector
+    return sectors
+
+@st.cache_data(ttl=300, max_entries=3, show_spinner="📊 計算全市場相關係數（1,800 檔）...")
+def market_correlation(window: int):
+    """全市場的相關矩陣 → (結果, {代號: 股名})；所有使用者共用
+
+    日 K 取自本地歷史倉庫，indicator_table("market") 會先經下載排程器把過期的補齊（與全市場掃描共用）；
+    產業只用已快取的基本面，不為了相關性替 1,800 檔各發一個基本面請求，沒抓過的歸在「未分類」。
     """
-    for r in rows:
-        color = "up" if r['change'] > 0 else "down"
-        mn, mx = min(r['trend']), max(r['trend'])
-        if mx == mn:
-            spark = '<svg width="150" height="40"><line x1="0" y1="20" x2="150" y2="20" stroke="#aaa" stroke-width="2"/></svg>'
+    built = indicator_table("market")
+    if built is None:
+        return None
+    names = built[1]
+    store = HistoryStore()
+    frames = {}
+    for t in names:
+        df = store.load(t, float("inf"))
+        if df is not None:
+            frames[t] = df
+    return correlation.compute(frames, list(frames), cached_sectors(frames), window), names
+
+# 條件選股：範例條件（第一個是輸入框的預設值）
+SCREEN_EXAMPLES = ("close > ma60 and rsi < 30 and vol_ratio > 2",
+                   "close > ma20 > ma60 > ma120 and change > 3",
+                   "abs(close / ma240 - 1) < 0.05 and rsi < 50",
+                   "rs > 80 and close > ma60")
+SCREEN_SCOPES = {"系統名單": "watch", "全市場": "market"}
+STRATEGY_LABELS = {"short": "短線", "medium": "中線", "long": "長線"}
+
+@st.cache_resource(ttl=300, max_entries=3, show_spinner="🧪 建立指標表...")
+def indicator_table(universe: str):
+    """條件選股與評級變動用的指標表（一檔一列）→ (指標表, {代號: 股名})；沒有資料時回傳 None
+
+    所有使用者共用、唯讀，存活時間與 fetch_data 相同；用 cache_resource 不必每次重跑都複製整張表。
+    全市場的指標取自本地歷史倉庫（與全市場掃描相同），系統名單與所有人的自選（watchlist）取自共用面板。
+    """
+    if universe == "market":
+        listings = fetch_market_listings()
+        if not listings:
+            return None
+        names = {item[0]: item[1] for item in listings}
+        prepared = market_scan.market_indicators(listings, store=HistoryStore())
+    else:
+        if universe == "watchlist":
+            names = {t: t.split('.')[0] for t in load_all_watchlist_tickers()}
         else:
-            pts = " ".join([f"{(i / (len(r['trend']) - 1)) * 150},{40 - ((v - mn) / (mx - mn)) * 30 - 5}" for i, v in enumerate(r['trend'])])
-            spark = f'<svg width="150" height="40"><polyline points="{pts}" fill="none" stroke="{"#d62728" if r["trend"][-1] > r["trend"][0] else "#2ca02c"}" stroke-width="2"/></svg>'
+            names = universe_list()
+        frames = panel_view(list(names))
+        prepared = []
+        for t in names:
+            df = frames.get(t)
+            p = radar.frame_indicators(df) if df is not None else None
+            if p is not None:
+                prepared.append((t, p))
+    if not prepared:
+        return None
+    return screener.build_table(prepared), names
+
+def rs_reference():
+    """系統名單的加權報酬基準：自選股、個股圖的相對強度跟排行榜用同一把尺；沒有指標表時回傳 None（以名單自己為準）"""
+    built = indicator_table("watch")
+    return built[0]["rs_reference"] if built is not None else None
+
+@st.cache_resource
+def get_rating_book(universe: str):
+    """每個範圍一本評級帳本，所有使用者共用；狀態與變動紀錄落地在 RADAR_RATINGS_DIR"""
+    return rating_alerts.RatingBook(universe)
+
+def rating_book(universe):
+    """指標表換新（每 5 分鐘）時比對一次評級；同一張表重複呼叫不做事，每次重跑都可以呼叫"""
+    book = get_rating_book(universe)
+    built = indicator_table(universe)
+    if built is not None:
+        book.update(built[0])
+    return book
+
+def format_rating_event(e, names):
+    when = datetime.fromtimestamp(e["time"]).strftime("%m/%d %H:%M")
+    label = " ".join(filter(None, (e["ticker"].split('.')[0], names.get(e["ticker"]))))
+    return (f"{when}　**{label}**｜{STRATEGY_LABELS[e['strategy']]}："
+            f"{e['from']} → **{e['to']}**（{e['price']:,.2f}）")
+
+# --- 9. 系統 Tab 的伺服器端篩選 ---
+DEFAULT_TOP_N = 50
+CHANGE_SLIDER = (-10.0, 10.0)
+PRICE_SLIDER = (0, 3000)
+
+def _slider_bounds(selected, extremes):
+    """滑桿拉到兩端表示不限（漲跌停、超過上限的高價股不會被誤篩），兩端都沒動回傳 None"""
+    if tuple(selected) == tuple(extremes):
+        return None
+    lo = selected[0] if selected[0] > extremes[0] else float("-inf")
+    hi = selected[1] if selected[1] < extremes[1] else float("inf")
+    return (lo, hi)
+
+def render_filter_controls():
+    """系統 Tab 的顯示筆數與篩選條件；回傳 (top_n, filters)，filters 為 None 表示不篩選"""
+    with st.expander("🔎 篩選與顯示筆數（系統 Tab）", expanded=False):
+        f1, f2, f3, f4 = st.columns([1, 2, 2, 2])
+        with f1:
+            top_n = st.number_input("顯示前 N 名", min_value=10, max_value=500, value=DEFAULT_TOP_N, step=10)
+        with f2:
+            ratings = st.multiselect("AI 評級", radar.RATINGS, placeholder="全部評級")
+        with f3:
+            change_range = st.slider("漲跌幅 (%)", *CHANGE_SLIDER, value=CHANGE_SLIDER, step=0.5)
+        with f4:
+            price_range = st.slider("現價", *PRICE_SLIDER, value=PRICE_SLIDER, step=10)
+    filters = (tuple(ratings) or None, _slider_bounds(change_range, CHANGE_SLIDER), _slider_bounds(price_range, PRICE_SLIDER))
+    return int(top_n), (filters if any(filters) else None)
+
+# =====================================================================
+# --- 10. 可獨立重跑的頁面片段 ---
+# 每個區塊包成 st.fragment：區塊內的互動只重跑該區塊，不會連帶重畫大盤圖與其他表格。
+# 會影響其他區塊的動作（換暱稱、新增自選股）才用 st.rerun() 重跑整頁。
+# =====================================================================
+# 系統排行表自動刷新的間隔（秒）；與 fetch_data 的快取時間相同，盤中模式則跟著報價輪詢
+TABLE_REFRESH_SECONDS = 300
+
+@st.fragment
+def render_watchlist_form(current_user):
+    with st.form(key='add_form', clear_on_submit=True):
+        c1, c2 = st.columns([4, 1])
+        with c1:
+            query = st.text_input("新增自選股", placeholder="可輸入多筆代號，請用逗號分隔。例如: 2330, 8040, 6789")
+        with c2:
+            if st.form_submit_button("加入自選") and query:
+                if not current_user:
+                    st.error("❌ 請先在左側欄設定暱稱，才能儲存自選股。")
+                else:
+                    queries = [q.strip() for q in query.replace('，', ',').split(',') if q.strip()]
+                    has_new = False
+                    for q in queries:
+                        s, n, e = validate_and_add(q, st.session_state.custom_list, resolve_symbol)
+                        if s:
+                            st.session_state.custom_list[s] = n
+                            st.session_state.watch_list[s] = n
+                            st.session_state.last_added = s
+                            save_stock_to_sheet(current_user, s, n)  # 同步寫入雲端
+                            has_new = True
+                            st.success(f"✅ 已將 {n} 加入自選並儲存至雲端！")
+                        else:
+                            st.error(f"❌ {q}：{e}")
+                    if has_new:
+                        # 系統 Tab 的名單也變了，整頁重跑
+                        st.rerun()
 
-        # 建立浮動視窗的 HTML 內容
-        fund = r.get("fundamentals", {})
-        tip_rows = "".join([f"<tr><td>{k}</td><td>{v}</td></tr>" for k, v in fund.items()])
-        tip_html = f'''<div class="tooltip-title">{r["code"]} {r["name"]}</div><table>{tip_rows}</table>'''
-        tip_html = tip_html.replace('"', '&quot;')
-        html += f"<tr><td><a href='{r['url']}' target='_blank'>{r['code']}</a></td><td>{r['name']}</td><td class='{color}'>{r['price']:.1f}</td><td class='{color}'>{r['change']:.2f}%</td><td>{r['target']:.1f}</td><td><span class='{r['cls']} has-tip' data-tip='{tip_html}'>{r['rating']}</span><br><small>{r['reason']}</small></td><td>{spark}</td></tr>"
-    return html + "</tbody></table>"
+def render_system_table(strategy, date_label, top_n, filters, full_market, live_mode):
+    """單一策略的排行表；計時重跑時只重算這一張表"""
+    if full_market:
+        market_rows = scan_full_market(top_n, filters)
+        if market_rows is not None:
+            components.html(ranking_grid.render_cached(market_rows[strategy], date_label), height=800)
+            return
+        st.warning("⚠️ 無法取得上市櫃清單，改回系統預設名單。")
+    if live_mode:
+        polled_at = refresh_live(st.session_state.watch_list).polled_at
+        if polled_at:
+            st.caption(f"⚡ 盤中報價更新於 {datetime.fromtimestamp(polled_at).strftime('%H:%M:%S')}")
+        rows = live_display(st.session_state.watch_list, strategy, top_n, filters)
+    else:
+        rows = snapshot_rows(strategy, st.session_state.watch_list, top_n, filters)
+        if rows is None:
+            rows = ranked_rows(tuple(st.session_state.watch_list.items()), strategy, top_n, filters)
+    components.html(ranking_grid.render_cached(rows, date_label), height=800)
+
+def render_custom_tab(current_user, date_label, live_mode):
+    if not current_user:
+        st.info("💡 請先在左側欄輸入暱稱，才能使用雲端自選功能。")
+        return
+    if not st.session_state.custom_list:
+        st.info("💡 目前沒有自選股。請在上方輸入股票代碼（例如 2888, 8040），即可馬上加入！")
+        return
+    col_header, col_clear = st.columns([5, 1])
+    with col_header:
+        st.caption(f"👤 {current_user} 的自選清單｜共 {len(st.session_state.custom_list)} 支")
+    with col_clear:
+        if st.button("🗑️ 清空自選", help="清空我的自選清單（雲端同步刪除）", use_container_width=True):
+            delete_all_user_stocks(current_user)
+            st.session_state.custom_list = {}
+            st.success("已清空自選清單！")
+            st.rerun(scope="fragment")
+
+    # 個別刪除按鈕
+    with st.expander("✏️ 個別刪除股票", expanded=False):
+        cols = st.columns(4)
+        for i, (ticker, name) in enumerate(list(st.session_state.custom_list.items())):
+            with cols[i % 4]:
+                if st.button(f"✕ {ticker.split('.')[0]} {name}", key=f"del_{ticker}", use_container_width=True):
+                    delete_stock_from_sheet(current_user, ticker)
+                    del st.session_state.custom_list[ticker]
+                    st.rerun(scope="fragment")
+
+    render_watchlist_alerts(st.session_state.custom_list)
+
+    if live_mode:
+        rows = live_display(st.session_state.custom_list, "short", rs_reference=rs_reference())
+    else:
+        # 自選是共用面板的子集合，不再依每個人的名單另外快取
+        rows = snapshot_rows("short", st.session_state.custom_list)
+        if rows is None:
+            rows = process_display(st.session_state.custom_list, "short", rs_reference=rs_reference())
+    components.html(ranking_grid.render_cached(rows, date_label), height=800)
+
+def render_watchlist_alerts(custom_list):
+    """自選股的評級變動：所有人的自選聯集共用一本帳本，這裡只挑自己的；上次看過之後的新變動跳出提示"""
+    if not sheets_configured():
+        return
+    alerts = rating_book("watchlist").feed(tickers=custom_list, limit=20)
+    seen = st.session_state.get("alerts_seen_at")
+    fresh = [e for e in alerts if seen is not None and e["time"] > seen]
+    for e in fresh[:3]:
+        st.toast(f"🔔 {e['ticker'].split('.')[0]} {custom_list.get(e['ticker'], '')} "
+                 f"{STRATEGY_LABELS[e['strategy']]}：{e['from']} → {e['to']}")
+    st.session_state.alerts_seen_at = time.time()
+    with st.expander(f"🔔 我的評級變動（{len(alerts)}）", expanded=bool(fresh)):
+        if alerts:
+            st.markdown("\n".join(f"- {format_rating_event(e, custom_list)}" for e in alerts))
+        else:
+            st.caption("自選股的評級還沒有變動過。")
+
+@st.fragment
+def render_rating_feed(full_market):
+    """系統名單（全市場模式時為全市場）最近的評級變動"""
+    universe = "market" if full_market else "watch"
+    book = rating_book(universe)
+    built = indicator_table(universe)
+    names = built[1] if built is not None else {}
+    events = book.feed(limit=30)
+    with st.expander(f"🔔 最新評級變動（{'全市場' if full_market else '系統名單'}）", expanded=False):
+        if events:
+            st.markdown("\n".join(f"- {format_rating_event(e, names)}" for e in events))
+        else:
+            st.caption("目前還沒有評級變動，每次資料更新（約 5 分鐘）會比對一次。")
+
+@st.cache_resource(ttl=300, max_entries=64, show_spinner=False)
+def stock_figure(ticker, version, _df):
+    """個股 drill-down 圖依（代號, 資料版本）快取一份給所有人共用 → (圖的 JSON, 摘要)；建圖與大盤圖共用 ta_chart"""
+    df = ta_chart.add_mas(_df, rsi=True)
+    return ta_chart.build_figure(ta_chart.window(df), height=460).to_json(), ta_chart.summary(df)
+
+@st.fragment
+def render_drilldown():
+    """個股技術線圖：日 K 取自共用面板（名單外的才經延伸集合下載一次），指標與評級用同一份日 K 算，不另外連上游"""
+    names = {**universe_list(), **st.session_state.watch_list, **st.session_state.custom_list}
+    with st.expander("🔍 個股技術線圖", expanded=False):
+        c1, c2 = st.columns([3, 2])
+        with c1:
+            picked = st.selectbox("選擇股票", list(names), index=None, placeholder="名單內的股票",
+                                  format_func=lambda t: f"{t.split('.')[0]} {names[t]}", key="drill_pick")
+        with c2:
+            query = st.text_input("或輸入代號 / 股名", placeholder="例如: 2330、鴻海", key="drill_query")
+        ticker = picked
+        if query.strip():
+            ticker, name, err = validate_and_add(query, names, resolve=resolve_symbol)
+            if err:
+                st.error(f"❌ {err}")
+                return
+            names.setdefault(ticker, name)
+        if not ticker:
+            st.caption("選一檔股票看 K 線、MA5～MA240 與 RSI。")
+            return
+
+        df = panel_view([ticker]).get(ticker)
+        prepared = radar.frame_indicators(df) if df is not None else None
+        if prepared is None:
+            st.warning(f"⚠️ 取不到 {ticker} 的日 K。")
+            return
+        payload, info = stock_figure(ticker, ta_chart.data_version(df), df)
+        ind = prepared[1]
+        m = st.columns(7)
+        m[0].metric(f"{ticker.split('.')[0]} {names.get(ticker, '')}", f"{info['current']:,.2f}",
+                    delta=f"{info['change']:,.2f} ({info['change_pct']:.2f}%)", delta_color="inverse")
+        m[1].metric("RSI", f"{ind['rsi']:.1f}")
+        m[2].metric("量比", f"{ind['vol_ratio']:.2f}")
+        rs = relative_strength.rs_map([(ticker, prepared)], rs_reference())[ticker]
+        m[3].metric("RS", "-" if rs is None else rs, help="3/6/12 個月加權報酬在系統名單中的百分位（1～99）")
+        for col, s in zip(m[4:], STRATEGY_LABELS):
+            col.metric(f"{STRATEGY_LABELS[s]}評級", radar.rate_indicators(*prepared, s)["rating"])
+        st.plotly_chart(ta_chart.load_figure(payload), use_container_width=True, config={'displayModeBar': False})
+
+@st.fragment
+def render_correlation_tab(full_market=False):
+    """名單內（全市場模式預設為全市場）股票的報酬相關係數與產業熱力圖；切換範圍或視窗只重跑這一塊"""
+    import plotly.graph_objects as go
+    c1, c2 = st.columns([3, 2])
+    with c1:
+        scope = st.radio("範圍", ["系統名單", "我的自選", "全市場"], index=2 if full_market else 0,
+                         horizontal=True, key="corr_scope")
+    with c2:
+        window = CORR_WINDOWS[st.radio("報酬視窗", list(CORR_WINDOWS), index=1, horizontal=True, key="corr_window")]
+
+    if scope == "我的自選":
+        names = dict(st.session_state.custom_list)
+        if len(names) < 2:
+            st.info("💡 自選股至少要兩支才能計算相關性。")
+            return
+        # 自選清單只有幾十檔，直接算，不替每個人的名單另外快取
+        result = correlation_of(tuple(sorted(names)), window)
+    elif scope == "全市場":
+        built = market_correlation(window)
+        result, names = built if built is not None else (None, {})
+    else:
+        names = universe_list()
+        result = universe_correlation(tuple(sorted(names)), window)
+    if result is None:
+        st.warning("⚠️ 價格資料不足，無法計算相關係數。")
+        return
+
+    avg, pairs = correlation.concentration(result, result["tickers"])
+    m1, m2, m3 = st.columns(3)
+    m1.metric("股票數", len(result["tickers"]))
+    m2.metric("兩兩平均相關係數", f"{avg:.2f}")
+    m3.metric("資料日期", result["as_of"], help=f"最近 {result['days']} 個交易日的日報酬")
+    if scope == "全市場":
+        st.caption("全市場的產業只取已查過基本面的股票，其餘歸在「未分類」。")
+    if scope == "我的自選" and pairs:
+        st.markdown("**走勢最接近的組合**（相關係數越接近 1，漲跌越同步，分散效果越差）")
+        st.markdown("\n".join(
+            f"- {a.split('.')[0]} {names.get(a, '')} ↔ {b.split('.')[0]} {names.get(b, '')}：{c:.2f}" for a, b, c in pairs))
+
+    labels = [f"{s} ({n})" for s, n in zip(result["sector_names"], result["sector_counts"])]
+    fig = go.Figure(go.Heatmap(z=result["sector_corr"], x=labels, y=labels, zmin=-1, zmax=1,
+                               colorscale="RdBu_r", hovertemplate="%{y} × %{x}<br>平均相關 %{z:.2f}<extra></extra>"))
+    fig.update_layout(title="產業間平均相關係數", height=420, margin=dict(l=10, r=10, t=40, b=10))
+    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+
+    if len(result["tickers"]) <= CORR_HEATMAP_MAX:
+        ticks = [f"{t.split('.')[0]} {names.get(t, '')}" for t in result["tickers"]]
+        hover = [f"{t}｜{s}" for t, s in zip(ticks, result["sectors"])]
+        fig = go.Figure(go.Heatmap(z=result["corr"], x=hover, y=hover, zmin=-1, zmax=1, colorscale="RdBu_r",
+                                   hovertemplate="%{y}<br>%{x}<br>相關 %{z:.2f}<extra></extra>"))
+        fig.update_layout(title="個股相關係數（依產業排序）", height=700, margin=dict(l=10, r=10, t=40, b=10),
+                          xaxis=dict(showticklabels=False), yaxis=dict(showticklabels=False, autorange="reversed"))
+        st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+    else:
+        st.caption(f"股票數超過 {CORR_HEATMAP_MAX} 檔，只顯示產業熱力圖。")
+
+@st.fragment
+def render_screen_tab(date_label, top_n):
+    """使用者自訂條件選股：條件編譯一次（依文字快取），對整張指標表向量化篩選，入選的再依策略評分排序"""
+    c1, c2, c3 = st.columns([6, 2, 2])
+    with c1:
+        expr = st.text_input("篩選條件", value=SCREEN_EXAMPLES[0], key="screen_expr",
+                             help="可用指標：" + "、".join(screener.VARIABLES) +
+                                  "；可用 and / or / not、比較、加減乘除與 abs / min / max")
+    with c2:
+        scope = st.radio("範圍", list(SCREEN_SCOPES), horizontal=True, key="screen_scope")
+    with c3:
+        strategy = st.radio("排序依據", list(STRATEGY_LABELS), format_func=STRATEGY_LABELS.get,
+                            horizontal=True, key="screen_strategy")
+    st.caption("範例：" + "｜".join(f"`{e}`" for e in SCREEN_EXAMPLES))
+
+    built = indicator_table(SCREEN_SCOPES[scope])
+    if built is None:
+        st.warning("⚠️ 無法取得價格資料，請稍後再試。")
+        return
+    table, names = built
+    start = time.perf_counter()
+    try:
+        matched = screener.screen(table, expr)
+    except screener.ScreenError as e:
+        st.error(f"❌ {e}")
+        return
+    elapsed = (time.perf_counter() - start) * 1000
+    st.caption(f"符合 {len(matched):,} / {len(table['tickers']):,} 檔（篩選 {elapsed:.1f} ms），依分數顯示前 {top_n} 名")
+    if not matched:
+        st.info("💡 沒有符合條件的股票。")
+        return
+    # 相對強度以整張表為基準，不是只在入選的股票之間比
+    prepared = [(t, table["prepared"][t]) for t in matched]
+    rated = radar.rate_prepared(prepared, strategy, rs=relative_strength.rs_map(prepared, table["rs_reference"]))
+    rows = radar.rank_rated(names, rated, fetch_fundamentals, top_n)
+    components.html(ranking_grid.render_cached(rows, date_label), height=800)
 
 # =====================================================================
 # --- 主介面佈局 ---
@@ -585,7 +824,14 @@ def render_table(rows, date_label):
 st.title("🚀 台股 AI 趨勢雷達")
 
 # 側邊欄使用者登入（必須在所有其他 UI 之前呼叫）
-current_user = render_user_login()
+with st.sidebar:
+    current_user = render_user_login()
+
+if sheets_configured():
+    get_watchlist_prefetcher()
+
+if download_scheduler.SCHEDULER.breaker.blocked():
+    st.warning("⚠️ Yahoo 暫時無法連線（連續下載失敗），先顯示最後一次取得的資料，稍後會自動恢復。")
 
 render_taiex_ta_chart()
 st.markdown("---")
@@ -593,95 +839,57 @@ st.markdown("---")
 with st.container():
     col_form, col_btn = st.columns([4, 1])
     with col_form:
-        with st.form(key='add_form', clear_on_submit=True):
-            c1, c2 = st.columns([4, 1])
-            with c1:
-                query = st.text_input("新增自選股", placeholder="可輸入多筆代號，請用逗號分隔。例如: 2330, 8040, 6789")
-            with c2:
-                if st.form_submit_button("加入自選") and query:
-                    if not current_user:
-                        st.error("❌ 請先在左側欄設定暱稱，才能儲存自選股。")
-                    else:
-                        queries = [q.strip() for q in query.replace('，', ',').split(',') if q.strip()]
-                        has_new = False
-                        for q in queries:
-                            s, n, e = validate_and_add(q)
-                            if s:
-                                st.session_state.custom_list[s] = n
-                                st.session_state.watch_list[s] = n
-                                st.session_state.last_added = s
-                                save_stock_to_sheet(current_user, s, n)  # 同步寫入雲端
-                                has_new = True
-                                st.success(f"✅ 已將 {n} 加入自選並儲存至雲端！")
-                            else:
-                                st.error(f"❌ {q}：{e}")
-                        if has_new:
-                            st.rerun()
+        render_watchlist_form(current_user)
 
     with col_btn:
         with st.container():
             if st.button("🔄 刷新大盤熱門股", help="更新前三個 Tab 的百大熱門名單", use_container_width=True):
-                fetch_dynamic_hot_stocks.clear()
+                fetch_market_listings.clear()
                 new_hot = fetch_dynamic_hot_stocks()
+                # 合併 0050 成分股 + 百大熱門股 + 自選股
+                st.session_state.watch_list = radar.build_watch_list(
+                    fetch_0050_constituents(), new_hot, st.session_state.custom_list)
                 if new_hot:
-                    # 合併 0050 成分股 + 百大熱門股 + 自選股
-                    new_watch = {c: n for c, n in fetch_0050_constituents() + MEGA_STOCKS[50:]}
-                    new_watch.update({c: n for c, n in new_hot})
-                    new_watch.update(st.session_state.custom_list)
-                    st.session_state.watch_list = new_watch
-                    st.success(f"✅ 已更新！共 {len(new_watch)} 支（0050 成分股 + 百大熱門股）")
+                    st.success(f"✅ 已更新！共 {len(st.session_state.watch_list)} 支（0050 成分股 + 百大熱門股）")
                 else:
-                    base_system = {c: n for c, n in fetch_0050_constituents() + MEGA_STOCKS[50:]}
-                    base_system.update(st.session_state.custom_list)
-                    st.session_state.watch_list = base_system
                     st.warning("⚠️ 網路阻擋，維持現有 0050 與保底清單。")
                 st.rerun()
+            full_market = st.toggle("🌐 全市場模式", help="掃描上市櫃全部個股，系統 Tab 只顯示各策略前 N 名")
+            live_mode = st.toggle("⚡ 盤中即時", help=f"每 {LIVE_POLL_SECONDS} 秒批次查詢證交所即時報價，只更新當天的 K 棒")
 
-# 分頁顯示
-t1, t2, t3, t4 = st.tabs(["🚀 短線飆股 (系統)", "🌊 中線波段 (系統)", "📅 長線價值 (系統)", "⭐ 我的自選"])
+top_n, filters = render_filter_controls()
+render_rating_feed(full_market)
+render_drilldown()
+
+# 分頁顯示；切換 Tab 會重跑，只計算目前打開的那一頁（.open）
+t1, t2, t3, t4, t5, t6 = st.tabs(["🚀 短線飆股 (系統)", "🌊 中線波段 (系統)", "📅 長線價值 (系統)", "⭐ 我的自選",
+                                  "📊 相關性分析", "🧪 條件選股"], key="main_tab", on_change="rerun")
 
 d1 = (datetime.now() + timedelta(days=30)).strftime("%m/%d")
 d2 = (datetime.now() + timedelta(days=180)).strftime("%m/%d")
 d3 = (datetime.now() + timedelta(days=365)).strftime("%m/%d")
 
-with t1:
-    rows = process_display(st.session_state.watch_list, "short")
-    components.html(render_table(rows, d1), height=800, scrolling=True)
-with t2:
-    rows = process_display(st.session_state.watch_list, "medium")
-    components.html(render_table(rows, d2), height=800, scrolling=True)
-with t3:
-    rows = process_display(st.session_state.watch_list, "long")
-    components.html(render_table(rows, d3), height=800, scrolling=True)
-
-with t4:
-    if not current_user:
-        st.info("💡 請先在左側欄輸入暱稱，才能使用雲端自選功能。")
-    elif not st.session_state.custom_list:
-        st.info("💡 目前沒有自選股。請在上方輸入股票代碼（例如 2888, 8040），即可馬上加入！")
-    else:
-        col_header, col_clear = st.columns([5, 1])
-        with col_header:
-            st.caption(f"👤 {current_user} 的自選清單｜共 {len(st.session_state.custom_list)} 支")
-        with col_clear:
-            if st.button("🗑️ 清空自選", help="清空我的自選清單（雲端同步刪除）", use_container_width=True):
-                delete_all_user_stocks(current_user)
-                st.session_state.custom_list = {}
-                st.success("已清空自選清單！")
-                st.rerun()
+# 排行表依模式決定自動刷新的間隔；st.fragment 每次整頁執行時重新套用
+refresh_every = LIVE_POLL_SECONDS if live_mode else TABLE_REFRESH_SECONDS
+system_table = st.fragment(render_system_table, run_every=refresh_every)
+custom_tab = st.fragment(render_custom_tab, run_every=refresh_every)
 
-        # 個別刪除按鈕
-        with st.expander("✏️ 個別刪除股票", expanded=False):
-            cols = st.columns(4)
-            for i, (ticker, name) in enumerate(list(st.session_state.custom_list.items())):
-                with cols[i % 4]:
-                    if st.button(f"✕ {ticker.split('.')[0]} {name}", key=f"del_{ticker}", use_container_width=True):
-                        delete_stock_from_sheet(current_user, ticker)
-                        del st.session_state.custom_list[ticker]
-                        st.rerun()
+for tab, strategy, date_label in ((t1, "short", d1), (t2, "medium", d2), (t3, "long", d3)):
+    if tab.open:
+        with tab:
+            system_table(strategy, date_label, top_n, filters, full_market, live_mode)
+
+if t4.open:
+    with t4:
+        custom_tab(current_user, d1, live_mode)
+
+if t5.open:
+    with t5:
+        render_correlation_tab(full_market)
 
-        rows = process_display(st.session_state.custom_list, "short")
-        components.html(render_table(rows, d1), height=800, scrolling=True)
+if t6.open:
+    with t6:
+        render_screen_tab(d1, top_n)
 
 
 
@@ -0,0 +1,217 @@
+"""三種策略的歷史回測：把 analyze_logic 的規則套在「每一天 × 每一檔」的價格陣列上。
+
+不逐日逐檔呼叫 analyze_logic，而是把整個價格面板轉成 (日期, 股票) 的 numpy 陣列，
+MA 用累加和一次算完、評級用 radar.analyze_vectorized 一次判完；往後看的觀察期
+只對「第幾天」迴圈，每一圈都是一整塊股票的陣列運算。
+
+對每個訊號（某天某檔得到某評級）統計：
+- 命中：觀察期內是否碰到目標價（目標價高於進場價看最高價，低於進場價看最低價）
+- 到價天數：第幾個交易日碰到
+- 回撤：碰到目標價之前（沒碰到就是整段觀察期）最低價相對進場收盤的跌幅
+- 報酬：到價以目標價出場、沒到價以觀察期最後一天收盤出場的報酬率
+
+用法：
+    python backtest.py --store .cache/history
+    python backtest.py --synthetic 1000 --years 5 --out backtest.csv
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import radar
+
+# 觀察期（交易日），對應頁面上目標價的日期：30 天 / 180 天 / 365 天
+HORIZONS = {"short": 21, "medium": 126, "long": 250}
+# 往後看的迴圈一次處理幾檔
+SCAN_BLOCK = 64
+
+
+def panel_arrays(panel):
+    """(ticker, field) 欄位的 DataFrame → (日期, 代號, {field: (T, N) 陣列})
+
+    停牌日以前一天價格補上、成交量補 0；上市前的 NaN 保留，之後 MA 不足自然不會產生訊號。
+    """
+    tickers = list(dict.fromkeys(panel.columns.get_level_values(0)))
+    arrays = {}
+    for field in ("Close", "High", "Low", "Volume"):
+        frame = panel.xs(field, axis=1, level=1).reindex(columns=tickers)
+        frame = frame.fillna(0) if field == "Volume" else frame.ffill()
+        arrays[field] = frame.to_numpy(dtype=np.float64)
+    return panel.index, tickers, arrays
+
+
+def rolling_mean(x, window):
+    """沿時間軸的移動平均（累加和相減），視窗內有 NaN 時結果為 NaN，與 rolling(window).mean() 相同"""
+    valid = ~np.isnan(x)
+    cs = np.zeros((x.shape[0] + 1,) + x.shape[1:])
+    cn = np.zeros_like(cs)
+    np.cumsum(np.where(valid, x, 0.0), axis=0, out=cs[1:])
+    np.cumsum(valid, axis=0, out=cn[1:])
+    out = np.full(x.shape, np.nan)
+    if x.shape[0] >= window:
+        sums = cs[window:] - cs[:-window]
+        counts = cn[window:] - cn[:-window]
+        out[window - 1:] = np.where(counts == window, sums / window, np.nan)
+    return out
+
+
+def indicator_arrays(arrays):
+    """analyze_logic 需要的指標，整個面板一次算完；RSI 規則沒用到所以不算"""
+    close, volume = arrays["Close"], arrays["Volume"]
+    ind = {"price": close}
+    for m in (20, 60, 120, 240):
+        ind[f"ma{m}"] = rolling_mean(close, m)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ind["vol_ratio"] = volume / rolling_mean(volume, 5)
+    return ind
+
+
+def _required_ma(strategy):
+    return {"short": ("ma20",), "medium": ("ma60", "ma120"), "long": ("ma240",)}[strategy]
+
+
+def _forward_scan(high, low, hi_thr, lo_thr, horizon):
+    """往後看 horizon 天：回傳 (到價天數，0 表示沒到, 到價前的最低價)"""
+    n_days = hi_thr.shape[0]
+    days = np.zeros(hi_thr.shape, dtype=np.int16)
+    pending = np.ones(hi_thr.shape, dtype=bool)
+    reached = np.empty(hi_thr.shape, dtype=bool)
+    below = np.empty(hi_thr.shape, dtype=bool)
+    run_low = np.full(hi_thr.shape, np.inf, dtype=low.dtype)
+    worst_low = np.full(hi_thr.shape, np.inf, dtype=low.dtype)
+    for h in range(1, horizon + 1):
+        fut_high, fut_low = high[h:h + n_days], low[h:h + n_days]
+        np.minimum(run_low, fut_low, out=run_low)
+        np.greater_equal(fut_high, hi_thr, out=reached)
+        np.less_equal(fut_low, lo_thr, out=below)
+        reached |= below
+        reached &= pending
+        np.copyto(days, h, where=reached)
+        # 到價當天之前（含當天）的最低價都算進回撤
+        np.copyto(worst_low, run_low, where=reached)
+        pending ^= reached
+    np.copyto(worst_low, run_low, where=pending)
+    return days, worst_low
+
+
+def evaluate_strategy(arrays, ind, strategy, params=None, horizon=None):
+    """回傳每個訊號的結果陣列（只含觀察期完整的日期）：code, hit, days, drawdown, return, valid，形狀 (T - H, N)"""
+    horizon = horizon or HORIZONS[strategy]
+    close, high, low = arrays["Close"], arrays["High"], arrays["Low"]
+    n_days = close.shape[0] - horizon
+    if n_days <= 0:
+        raise ValueError(f"歷史資料只有 {close.shape[0]} 天，不足 {strategy} 的觀察期 {horizon} 天")
+
+    code, target = radar.analyze_vectorized(
+        ind["price"], ind["ma20"], ind["ma60"], ind["ma120"], ind["ma240"], ind["vol_ratio"], strategy, params)
+    code, target, entry = code[:n_days], target[:n_days], close[:n_days]
+    valid = ~np.isnan(entry) & ~np.isnan(target)
+    for name in _required_ma(strategy):
+        valid &= ~np.isnan(ind[name][:n_days])
+    # 目標價高於進場價看最高價、低於進場價看最低價；拆成兩個門檻，迴圈內就不必再判斷方向
+    upward = target >= entry
+    hi_thr = np.where(upward, target, np.inf).astype(np.float32)
+    lo_thr = np.where(upward, -np.inf, target).astype(np.float32)
+
+    # 往後看的迴圈是瓶頸：價格轉 float32、按股票切成小塊，讓每塊都留在 CPU cache 裡
+    days = np.empty(entry.shape, dtype=np.int16)
+    worst_low = np.empty(entry.shape, dtype=np.float32)
+    for j in range(0, entry.shape[1], SCAN_BLOCK):
+        cols = slice(j, j + SCAN_BLOCK)
+        days[:, cols], worst_low[:, cols] = _forward_scan(
+            np.ascontiguousarray(high[:, cols], dtype=np.float32),
+            np.ascontiguousarray(low[:, cols], dtype=np.float32),
+            np.ascontiguousarray(hi_thr[:, cols]), np.ascontiguousarray(lo_thr[:, cols]), horizon)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown = np.minimum(worst_low / entry - 1, 0.0)
+        # 到價就以目標價出場，沒到價就以觀察期最後一天收盤出場
+        exit_price = np.where(days > 0, target, close[horizon:horizon + n_days])
+        ret = exit_price / entry - 1
+    return {"code": code, "hit": days > 0, "days": days, "drawdown": drawdown, "return": ret, "valid": valid}
+
+
+def summarize(result, strategy):
+    """依評級彙總成一張表"""
+    rows = []
+    valid = result["valid"]
+    for idx, (rating, _, score) in enumerate(radar.VECTOR_RATINGS[strategy]):
+        mask = valid & (result["code"] == idx)
+        signals = int(mask.sum())
+        hits = mask & result["hit"]
+        hit_days = result["days"][hits]
+        dd = result["drawdown"][mask]
+        ret = result["return"][mask]
+        rows.append({
+            "strategy": strategy, "rating": rating, "score": score, "signals": signals,
+            "hit_rate": float(hits.sum() / signals) if signals else np.nan,
+            "avg_days_to_target": float(hit_days.mean()) if hit_days.size else np.nan,
+            "median_days_to_target": float(np.median(hit_days)) if hit_days.size else np.nan,
+            "avg_drawdown": float(dd.mean()) if signals else np.nan,
+            "p95_drawdown": float(np.quantile(dd, 0.05)) if signals else np.nan,
+            "avg_return": float(ret.mean()) if signals else np.nan,
+        })
+    return rows
+
+
+def backtest_arrays(arrays, ind, strategies=("short", "medium", "long"), params=None):
+    """已轉好的陣列跑回測，回傳每個評級一個 dict；參數掃描重複呼叫這一段，指標只算一次"""
+    rows = []
+    for strategy in strategies:
+        rows.extend(summarize(evaluate_strategy(arrays, ind, strategy, params), strategy))
+    return rows
+
+
+def run_backtest(panel, strategies=("short", "medium", "long"), params=None):
+    """整個面板跑三種策略，回傳每個評級一列的 DataFrame"""
+    _, _, arrays = panel_arrays(panel)
+    ind = indicator_arrays(arrays)
+    return pd.DataFrame(backtest_arrays(arrays, ind, strategies, params))
+
+
+def add_source_args(parser):
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--store", help="HistoryStore 目錄（讀全部已存的股票）")
+    source.add_argument("--synthetic", type=int, default=1000, help="改用 N 檔合成資料")
+    parser.add_argument("--years", type=float, default=5, help="合成資料的年數")
+
+
+def load_panel(args):
+    """依 add_source_args 的參數讀歷史倉庫或產生合成資料"""
+    if args.store:
+        from history_store import HistoryStore
+        panel = HistoryStore(args.store).load_panel()
+        if panel is None:
+            raise SystemExit(f"歷史倉庫 {args.store} 沒有資料")
+        return panel
+    from bench.fixtures import TRADING_DAYS_PER_YEAR, synthetic_panel, synthetic_universe
+    tickers = [c for c, _ in synthetic_universe(args.synthetic)]
+    return synthetic_panel(tickers, days=int(args.years * TRADING_DAYS_PER_YEAR))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="analyze_logic 三種策略的向量化歷史回測")
+    add_source_args(parser)
+    parser.add_argument("--out", help="另存 CSV")
+    args = parser.parse_args(argv)
+
+    panel = load_panel(args)
+    start = time.perf_counter()
+    report = run_backtest(panel)
+    elapsed = time.perf_counter() - start
+    n_days, n_tickers = panel.shape[0], panel.columns.get_level_values(0).nunique()
+
+    with pd.option_context("display.width", 160, "display.max_columns", 20):
+        print(report.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    print(f"[backtest] {n_tickers} 檔 × {n_days} 天，耗時 {elapsed:.2f} 秒")
+    if args.out:
+        report.to_csv(args.out, index=False, encoding="utf-8-sig")
+        print(f"[backtest] 已寫入 {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
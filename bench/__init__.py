@@ -0,0 +1 @@
+"""離線效能基準、壓測與共用的假資料。"""
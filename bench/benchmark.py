@@ -0,0 +1,169 @@
+"""離線效能基準：不連 Yahoo / TWSE / Google，量測核心函式的端到端耗時。
+
+用法：
+    python -m bench.benchmark                          # 100 / 1000 / 2000 檔
+    python -m bench.benchmark --sizes 100 --repeat 5
+    python -m bench.benchmark --baseline bench/baseline.json --tolerance 0.25
+
+結果寫成 JSON（預設 bench/results/latest.json）；給 --baseline 時若任何案例
+比基準慢超過 tolerance，結束碼為 1，可直接接在部署前的檢查流程。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import correlation
+import radar
+import ranking_grid
+import relative_strength
+import ta_chart
+from bench.fixtures import OfflineMarket, offline_upstreams, synthetic_info, synthetic_ohlcv, synthetic_universe
+
+DEFAULT_SIZES = (100, 1000, 2000)
+DEFAULT_OUT = os.path.join("bench", "results", "latest.json")
+
+
+def timed(fn, repeat):
+    """執行 repeat 次，回傳 (每次秒數 list, 最後一次回傳值)"""
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return samples, result
+
+
+def _validate_queries(universe):
+    """涵蓋 validate_and_add 各條路徑：保底代號、保底中文名、Yahoo 搜尋、純數字探測、查無此股"""
+    local_code = radar.MEGA_STOCKS[0][0].split('.')[0]
+    local_name = radar.MEGA_STOCKS[1][1]
+    synthetic = [c for c, _ in universe if c.split('.')[0] not in radar.LOCAL_DICT]
+    queries = [local_code, local_name, "9999"]
+    names = dict(universe)
+    queries += [t.split('.')[0] for t in synthetic[:5]]
+    queries += [names[t] for t in synthetic[5:10]]
+    return queries
+
+
+def run_size(n, repeat):
+    universe = synthetic_universe(n)
+    stock_dict = dict(universe)
+    market = OfflineMarket(universe)
+    results = []
+
+    def record(case, samples, **extra):
+        results.append({
+            "case": case, "tickers": n, "repeat": len(samples),
+            "median_s": statistics.median(samples), "min_s": min(samples), "max_s": max(samples),
+            **extra,
+        })
+
+    with offline_upstreams(market):
+        panel = radar.fetch_data(tuple(sorted(stock_dict)))
+        closes = {t: panel[t]['Close'].dropna() for t in stock_dict}
+
+        samples, _ = timed(lambda: [radar.calculate_rsi(s) for s in closes.values()], repeat)
+        record("calculate_rsi", samples)
+
+        inputs = []
+        for s in closes.values():
+            ma = [s.rolling(window=m).mean().iloc[-1] for m in [20, 60, 120, 240]]
+            inputs.append((s.iloc[-1], *ma, 1.5, 50.0))
+
+        def analyze_all():
+            return [radar.analyze_logic(*args, strategy) for args in inputs for strategy in ("short", "medium", "long")]
+        samples, _ = timed(analyze_all, repeat)
+        record("analyze_logic", samples, calls=len(inputs) * 3)
+
+        for strategy in ("short", "medium", "long"):
+            samples, rows = timed(lambda: radar.process_display(stock_dict, strategy), repeat)
+            record(f"process_display[{strategy}]", samples, rows=len(rows))
+            samples, html = timed(lambda: radar.render_table(rows, "01/01"), repeat)
+            record(f"render_table[{strategy}]", samples, bytes=len(html.encode("utf-8")))
+            samples, html = timed(lambda: ranking_grid.render_grid(rows, "01/01"), repeat)
+            record(f"render_grid[{strategy}]", samples, bytes=len(html.encode("utf-8")))
+
+        # 相對強度：整個股票池一次向量化排名
+        prepared = [(t, radar.frame_indicators(panel[t])) for t in stock_dict]
+        samples, rs = timed(lambda: relative_strength.rs_map(prepared), repeat)
+        record("relative_strength", samples, ranked=sum(v is not None for v in rs.values()))
+
+        sectors = {t: synthetic_info(t)["sector"] for t in stock_dict}
+        samples, corr = timed(lambda: correlation.compute(panel, list(stock_dict), sectors), repeat)
+        record("correlation", samples, matrix=len(corr["tickers"]) if corr else 0)
+
+        # 大盤圖與股票池大小無關：量開窗 / 抽稀後的建圖時間與送給瀏覽器的 JSON 大小
+        taiex = ta_chart.add_mas(synthetic_ohlcv("^TWII"))
+        for label, bars in ta_chart.HISTORY_OPTIONS.items():
+            samples, fig = timed(lambda: ta_chart.build_figure(ta_chart.window(taiex, bars)), repeat)
+            record(f"ta_chart[{label}]", samples, bytes=len(fig.to_json()))
+
+        queries = _validate_queries(universe)
+        samples, _ = timed(lambda: [radar.validate_and_add(q, {}) for q in queries], repeat)
+        record("validate_and_add", samples, queries=len(queries))
+
+    for r in results:
+        r["upstream_calls"] = dict(market.calls)
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    """回傳比基準慢超過 tolerance 的案例"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["case"], r["tickers"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get((r["case"], r["tickers"]))
+        if base and r["median_s"] > base["median_s"] * (1 + tolerance):
+            regressions.append({**r, "baseline_median_s": base["median_s"]})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線效能基準（合成 OHLCV + 本地上游替身）")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--baseline", help="要比較的先前結果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允許的變慢比例（0.25 = 25%%）")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n in args.sizes:
+        print(f"[benchmark] {n} 檔 ...", flush=True)
+        for r in run_size(n, args.repeat):
+            print(f"  {r['case']:<28} {r['median_s'] * 1000:10.1f} ms")
+            results.append(r)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[benchmark] 結果已寫入 {args.out}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for r in regressions:
+            print(f"[benchmark] 變慢：{r['case']} ({r['tickers']} 檔) "
+                  f"{r['baseline_median_s'] * 1000:.1f} → {r['median_s'] * 1000:.1f} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""冷啟動量測：app 頂層 import 的耗時，以及離線狀態下第一次執行整頁的耗時。
+
+import 時間用 python -X importtime 在乾淨的子程序裡量，依頂層套件彙總；
+第一次執行則在另一個子程序裡用 streamlit AppTest 跑 app.py（上游全部導向 bench.fixtures，
+快取、歷史資料、快照目錄都是空的暫存目錄），跑完檢查沒登入時 gspread / google-auth 沒被載入。
+
+用法：
+    python -m bench.coldstart                      # 預算：import 2500 ms、第一次執行 15000 ms
+    python -m bench.coldstart --budget-ms 2000 --run-budget-ms 10000
+    python -m bench.coldstart --budget-ms 0        # 0 表示不檢查該項預算
+
+超過預算或載入了不該載入的模組時結束碼為 1。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py 頂層實際 import 的模組
+APP_IMPORTS = ("streamlit", "streamlit.components.v1", "radar", "market_scan", "live_quotes",
+               "snapshot", "shared_cache", "shared_panel", "ranking_grid", "correlation", "screener",
+               "download_scheduler", "rating_alerts", "relative_strength", "ta_chart",
+               "history_store")
+# 應該延後到用到才載入的模組：除了 streamlit 自己會帶進來的（plotly），頂層 import 一律不該出現
+DEFERRED = ("yfinance", "plotly", "gspread", "google.oauth2")
+# 預設預算（毫秒）：頂層 import 總耗時、離線第一次執行整頁
+IMPORT_BUDGET_MS = 2500
+RUN_BUDGET_MS = 15000
+# 沒登入的第一次執行也不該出現（大盤圖會用到 plotly / yfinance，所以不在這裡）
+PERSISTENCE = ("gspread", "google.oauth2")
+
+
+def parse_importtime(stderr):
+    """-X importtime 的輸出 → {頂層模組: 累計毫秒}"""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):  # 縮排的是被別人帶進來的子模組，已算在上層的累計裡
+            continue
+        totals[name.strip()] = totals.get(name.strip(), 0) + int(cumulative) / 1000
+    return totals
+
+
+def import_times(modules=APP_IMPORTS):
+    """在新的子程序裡 import modules，回傳 ({頂層模組: 毫秒}, 載入過的 DEFERRED 模組)"""
+    code = f"import sys\nimport {', '.join(modules)}\n" \
+           f"print(','.join(m for m in {DEFERRED!r} if m in sys.modules))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return parse_importtime(proc.stderr), loaded
+
+
+def first_run(size):
+    """在子程序裡離線跑一次 app.py，回傳子程序印出的結果"""
+    proc = subprocess.run([sys.executable, "-m", "bench.coldstart", "--child", "--size", str(size)],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def child(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["RADAR_HISTORY_DIR"] = os.path.join(tmp, "history")
+        os.environ["RADAR_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshots")
+        os.environ["RADAR_RATINGS_DIR"] = os.path.join(tmp, "ratings")
+        os.environ["RADAR_CACHE_URL"] = "sqlite:///" + os.path.join(tmp, "shared.sqlite")
+        sys.path.insert(0, ROOT)
+        from streamlit.testing.v1 import AppTest
+        from bench.fixtures import OfflineMarket, offline_upstreams, synthetic_universe
+
+        market = OfflineMarket(synthetic_universe(size))
+        with offline_upstreams(market):
+            at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+            start = time.perf_counter()
+            at.run()
+            elapsed = time.perf_counter() - start
+        print(json.dumps({
+            "first_run_ms": round(elapsed * 1000, 1),
+            "exceptions": [e.value for e in at.exception],
+            "persistence_loaded": [m for m in PERSISTENCE if m in sys.modules],
+        }, ensure_ascii=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="量測 app 冷啟動的 import 與第一次執行耗時")
+    parser.add_argument("--repeat", type=int, default=3, help="import 量測次數，取中位數")
+    parser.add_argument("--size", type=int, default=100, help="第一次執行時的合成股票池大小")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="頂層 import 總耗時上限（毫秒，0 不檢查）")
+    parser.add_argument("--run-budget-ms", type=float, default=RUN_BUDGET_MS,
+                        help="第一次執行耗時上限（毫秒，0 不檢查）")
+    parser.add_argument("--top", type=int, default=10, help="列出最慢的幾個頂層模組")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.size)
+        return 0
+
+    ok = True
+    samples = [import_times() for _ in range(args.repeat)]
+    loaded = sorted(set(samples[-1][1]) - set(import_times(("streamlit",))[1]))
+    per_module = {m: statistics.median(s[0].get(m, 0) for s in samples) for m in samples[-1][0]}
+    total = statistics.median(sum(s[0].values()) for s in samples)
+    print(f"頂層 import：{total:,.0f} ms（{args.repeat} 次中位數）")
+    for name, ms in sorted(per_module.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {name:<28}{ms:>8,.0f} ms")
+    if loaded:
+        print(f"[失敗] 頂層 import 載入了應延後的模組：{', '.join(loaded)}")
+        ok = False
+    if args.budget_ms and total > args.budget_ms:
+        print(f"[失敗] import 超過預算 {args.budget_ms:,.0f} ms")
+        ok = False
+
+    result = first_run(args.size)
+    print(f"第一次執行（{args.size} 檔，離線）：{result['first_run_ms']:,.0f} ms")
+    if result["exceptions"]:
+        print(f"[失敗] 執行時發生例外：{result['exceptions']}")
+        ok = False
+    if result["persistence_loaded"]:
+        print(f"[失敗] 沒登入卻載入了：{', '.join(result['persistence_loaded'])}")
+        ok = False
+    if args.run_budget_ms and result["first_run_ms"] > args.run_budget_ms:
+        print(f"[失敗] 第一次執行超過預算 {args.run_budget_ms:,.0f} ms")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
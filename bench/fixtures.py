@@ -0,0 +1,347 @@
+"""離線測試用的假資料與上游替身。
+
+synthetic_universe / synthetic_panel 產生固定亂數種子的合成 OHLCV，
+offline_upstreams() 在 with 區塊內把 yf.download、yf.Ticker 與 requests.get
+換成讀本地資料的版本（下載排程器也換成不限流的一份），離開時還原；offline_sheets() 以 FakeSheets 代替 gspread / google-auth。
+benchmark 與壓測都共用這一份。
+"""
+import contextlib
+import functools
+import re
+import sys
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+import pandas as pd
+import requests
+import yfinance as yf
+
+import download_scheduler
+from radar import MEGA_STOCKS
+
+TRADING_DAYS_PER_YEAR = 250
+
+
+def synthetic_universe(n):
+    """回傳 n 檔 [(ticker, name)]：先放保底清單，不夠再補合成代號（上市 .TW / 上櫃 .TWO 交錯）"""
+    universe = list(MEGA_STOCKS[:n])
+    taken = {c.split('.')[0] for c, _ in universe}
+    code = 1100
+    while len(universe) < n:
+        if str(code) not in taken:
+            suffix = ".TW" if code % 3 else ".TWO"
+            universe.append((f"{code}{suffix}", f"合成{code}"))
+        code += 1
+    return universe
+
+
+@functools.lru_cache(maxsize=8)
+def _trading_days(days, end):
+    return pd.bdate_range(end=pd.Timestamp(end or "2026-10-16"), periods=days, name="Date")
+
+
+def _ticker_seed(ticker):
+    return zlib.crc32(ticker.encode("utf-8"))
+
+
+def synthetic_ohlcv(ticker, days=2 * TRADING_DAYS_PER_YEAR, end=None):
+    """單一股票的合成日 K：幾何隨機漫步，種子由代號決定，每次產生結果相同"""
+    rng = np.random.default_rng(_ticker_seed(ticker))
+    index = _trading_days(days, end)
+    start_price = rng.uniform(10, 1000)
+    drift = rng.normal(0.0003, 0.0004)
+    rets = rng.normal(drift, rng.uniform(0.01, 0.03), size=days)
+    close = start_price * np.exp(np.cumsum(rets))
+    open_ = close * (1 + rng.normal(0, 0.005, size=days))
+    spread = np.abs(rng.normal(0, 0.01, size=days))
+    high = np.maximum(open_, close) * (1 + spread)
+    low = np.minimum(open_, close) * (1 - spread)
+    volume = rng.lognormal(mean=14, sigma=0.6, size=days).round()
+    return pd.DataFrame(
+        {"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume},
+        index=index,
+    )
+
+
+def synthetic_panel(tickers, days=2 * TRADING_DAYS_PER_YEAR, end=None):
+    """多檔合成資料，欄位格式與 yf.download(group_by='ticker') 相同：(ticker, field)"""
+    frames = {t: synthetic_ohlcv(t, days, end) for t in tickers}
+    return pd.concat(frames, axis=1, names=["Ticker", "Price"])
+
+
+def period_bars(period):
+    """yfinance 的 period 字串 → 大約的交易日數；None / "max" 回傳 None（全部）"""
+    if not period or period == "max":
+        return None
+    num, unit = re.fullmatch(r"(\d+)(d|wk|mo|y)", period).groups()
+    return int(num) * {"d": 1, "wk": 5, "mo": 21, "y": TRADING_DAYS_PER_YEAR}[unit]
+
+
+def synthetic_info(ticker):
+    """假的 yf.Ticker(...).info，只放 fetch_fundamentals 會讀的欄位"""
+    rng = np.random.default_rng(_ticker_seed(ticker) + 1)
+    return {
+        "trailingEps": float(rng.uniform(-2, 40)),
+        "forwardEps": float(rng.uniform(0, 45)),
+        "trailingPE": float(rng.uniform(5, 60)),
+        "forwardPE": float(rng.uniform(5, 50)),
+        "priceToBook": float(rng.uniform(0.5, 8)),
+        "dividendYield": float(rng.uniform(0, 0.07)),
+        "marketCap": float(rng.uniform(5e9, 3e13)),
+        "grossMargins": float(rng.uniform(0.05, 0.6)),
+        "operatingMargins": float(rng.uniform(-0.05, 0.45)),
+        "revenueGrowth": float(rng.normal(0.08, 0.2)),
+        "sector": ["Technology", "Financial Services", "Industrials", "Basic Materials"][_ticker_seed(ticker) % 4],
+    }
+
+
+class FakeResponse:
+    def __init__(self, payload=None, text="", status_code=200):
+        self._payload = payload
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return self._payload
+
+
+class FakeRedis:
+    """Redis 替身：只實作 shared_cache 用到的 get / set(ex, nx) / delete，多執行緒共用安全"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.calls = {"get": 0, "set": 0}
+
+    def get(self, key):
+        with self._lock:
+            self.calls["get"] += 1
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            self.calls["set"] += 1
+            current = self._data.get(key)
+            if nx and current is not None and (current[1] is None or current[1] > time.time()):
+                return None
+            self._data[key] = (value, time.time() + ex if ex else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            return 1 if self._data.pop(key, None) is not None else 0
+
+
+class FakeWorksheet:
+    """gspread Worksheet 替身：只實作 app 用到的讀寫方法，第一列為標題列"""
+
+    def __init__(self, header=None):
+        self.rows = [list(header)] if header else []
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def get_all_records(self):
+        with self._lock:
+            self.calls += 1
+            if not self.rows:
+                return []
+            header = self.rows[0]
+            return [dict(zip(header, row)) for row in self.rows[1:]]
+
+    def append_row(self, values):
+        with self._lock:
+            self.calls += 1
+            self.rows.append(list(values))
+
+    def findall(self, value):
+        with self._lock:
+            self.calls += 1
+            return [types.SimpleNamespace(row=i + 1, col=j + 1, value=v)
+                    for i, row in enumerate(self.rows) for j, v in enumerate(row) if v == value]
+
+    def row_values(self, row):
+        with self._lock:
+            self.calls += 1
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def delete_rows(self, index):
+        with self._lock:
+            self.calls += 1
+            if 1 < index <= len(self.rows):
+                del self.rows[index - 1]
+
+
+class FakeSheets:
+    """Google Sheets 替身：一份試算表，分頁不存在時由 add_worksheet 建立"""
+
+    class WorksheetNotFound(Exception):
+        pass
+
+    def __init__(self):
+        self.worksheets = {}
+
+    def worksheet(self, title):
+        if title not in self.worksheets:
+            raise self.WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title, rows=0, cols=0):
+        self.worksheets[title] = FakeWorksheet()
+        return self.worksheets[title]
+
+    def open_by_key(self, key):
+        return self
+
+
+class OfflineMarket:
+    """一份本地市場資料：代號清單 + 惰性產生並保存的日 K"""
+
+    def __init__(self, universe, days=2 * TRADING_DAYS_PER_YEAR, end=None):
+        self.universe = list(universe)
+        self.names = dict(self.universe)
+        self.days = days
+        self.end = end
+        self._frames = {}
+        self.calls = {"download": 0, "ticker": 0, "http": 0}
+
+    def frame(self, ticker):
+        if ticker not in self._frames:
+            self._frames[ticker] = synthetic_ohlcv(ticker, self.days, self.end)
+        return self._frames[ticker]
+
+    def known(self, ticker):
+        return ticker in self.names or ticker.startswith("^")
+
+    # --- yfinance 替身 ---
+    def download(self, tickers, period=None, interval="1d", group_by="column", progress=True, **kwargs):
+        self.calls["download"] += 1
+        single = isinstance(tickers, str)
+        symbols = [tickers] if single else list(tickers)
+        bars = period_bars(period)
+        frames = {t: self.frame(t) if bars is None else self.frame(t).iloc[-bars:] for t in symbols if self.known(t)}
+        if not frames:
+            return pd.DataFrame()
+        if group_by == "ticker":
+            return pd.concat(frames, axis=1, names=["Ticker", "Price"])
+        # yfinance 預設 (Price, Ticker) 欄位順序，單檔也一樣是 MultiIndex
+        panel = pd.concat(frames, axis=1, names=["Ticker", "Price"])
+        return panel.swaplevel(0, 1, axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+
+    def make_ticker(self, symbol):
+        market = self
+
+        class _FakeTicker:
+            def __init__(self):
+                market.calls["ticker"] += 1
+                self.ticker = symbol
+
+            def history(self, period="1mo", **kwargs):
+                if not market.known(symbol):
+                    return pd.DataFrame()
+                return market.frame(symbol).iloc[-1:]
+
+            @property
+            def info(self):
+                return synthetic_info(symbol) if market.known(symbol) else {}
+
+        return _FakeTicker()
+
+    # --- HTTP 替身 ---
+    def http_get(self, url, params=None, headers=None, timeout=None, **kwargs):
+        self.calls["http"] += 1
+        if "yuantaetfs.com" in url:
+            return FakeResponse([
+                {"stkCd": c.split('.')[0], "stkNm": n}
+                for c, n in self.universe[:50] if c.endswith(".TW")
+            ])
+        if "STOCK_DAY_ALL" in url:
+            return FakeResponse([
+                {"Code": c.split('.')[0], "Name": n, "TradeVolume": f"{int(self.frame(c)['Volume'].iloc[-1]):,}"}
+                for c, n in self.universe if c.endswith(".TW")
+            ])
+        if "tpex_mainboard_quotes" in url:
+            return FakeResponse([
+                {"SecuritiesCompanyCode": c.split('.')[0], "CompanyName": n,
+                 "TradingVolume": f"{int(self.frame(c)['Volume'].iloc[-1] // 1000):,}"}
+                for c, n in self.universe if c.endswith(".TWO")
+            ])
+        if "AutocompleteService" in url:
+            query = str((params or {}).get("query", ""))
+            result = [
+                {"symbol": c, "name": n, "exchange": "TAI" if c.endswith(".TW") else "TWO"}
+                for c, n in self.universe if query and (query in c or query in n)
+            ]
+            return FakeResponse({"data": {"result": result[:5]}})
+        if "mis.twse.com.tw" in url:
+            # 即時報價：回傳最後一根日 K 的收盤與成交量（張），盤中模式套用後結果應與日 K 相同
+            items = []
+            for ch in str((params or {}).get("ex_ch", "")).split("|"):
+                ex, _, code = ch.partition("_")
+                ticker = f"{code.split('.')[0]}.{'TWO' if ex == 'otc' else 'TW'}"
+                if ticker not in self.names:
+                    continue
+                last = self.frame(ticker).iloc[-1]
+                # 真實來源的成交量是整數張；這裡保留小數，套用後才會與日 K 完全相同
+                items.append({"c": code.split('.')[0], "ex": ex, "z": repr(float(last["Close"])),
+                              "v": repr(float(last["Volume"]) / 1000), "d": last.name.strftime("%Y%m%d")})
+            return FakeResponse({"msgArray": items, "rtcode": "0000"})
+        if "tw.stock.yahoo.com/quote/" in url:
+            symbol = url.rsplit("/", 1)[-1]
+            name = self.names.get(symbol)
+            if name is None:
+                return FakeResponse(text="<title>Yahoo股市</title>", status_code=404)
+            return FakeResponse(text=f"<title>{name}({symbol}) 走勢圖 - Yahoo股市</title>")
+        return FakeResponse(status_code=404)
+
+
+@contextlib.contextmanager
+def offline_upstreams(market):
+    """在 with 區塊內把 yfinance 與 Yahoo / TWSE / TPEX / 元大的 HTTP 請求全部導向 market
+
+    程序共用的下載排程器也換成不限流、不退避的一份：離線替身沒有被擋的問題，
+    量測結果才是計算時間而不是 token bucket 的等待時間。
+    """
+    saved = (yf.download, yf.Ticker, requests.get, download_scheduler.SCHEDULER)
+    yf.download = market.download
+    yf.Ticker = market.make_ticker
+    requests.get = market.http_get
+    download_scheduler.SCHEDULER = download_scheduler.DownloadScheduler(
+        bucket=download_scheduler.TokenBucket(rate=1e9, burst=1e9, sleep=lambda _: None), sleep=lambda _: None)
+    try:
+        yield market
+    finally:
+        yf.download, yf.Ticker, requests.get, download_scheduler.SCHEDULER = saved
+
+
+@contextlib.contextmanager
+def offline_sheets(sheets):
+    """在 with 區塊內把 gspread 與 google.oauth2.service_account 換成導向 sheets 的替身模組
+
+    app 在用到 Sheets 時才 import 這兩個套件，所以替身放進 sys.modules 就會被拿到；
+    st.secrets 仍需另外設定 gcp_service_account（AppTest 用 at.secrets）。
+    """
+    gspread = types.ModuleType("gspread")
+    gspread.authorize = lambda creds: sheets
+    gspread.WorksheetNotFound = FakeSheets.WorksheetNotFound
+    service_account = types.ModuleType("google.oauth2.service_account")
+    service_account.Credentials = types.SimpleNamespace(from_service_account_info=lambda info, scopes=None: None)
+    oauth2 = types.ModuleType("google.oauth2")
+    oauth2.service_account = service_account
+    fakes = {"gspread": gspread, "google.oauth2": oauth2, "google.oauth2.service_account": service_account}
+    saved = {name: sys.modules.get(name) for name in fakes}
+    sys.modules.update(fakes)
+    try:
+        yield sheets
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
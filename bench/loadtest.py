@@ -0,0 +1,230 @@
+"""多使用者壓測：N 個模擬 session 同時跑真正的 app.py，量測重跑延遲與記憶體。
+
+每個 session 是一個 streamlit AppTest，在各自的執行緒裡同時操作：
+開頁 → 設定暱稱 → 加入自選股 → 逐一切換四個 Tab（--rounds 輪）→ 刪除一檔自選。
+AppTest 每次執行都會替換程序層級的全域狀態（Runtime、st.secrets），不能真的並行，
+所以重跑本身排隊執行、延遲從送出到完成計算（含排隊）；純 Python 的重跑在 GIL 下本來就大致是排隊，
+背景執行緒（預抓、共用快取）照常並行。
+上游（yfinance、TWSE / TPEX、Yahoo）由 bench.fixtures.offline_upstreams 代替，
+Google Sheets 由 FakeSheets 代替；每種 session 數在獨立的子程序裡跑，RSS 互不影響。
+
+用法：
+    python -m bench.loadtest                          # 1 / 5 / 10 / 20 個 session
+    python -m bench.loadtest --sessions 1 10 --universe 600 --rounds 3
+
+輸出每種 session 數的 p50 / p95 / 最大重跑延遲（另列不含排隊的執行時間中位數）、RSS 與每個 session 平均 / 邊際佔用的記憶體，
+結果寫成 JSON（預設 bench/results/loadtest.json）。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SESSIONS = (1, 5, 10, 20)
+DEFAULT_OUT = os.path.join("bench", "results", "loadtest.json")
+TABS = ("🚀 短線飆股 (系統)", "🌊 中線波段 (系統)", "📅 長線價值 (系統)", "⭐ 我的自選")
+# AppTest 每次都整頁重跑、沒有片段重跑，片段裡的 st.rerun(scope="fragment") 在這裡會報錯；瀏覽器上不會
+APPTEST_ONLY_ERRORS = ('scope="fragment" can only be specified',)
+
+
+def rss_mb():
+    """目前程序的常駐記憶體（MB）；沒有 /proc 時退回最高用量"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+# AppTest.run 不是執行緒安全的，所有 session 的重跑共用這把鎖
+RUN_LOCK = threading.Lock()
+
+
+def _widget(widgets, label):
+    return next(w for w in widgets if w.label == label)
+
+
+class Session:
+    """一個模擬使用者：照固定劇本操作一個 AppTest，記下每次重跑的秒數與例外"""
+
+    def __init__(self, index, stocks, rounds):
+        from streamlit.testing.v1 import AppTest
+        self.index = index
+        self.stocks = stocks
+        self.rounds = rounds
+        self.samples = []
+        self.exec_samples = []
+        self.errors = []
+        self.at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+        self.at.secrets["gcp_service_account"] = {"SHEET_ID": "loadtest"}
+
+    def run(self, step):
+        start = time.perf_counter()
+        with RUN_LOCK:
+            began = time.perf_counter()
+            self.at.run()
+        end = time.perf_counter()
+        self.samples.append((step, end - start))
+        self.exec_samples.append(end - began)
+        self.errors += [f"{step}: {e.value}" for e in self.at.exception
+                        if not any(known in e.value for known in APPTEST_ONLY_ERRORS)]
+
+    def play(self):
+        at = self.at
+        self.run("open")
+        at.text_input(key="uid_input").input(f"loadtest{self.index:03d}")
+        _widget(at.button, "確認暱稱").click()
+        self.run("login")
+        _widget(at.text_input, "新增自選股").input(", ".join(code for code, _ in self.stocks))
+        _widget(at.button, "加入自選").click()
+        self.run("add")
+        for _ in range(self.rounds):
+            for tab in TABS[1:] + TABS[:1]:
+                at.session_state["main_tab"] = tab
+                self.run("tab")
+        at.session_state["main_tab"] = TABS[-1]
+        self.run("tab")
+        at.button(key=f"del_{self.stocks[0][1]}").click()
+        self.run("delete")
+
+
+def session_stocks(universe, index, watch):
+    """每個 session 加兩檔：一檔在系統名單裡，一檔在名單外（各 session 不同）→ [(查詢字串, 代號)]"""
+    inside = [c for c, _ in universe if c in watch]
+    outside = [c for c, _ in universe if c not in watch]
+    picked = [inside[index % len(inside)], outside[-(index % len(outside)) - 1]]
+    return [(t.split('.')[0], t) for t in picked]
+
+
+def child(n, universe_size, rounds):
+    """子程序：同時跑 n 個 session，印出一行 JSON"""
+    tmp = tempfile.mkdtemp(prefix="radar-loadtest-")
+    os.environ["RADAR_HISTORY_DIR"] = os.path.join(tmp, "history")
+    os.environ["RADAR_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshots")
+    os.environ["RADAR_RATINGS_DIR"] = os.path.join(tmp, "ratings")
+    os.environ["RADAR_CACHE_URL"] = "sqlite:///" + os.path.join(tmp, "shared.sqlite")
+    sys.path.insert(0, ROOT)
+    import radar
+    from bench.fixtures import FakeSheets, OfflineMarket, offline_sheets, offline_upstreams, synthetic_universe
+
+    universe = synthetic_universe(universe_size)
+    market = OfflineMarket(universe)
+    watch = radar.build_watch_list(universe[:50], [(c, n_) for c, n_ in universe[:100]])
+    sessions = [Session(i, session_stocks(universe, i, watch), rounds) for i in range(n)]
+    baseline = rss_mb()
+    barrier = threading.Barrier(n)
+    failures = []
+
+    def drive(session):
+        barrier.wait()
+        try:
+            session.play()
+        except Exception as e:
+            failures.append(f"session {session.index}: {e!r}")
+
+    with offline_upstreams(market), offline_sheets(FakeSheets()):
+        start = time.perf_counter()
+        threads = [threading.Thread(target=drive, args=(s,)) for s in sessions]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+    rss = rss_mb()  # session 都還活著（session_state 仍在）時量
+
+    samples = [sec * 1000 for s in sessions for _, sec in s.samples]
+    by_step = {}
+    for s in sessions:
+        for step, sec in s.samples:
+            by_step.setdefault(step, []).append(sec * 1000)
+    print(json.dumps({
+        "sessions": n,
+        "reruns": len(samples),
+        "wall_s": round(wall, 2),
+        "p50_ms": round(statistics.median(samples), 1) if samples else None,
+        "p95_ms": round(percentile(samples, 0.95), 1) if samples else None,
+        "max_ms": round(max(samples), 1) if samples else None,
+        "exec_p50_ms": round(statistics.median(sec * 1000 for s in sessions for sec in s.exec_samples), 1)
+        if samples else None,
+        "steps": {k: {"p50_ms": round(statistics.median(v), 1), "p95_ms": round(percentile(v, 0.95), 1)}
+                  for k, v in by_step.items()},
+        "baseline_rss_mb": round(baseline, 1),
+        "rss_mb": round(rss, 1),
+        "rss_per_session_mb": round((rss - baseline) / n, 2),
+        "upstream_calls": dict(market.calls),
+        "errors": failures + [e for s in sessions for e in s.errors][:20],
+    }, ensure_ascii=False))
+
+
+def run_level(n, universe_size, rounds):
+    proc = subprocess.run([sys.executable, "-m", "bench.loadtest", "--child", str(n),
+                           "--universe", str(universe_size), "--rounds", str(rounds)],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多使用者同時操作 app.py 的壓測")
+    parser.add_argument("--sessions", type=int, nargs="+", default=list(DEFAULT_SESSIONS), help="同時 session 數")
+    parser.add_argument("--universe", type=int, default=300, help="合成股票池大小")
+    parser.add_argument("--rounds", type=int, default=2, help="每個 session 切換 Tab 幾輪")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.universe, args.rounds)
+        return 0
+
+    results = []
+    print(f"{'sessions':>8} {'reruns':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'執行 ms':>8} {'RSS MB':>8} "
+          f"{'MB/session':>11} {'邊際 MB':>8}")
+    for n in sorted(args.sessions):
+        r = run_level(n, args.universe, args.rounds)
+        if results:
+            prev = results[-1]
+            r["marginal_mb_per_session"] = round((r["rss_mb"] - prev["rss_mb"]) / (n - prev["sessions"]), 2)
+        else:
+            r["marginal_mb_per_session"] = None
+        results.append(r)
+        marginal = "-" if r["marginal_mb_per_session"] is None else f"{r['marginal_mb_per_session']:.2f}"
+        print(f"{n:>8} {r['reruns']:>7} {r['p50_ms']:>9,.0f} {r['p95_ms']:>9,.0f} {r['max_ms']:>9,.0f} {r['exec_p50_ms']:>8,.0f} "
+              f"{r['rss_mb']:>8,.0f} {r['rss_per_session_mb']:>11.2f} {marginal:>8}")
+        for e in r["errors"]:
+            print(f"  [錯誤] {e}")
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "universe": args.universe,
+        "rounds": args.rounds,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[loadtest] 結果已寫入 {args.out}")
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""報酬相關係數矩陣與產業熱力圖：看名單（特別是自選清單）是不是都押在同一個方向。
+
+資料直接取自 fetch_data 已經抓好的面板（app 傳 panel_view 的結果），不另外下載。
+報酬以 float32 計算，相關矩陣是標準化報酬的 Z.T @ Z，一次矩陣乘法：1,800 檔 × 120 天約幾十毫秒，
+不必做增量更新；快取由呼叫端負責（app 與面板同樣 5 分鐘失效）。
+"""
+import numpy as np
+import pandas as pd
+
+import radar
+
+DEFAULT_WINDOW = 120
+# 視窗內有報酬的天數低於這個比例就不列入（新上市、長期停牌）
+MIN_COVERAGE = 0.8
+UNCLASSIFIED = "未分類"
+
+
+def close_matrix(data, tickers, window=DEFAULT_WINDOW):
+    """面板（或 {ticker: 日 K}）→ 最後 window + 1 天的收盤 DataFrame（日期 × 代號）"""
+    if isinstance(data, pd.DataFrame) and isinstance(data.columns, pd.MultiIndex):
+        # 整個面板一次取出收盤欄，不逐檔切（逐檔切 1,800 檔要好幾秒）
+        closes = data.xs('Close', axis=1, level=1)
+        closes = closes[[t for t in dict.fromkeys(tickers) if t in closes.columns]]
+    else:
+        cols = {}
+        for t in tickers:
+            df = radar.ticker_frame(data, t)
+            if df is not None and not df.empty:
+                cols[t] = df['Close']
+        closes = pd.concat(cols, axis=1) if cols else pd.DataFrame()
+    if closes.empty:
+        return closes
+    return closes.dropna(how="all").iloc[-(window + 1):]
+
+
+def returns_matrix(closes, min_coverage=MIN_COVERAGE):
+    """收盤 → (float32 日報酬 T × N, 留下的代號 list)；缺值太多的股票排除，其餘缺值當作 0 報酬"""
+    values = closes.to_numpy(dtype=np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rets = values[1:] / values[:-1] - np.float32(1)
+    valid = np.isfinite(rets)
+    keep = valid.mean(axis=0) >= min_coverage if len(rets) else np.zeros(values.shape[1], dtype=bool)
+    rets = np.where(valid[:, keep], rets[:, keep], np.float32(0))
+    return rets, [t for t, k in zip(closes.columns, keep) if k]
+
+
+def correlation_matrix(rets):
+    """float32 報酬 T × N → N × N 相關係數；沒有波動的股票與其他股票的相關係數為 0"""
+    dof = np.float32(max(rets.shape[0] - 1, 1))
+    z = rets - rets.mean(axis=0, dtype=np.float32)
+    std = np.sqrt((z * z).sum(axis=0) / dof)
+    z /= np.where(std > 0, std, np.float32(1))
+    corr = (z.T @ z) / dof
+    np.fill_diagonal(corr, 1)
+    return np.clip(corr, -1, 1, out=corr)
+
+
+def sector_labels(tickers, sectors):
+    return [sectors.get(t) or UNCLASSIFIED for t in tickers]
+
+
+def sector_order(labels):
+    """依產業分組的排列順序（未分類放最後，組內維持原順序）"""
+    return sorted(range(len(labels)), key=lambda i: (labels[i] == UNCLASSIFIED, labels[i], i))
+
+
+def sector_matrix(corr, labels):
+    """產業 × 產業的平均相關係數（同產業不算自己對自己）→ (產業 list, 矩陣, 各產業檔數)"""
+    names = sorted(set(labels), key=lambda s: (s == UNCLASSIFIED, s))
+    index = {s: i for i, s in enumerate(names)}
+    onehot = np.zeros((len(labels), len(names)), dtype=np.float32)
+    onehot[np.arange(len(labels)), [index[s] for s in labels]] = 1
+    counts = onehot.sum(axis=0)
+    sums = onehot.T @ corr @ onehot
+    pairs = np.outer(counts, counts)
+    sums[np.diag_indices(len(names))] -= counts
+    pairs[np.diag_indices(len(names))] -= counts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(pairs > 0, sums / pairs, np.nan)
+    return names, mean, counts.astype(int).tolist()
+
+
+def compute(data, tickers, sectors=None, window=DEFAULT_WINDOW):
+    """名單的相關矩陣（依產業排序）與產業熱力圖；資料不足兩檔回傳 None
+
+    回傳 dict：tickers / sectors（排序後）、corr（N × N float32）、sector_names / sector_corr / sector_counts、
+    as_of（最後一天的日期）、days（實際用到的報酬天數）
+    """
+    closes = close_matrix(data, tickers, window)
+    if closes.empty:
+        return None
+    rets, kept = returns_matrix(closes)
+    if len(kept) < 2:
+        return None
+    corr = correlation_matrix(rets)
+    labels = sector_labels(kept, sectors or {})
+    order = sector_order(labels)
+    corr = corr[np.ix_(order, order)]
+    labels = [labels[i] for i in order]
+    names, sector_corr, counts = sector_matrix(corr, labels)
+    return {
+        "tickers": [kept[i] for i in order], "sectors": labels, "corr": corr,
+        "sector_names": names, "sector_corr": sector_corr, "sector_counts": counts,
+        "as_of": closes.index[-1].strftime("%Y-%m-%d"), "days": int(rets.shape[0]),
+    }
+
+
+def concentration(result, subset, top=5):
+    """subset 在 result 相關矩陣裡的兩兩平均相關係數與最相關的 top 組 → (平均, [(a, b, 相關係數)])"""
+    pos = {t: i for i, t in enumerate(result["tickers"])}
+    idx = [pos[t] for t in subset if t in pos]
+    if len(idx) < 2:
+        return None, []
+    sub = result["corr"][np.ix_(idx, idx)]
+    upper = np.triu_indices(len(idx), k=1)
+    values = sub[upper]
+    best = np.argsort(values)[::-1][:top]
+    names = [result["tickers"][i] for i in idx]
+    return float(values.mean()), [(names[upper[0][k]], names[upper[1][k]], float(values[k])) for k in best]
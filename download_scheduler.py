@@ -0,0 +1,282 @@
+"""Yahoo 日 K 下載排程：所有 yf.download 都經過這裡。
+
+以前 fetch_data 把整份名單丟給一次 yf.download，Yahoo 限流或漏掉幾檔時，那幾檔就從結果裡
+默默消失（process_display 直接略過），而且這個不完整的結果會被快取 5 分鐘。現在：
+
+1. 名單切成 chunk_size 檔一批，批次用小的 thread pool 平行送出；
+2. 每個請求先向整個程序共用的 TokenBucket 拿 token，不管幾個使用者、幾條背景執行緒，
+   對 Yahoo 的請求頻率都有上限，容器的 IP 不會被擋；
+3. 請求失敗的批次裡的代號縮小批次、指數退避後重試；
+   有回應但缺席的代號（被限流漏掉，或下市、壞代號）最後退避一次、逐檔再查一輪，
+   第二次還是空的才當作沒有資料；
+4. 連續失敗達門檻時 CircuitBreaker 跳開，一段時間內不再送請求，
+   直接回傳每檔最後一次成功取得的資料，Yahoo 恢復後再由一個試探請求接回。
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# 預設值：2 req/s、可連發 4 個；yf.download 一次 100 檔在 Yahoo 端仍是單一請求的成本
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 4
+DEFAULT_CHUNK_SIZE = 100
+
+
+class TokenBucket:
+    """多執行緒共用的 token bucket：平均每秒 rate 個請求，最多可連發 burst 個"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """拿一個 token，不夠時等到有為止；回傳等待的秒數"""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 先扣掉（可能變負數），等待時間依欠的量計算，排隊的執行緒自然依序錯開
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+
+class CircuitBreaker:
+    """連續 failure_threshold 次失敗就跳開 reset_after 秒；之後放一個試探請求，成功才恢復"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=3, reset_after=120, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """現在可以送請求嗎；跳開期滿後只放行一個試探請求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_after:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def blocked(self):
+        """跳開中且還沒到試探時間（只查詢，不會消耗試探的機會）"""
+        with self._lock:
+            return self.state == self.OPEN and self.clock() - self.opened_at < self.reset_after
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[CircuitBreaker] 連續 {self.failures} 次失敗，暫停下載 {self.reset_after} 秒")
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+    def record_inconclusive(self):
+        """請求有送出但結果看不出 Yahoo 是否健康（例如單檔查無資料）：
+        若這是試探請求就當失敗重新跳開，否則不影響計數；被放行的試探一定要有結論，不能卡在 HALF_OPEN"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+def yf_download(tickers, period):
+    """實際的 yfinance 呼叫；平行度由排程器控制，這裡關掉 yfinance 自己的多執行緒"""
+    import yfinance as yf
+    return yf.download(list(tickers), period=period, group_by='ticker', progress=False, threads=False)
+
+
+def split_frames(data, tickers):
+    """yf.download(group_by='ticker') 的結果 → {ticker: 日 K}，只留有收盤價的代號"""
+    frames = {}
+    if data is None or data.empty:
+        return frames
+    multi = isinstance(data.columns, pd.MultiIndex)
+    names = set(data.columns.get_level_values(0)) if multi else set()
+    for t in tickers:
+        if multi:
+            if t not in names:
+                continue
+            df = data[t]
+        elif len(tickers) == 1:
+            df = data
+        else:
+            continue
+        df = df.dropna(how="all")
+        if 'Close' in df and not df['Close'].dropna().empty:
+            frames[t] = df
+    return frames
+
+
+def join_frames(frames):
+    """{ticker: 日 K} → (ticker, field) 欄位的 DataFrame，格式與 yf.download(group_by='ticker') 相同"""
+    if not frames:
+        return None
+    return pd.concat(frames, axis=1)
+
+
+class DownloadScheduler:
+    """批次、限流、重試、斷路器與最後已知資料；fetch() 與 radar.fetch_data 的回傳格式相同。
+
+    download(tickers, period) 預設為 yf_download（測試與壓測會換成離線版本）；
+    last_known 以 (ticker, period) 為單位保留最後一次成功的日 K，超過 max_last_known 檔時丟最舊的。
+    """
+
+    def __init__(self, download=yf_download, bucket=None, breaker=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_workers=4, max_retries=3, backoff=1.0, max_last_known=5000, sleep=time.sleep):
+        self.download = download
+        self.bucket = bucket or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_last_known = max_last_known
+        self.sleep = sleep
+        self.last_report = None
+        self._last_known = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _request(self, chunk, period):
+        """送出一個批次 → {ticker: 日 K}；斷路器不放行時不送，回傳空 dict
+
+        只有一檔的批次沒回來多半是壞代號（已下市、打錯），不算 Yahoo 失敗，免得幾個壞代號就把斷路器弄跳
+        （例外一律算失敗）；但若這是跳開後的試探請求，仍要讓斷路器重新跳開。
+        """
+        if not self.breaker.allow():
+            return {}
+        self.bucket.acquire()
+        try:
+            data = self.download(chunk, period)
+        except Exception as e:
+            print(f"[DownloadScheduler] 下載 {len(chunk)} 檔失敗: {e}")
+            self.breaker.record_failure()
+            return {}
+        frames = split_frames(data, chunk)
+        # 整批一檔都沒回來多半是被限流；部分缺漏（下市、停牌、偶發漏掉）不算 Yahoo 不健康
+        if frames:
+            self.breaker.record_success()
+        elif len(chunk) > 1:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_inconclusive()
+        return frames
+
+    def call(self, fn, *args, **kwargs):
+        """日 K 以外的 Yahoo 請求（例如大盤指數）也經過同一個斷路器與 token bucket
+
+        斷路器不放行、丟例外或回傳空的結果時回傳 None；成功與失敗都回報給斷路器。
+        """
+        if not self.breaker.allow():
+            return None
+        self.bucket.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            print(f"[DownloadScheduler] {getattr(fn, '__name__', fn)} 失敗: {e}")
+            self.breaker.record_failure()
+            return None
+        if result is None or getattr(result, "empty", False):
+            self.breaker.record_failure()
+            return None
+        self.breaker.record_success()
+        return result
+
+    def _remember(self, frames, period):
+        with self._lock:
+            for t, df in frames.items():
+                self._last_known[(t, period)] = df
+                self._last_known.move_to_end((t, period))
+            while len(self._last_known) > self.max_last_known:
+                self._last_known.popitem(last=False)
+
+    def _recall(self, tickers, period):
+        with self._lock:
+            return {t: self._last_known[(t, period)] for t in tickers if (t, period) in self._last_known}
+
+    def fetch_frames(self, tickers, period="2y", fallback=True):
+        """tickers 的日 K {ticker: DataFrame}；重試後仍拿不到的用最後已知資料補（fallback=False 時不補），
+        都沒有的不出現在結果裡
+
+        請求失敗的批次最多重試 max_retries 次；有回應但缺席的代號在最後逐檔再查一次（單檔查無資料不算斷路器失敗）。
+        """
+        pending = list(dict.fromkeys(tickers))
+        requested = len(pending)
+        frames, requests, retried = {}, 0, 0
+        absent = set()
+        chunk_size = self.chunk_size
+        for attempt in range(self.max_retries + 1):
+            if not pending or self.breaker.blocked():
+                break
+            if attempt:
+                retried += len(pending)
+                # 指數退避加一點抖動，避免多條執行緒同時重試
+                self.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random() / 2))
+                # 重試時批次減半：被限流時較小的請求較容易過，也讓單一壞代號影響的範圍變小
+                chunk_size = max(1, chunk_size // 2)
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as pool:
+                results = list(pool.map(lambda c: self._request(c, period), chunks))
+            requests += len(chunks)
+            for chunk, got in zip(chunks, results):
+                frames.update(got)
+                if got:
+                    # 有回應的批次裡缺席的代號：可能被限流漏掉，也可能下市、壞代號；留到最後逐檔查一次
+                    absent.update(t for t in chunk if t not in got)
+            # 請求本身失敗（例外或整批空）的代號才進下一輪批次重試
+            pending = [t for t in pending if t not in frames and t not in absent]
+
+        absent = [t for t in dict.fromkeys(tickers) if t in absent and t not in frames]
+        if absent and not self.breaker.blocked():
+            retried += len(absent)
+            self.sleep(self.backoff * (1 + random.random() / 2))
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(absent))) as pool:
+                results = list(pool.map(lambda t: self._request([t], period), absent))
+            requests += len(absent)
+            for got in results:
+                frames.update(got)
+
+        unresolved = [t for t in dict.fromkeys(tickers) if t not in frames]
+        self._remember(frames, period)
+        stale = self._recall(unresolved, period) if fallback else {}
+        downloaded = len(frames)
+        frames.update(stale)
+        self.last_report = {
+            "requested": requested, "downloaded": downloaded,
+            "from_last_known": len(stale), "missing": [t for t in unresolved if t not in stale],
+            "requests": requests, "retried": retried, "breaker": self.breaker.state,
+        }
+        return frames
+
+    def fetch(self, tickers, period="2y"):
+        """與 radar.fetch_data 相同格式的面板；一檔都拿不到時回傳 None"""
+        frames = self.fetch_frames(tickers, period)
+        return join_frames({t: frames[t] for t in dict.fromkeys(tickers) if t in frames})
+
+
+# 整個程序共用一個排程器：app 的所有使用者、背景預抓與全市場掃描共用同一個 token bucket 與斷路器
+SCHEDULER = DownloadScheduler()
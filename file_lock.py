@@ -0,0 +1,41 @@
+"""跨程序的檔案鎖：同一台機器（或共用磁碟）上的多個程序、副本輪流讀改寫同一組檔案。
+
+POSIX 用 fcntl.flock，Windows 用 msvcrt.locking；鎖檔本身是空的，持有鎖的程序掛掉時作業系統會自動釋放。
+flock 以開啟的檔案為單位，所以同一程序內的不同執行緒各自 locked() 也會互斥。
+"""
+import contextlib
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextlib.contextmanager
+def locked(path):
+    """取得 path 這個鎖檔的獨占鎖（拿不到就等），離開 with 區塊時釋放"""
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,113 @@
+"""本地歷史 K 線倉庫：每檔一個 pickle 檔，用檔案修改時間判斷是否還新鮮。
+
+全市場掃描、回測與批次工具都從這裡讀；倉庫是「熱」的時候完全不必連 Yahoo。
+每檔旁邊另存一份 {ticker}.state.json（indicators.IndicatorState），掃描只讀這份小檔就能評級。
+路徑預設為 .cache/history，可用環境變數 RADAR_HISTORY_DIR 改掉。
+"""
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from indicators import IndicatorState
+from radar import ticker_frame
+
+DEFAULT_HISTORY_DIR = os.environ.get("RADAR_HISTORY_DIR", os.path.join(".cache", "history"))
+
+
+class HistoryStore:
+    def __init__(self, root=DEFAULT_HISTORY_DIR, max_age=1800):
+        self.root = root
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, ticker):
+        return os.path.join(self.root, f"{ticker}.pkl")
+
+    def age(self, ticker):
+        """距離上次寫入的秒數；沒有檔案回傳 None"""
+        try:
+            return time.time() - os.path.getmtime(self.path(ticker))
+        except OSError:
+            return None
+
+    def is_fresh(self, ticker, max_age=None):
+        age = self.age(ticker)
+        return age is not None and age <= (self.max_age if max_age is None else max_age)
+
+    def load(self, ticker, max_age=None):
+        """讀單檔日 K；不存在或超過 max_age 秒回傳 None（max_age=float('inf') 表示不管新舊）"""
+        if not self.is_fresh(ticker, max_age):
+            return None
+        try:
+            return pd.read_pickle(self.path(ticker))
+        except Exception as e:
+            print(f"[HistoryStore.load] {ticker} 失敗: {e}")
+            return None
+
+    def save(self, ticker, df):
+        """先寫暫存檔再 rename，其他程序讀到的一定是完整檔案"""
+        tmp = f"{self.path(ticker)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_pickle(tmp)
+        os.replace(tmp, self.path(ticker))
+
+    def append(self, ticker, df):
+        """把新下載的 K 棒併進既有歷史（同日期以新資料為準），回傳合併後的 DataFrame"""
+        try:
+            old = pd.read_pickle(self.path(ticker))
+        except Exception:
+            old = None
+        if old is not None and not old.empty:
+            df = pd.concat([old[~old.index.isin(df.index)], df]).sort_index()
+        self.save(ticker, df)
+        return df
+
+    def state_path(self, ticker):
+        return os.path.join(self.root, f"{ticker}.state.json")
+
+    def load_state(self, ticker):
+        """讀指標狀態；沒有或讀取失敗回傳 None"""
+        try:
+            with open(self.state_path(ticker), encoding="utf-8") as f:
+                return IndicatorState.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[HistoryStore.load_state] {ticker} 失敗: {e}")
+            return None
+
+    def save_state(self, ticker, state):
+        tmp = f"{self.state_path(ticker)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state.to_dict(), f)
+        os.replace(tmp, self.state_path(ticker))
+
+    def save_panel(self, data, tickers):
+        """把 yf.download(group_by='ticker') 的結果拆成單檔存起來，回傳實際存到的代號"""
+        saved = []
+        for t in tickers:
+            df = ticker_frame(data, t)
+            if df is None:
+                continue
+            df = df.dropna(how="all")
+            if df.empty:
+                continue
+            self.save(t, df)
+            saved.append(t)
+        return saved
+
+    def tickers(self):
+        return sorted(f[:-len(".pkl")] for f in os.listdir(self.root) if f.endswith(".pkl"))
+
+    def load_panel(self, tickers=None, max_age=float("inf")):
+        """多檔合併成 (ticker, field) 欄位的 DataFrame，格式和 fetch_data 相同"""
+        frames = {}
+        for t in (self.tickers() if tickers is None else tickers):
+            df = self.load(t, max_age)
+            if df is not None:
+                frames[t] = df
+        if not frames:
+            return None
+        return pd.concat(frames, axis=1, names=["Ticker", "Price"])
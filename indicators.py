@@ -0,0 +1,204 @@
+"""單檔的串流指標狀態：推進一根 K 棒只要 O(1)，不必每次對兩年資料重算 rolling。
+
+保存最近 240 根收盤（環狀緩衝）與最近 5 根成交量，並維護：
+- MA20 / 60 / 120 / 240 的滑動和
+- RSI 14 的漲幅和與跌幅和（和 calculate_rsi 一樣是簡單平均，不是 Wilder 平滑）
+- 5 日均量的滑動和
+
+snapshot() 的結果與 radar.latest_indicators() 相同，可以直接丟給 radar.rate_indicators()。
+狀態以 JSON 存在歷史倉庫裡（HistoryStore.save_state），和 K 線檔放在一起。
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+MA_WINDOWS = (20, 60, 120, 240)
+RSI_PERIOD = 14
+VOL_WINDOW = 5
+CAPACITY = max(MA_WINDOWS) + 1   # 多留一格，最長的視窗滑出時還拿得到舊值
+# 每推進這麼多根就用緩衝區重算一次滑動和，避免浮點誤差累積
+REBASE_EVERY = 1000
+
+
+class IndicatorState:
+    def __init__(self):
+        self.closes = [0.0] * CAPACITY
+        self.volumes = [0.0] * VOL_WINDOW
+        self.count = 0          # 累計收到的收盤數
+        self.vol_count = 0
+        self.last_date = None
+        self.ma_sums = {m: 0.0 for m in MA_WINDOWS}
+        self.gain_sum = 0.0
+        self.loss_sum = 0.0
+        self.vol_sum = 0.0
+        self._since_rebase = 0
+
+    # --- 環狀緩衝 ---
+    def close_at(self, back):
+        """back=0 是最新一根，back=1 是前一根…；back 必須小於 min(count, CAPACITY)"""
+        return self.closes[(self.count - 1 - back) % CAPACITY]
+
+    def _delta_at(self, back):
+        """第 back 根的漲跌（相對前一根），需要 back + 1 < count"""
+        return self.close_at(back) - self.close_at(back + 1)
+
+    # --- 更新 ---
+    def advance(self, close, volume, date=None):
+        """收進新的一根 K 棒；date 與最後一根相同時改成覆寫最後一根（盤中更新）"""
+        if date is not None and self.last_date is not None and str(date) == self.last_date:
+            self.replace_last(close, volume)
+            return
+        close, volume = float(close), float(volume)
+        # 收盤與成交量各自略過 NaN，與 frame_indicators 分別 dropna 的行為一致
+        if not math.isnan(volume):
+            if self.vol_count >= VOL_WINDOW:
+                self.vol_sum -= self.volumes[self.vol_count % VOL_WINDOW]
+            self.volumes[self.vol_count % VOL_WINDOW] = volume
+            self.vol_sum += volume
+            self.vol_count += 1
+        if date is not None:
+            self.last_date = str(date)
+        if math.isnan(close):
+            return
+        for m in MA_WINDOWS:
+            self.ma_sums[m] += close
+            if self.count >= m:
+                self.ma_sums[m] -= self.close_at(m - 1)
+        if self.count >= 1:
+            delta = close - self.close_at(0)
+            self.gain_sum += max(delta, 0.0)
+            self.loss_sum += max(-delta, 0.0)
+            if self.count > RSI_PERIOD:
+                old = self._delta_at(RSI_PERIOD - 1)
+                self.gain_sum -= max(old, 0.0)
+                self.loss_sum -= max(-old, 0.0)
+        self.closes[self.count % CAPACITY] = close
+        self.count += 1
+        self._since_rebase += 1
+        if self._since_rebase >= REBASE_EVERY:
+            self.rebase()
+
+    def replace_last(self, close, volume=None):
+        """覆寫最後一根（盤中報價更新今天這根），所有滑動和只做差量調整"""
+        if self.count == 0:
+            self.advance(close, volume if volume is not None else float("nan"))
+            return
+        close = float(close)
+        if math.isnan(close):
+            return
+        old = self.close_at(0)
+        diff = close - old
+        for m in MA_WINDOWS:
+            self.ma_sums[m] += diff
+        if self.count >= 2:
+            prev = self.close_at(1)
+            self.gain_sum += max(close - prev, 0.0) - max(old - prev, 0.0)
+            self.loss_sum += max(prev - close, 0.0) - max(prev - old, 0.0)
+        self.closes[(self.count - 1) % CAPACITY] = close
+        if volume is not None and not math.isnan(float(volume)) and self.vol_count:
+            idx = (self.vol_count - 1) % VOL_WINDOW
+            self.vol_sum += float(volume) - self.volumes[idx]
+            self.volumes[idx] = float(volume)
+
+    def rebase(self):
+        """用緩衝區內容重算所有滑動和"""
+        n = min(self.count, CAPACITY)
+        tail = [self.close_at(back) for back in range(n)][::-1]
+        for m in MA_WINDOWS:
+            self.ma_sums[m] = float(sum(tail[-m:])) if self.count >= m else float(sum(tail))
+        deltas = np.diff(tail[-(RSI_PERIOD + 1):]) if n >= 2 else np.array([])
+        self.gain_sum = float(deltas.clip(min=0).sum())
+        self.loss_sum = float((-deltas).clip(min=0).sum())
+        k = min(self.vol_count, VOL_WINDOW)
+        self.vol_sum = float(sum(self.volumes[(self.vol_count - 1 - i) % VOL_WINDOW] for i in range(k)))
+        self._since_rebase = 0
+
+    # --- 讀取 ---
+    def trend(self, n):
+        """最近 n 根收盤（舊 → 新），n 最多 240"""
+        n = min(n, self.count, CAPACITY)
+        if self.count <= CAPACITY:
+            ordered = self.closes[:self.count]
+        else:
+            start = self.count % CAPACITY
+            ordered = self.closes[start:] + self.closes[:start]
+        return np.array(ordered[len(ordered) - n:])
+
+    def snapshot(self):
+        """與 radar.latest_indicators() 相同的 dict；收盤不足 20 根回傳 None"""
+        if self.count < 20:
+            return None
+        cur_p, prev = self.close_at(0), self.close_at(1)
+        ma = {f"ma{m}": (self.ma_sums[m] / m if self.count >= m else np.nan) for m in MA_WINDOWS}
+        gain, loss = self.gain_sum / RSI_PERIOD, self.loss_sum / RSI_PERIOD
+        # 滑動和相減可能留下極小的負數或殘值，視為 0
+        rsi = 100.0 if loss <= 1e-12 else 100 - (100 / (1 + max(gain, 0.0) / loss))
+        if self.vol_count >= VOL_WINDOW:
+            vol_mean = self.vol_sum / VOL_WINDOW
+            last_vol = self.volumes[(self.vol_count - 1) % VOL_WINDOW]
+            v_ratio = last_vol / vol_mean if vol_mean else np.nan
+        else:
+            v_ratio = 1.0
+        return {"price": cur_p, "change": ((cur_p - prev) / prev) * 100 if prev else np.nan, **ma,
+                "rsi": rsi, "vol_ratio": v_ratio}
+
+    # --- 持久化 ---
+    def to_dict(self):
+        n = min(self.count, CAPACITY)
+        k = min(self.vol_count, VOL_WINDOW)
+        return {
+            "closes": self.trend(n).tolist(),
+            "volumes": [self.volumes[(self.vol_count - k + i) % VOL_WINDOW] for i in range(k)],
+            "count": self.count, "vol_count": self.vol_count, "last_date": self.last_date,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """還原後重算一次滑動和（O(240)，只在載入時做）"""
+        state = cls()
+        closes, volumes = data["closes"], data["volumes"]
+        state.count = int(data["count"])
+        state.vol_count = int(data["vol_count"])
+        for back, c in enumerate(reversed(closes)):
+            state.closes[(state.count - 1 - back) % CAPACITY] = float(c)
+        for back, v in enumerate(reversed(volumes)):
+            state.volumes[(state.vol_count - 1 - back) % VOL_WINDOW] = float(v)
+        state.last_date = data.get("last_date")
+        state.rebase()
+        return state
+
+    @classmethod
+    def from_frame(cls, df):
+        """從日 K DataFrame 建立狀態（只需要最後 240 根）"""
+        state = cls()
+        sync_state(state, df.iloc[-CAPACITY:])
+        return state
+
+
+def _bar_date(ts):
+    return pd.Timestamp(ts).strftime("%Y-%m-%d")
+
+
+def sync_state(state, df):
+    """把 df 中比 state.last_date 新的 K 棒推進狀態；同一天的最後一根以 df 為準覆寫。
+
+    一般刷新只會多 0～1 根，成本與歷史長度無關。回傳實際處理的根數。
+    """
+    if df is None or df.empty:
+        return 0
+    if state.last_date is not None:
+        df = df[df.index.map(_bar_date) >= state.last_date]
+    closes = df["Close"].to_numpy(dtype=float)
+    vols = df["Volume"].to_numpy(dtype=float) if "Volume" in df else np.full(len(df), np.nan)
+    for ts, c, v in zip(df.index, closes, vols):
+        state.advance(c, v, _bar_date(ts))
+    return len(df)
+
+
+def state_indicators(state):
+    """與 radar.frame_indicators() 相同的 (收盤陣列, 指標)，可直接丟給 radar.rate_indicators()"""
+    ind = state.snapshot()
+    if ind is None:
+        return None
+    return state.trend(CAPACITY), ind
@@ -0,0 +1,166 @@
+"""盤中即時模式：批次查詢整個股票池的最新成交價，只覆寫當天那一根 K 棒。
+
+歷史 K 線照舊由 fetch_data 每 5 分鐘抓一次；盤中只用少數幾個請求拿到全部股票的最新成交，
+交給 indicators.IndicatorState 以 O(1) 覆寫最後一根（或收進新的一天），再重新評級。
+
+報價來源只要有 fetch(tickers) -> {ticker: Quote} 即可替換：
+- TwseMisSource：證交所基本市況報導（mis.twse.com.tw），上市、上櫃都查得到，一次可查上百檔
+- StaticQuoteSource：固定報價表，給測試與離線展示用
+"""
+import threading
+import time
+from collections import namedtuple
+
+import requests
+
+import radar
+import relative_strength
+from indicators import IndicatorState, state_indicators
+
+# volume 為當日累計成交股數（與 yfinance 日 K 的單位相同），date 為 "YYYY-MM-DD"；
+# indicative 為 True 表示這筆不是成交價（還沒有成交，只有委買價），不會推進指標
+Quote = namedtuple("Quote", "price volume date indicative", defaults=(False,))
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+class TwseMisSource:
+    """證交所 MIS 即時報價，依 batch_size 分批，每批一個請求"""
+    URL = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
+
+    def __init__(self, batch_size=100, timeout=5):
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    @staticmethod
+    def channel(ticker):
+        """2330.TW → tse_2330.tw、6488.TWO → otc_6488.tw"""
+        code, _, suffix = ticker.partition('.')
+        return f"{'otc' if suffix == 'TWO' else 'tse'}_{code}.tw"
+
+    @staticmethod
+    def parse(item):
+        """msgArray 的一筆 → (ticker, Quote)；沒有成交也沒有委買價時回傳 None"""
+        ticker = f"{item.get('c')}.{'TWO' if item.get('ex') == 'otc' else 'TW'}"
+        # z 是最近成交價，該筆快照沒有成交時為 "-"，改用最佳一檔委買價並標成參考價
+        price = _to_float(item.get("z"))
+        indicative = price is None
+        if indicative:
+            price = _to_float(str(item.get("b", "")).split("_")[0])
+        if price is None:
+            return None
+        lots = _to_float(item.get("v"))
+        date = str(item.get("d", ""))
+        date = f"{date[:4]}-{date[4:6]}-{date[6:8]}" if len(date) == 8 else None
+        return ticker, Quote(price, lots * 1000 if lots is not None else float("nan"), date, indicative)
+
+    def fetch(self, tickers):
+        quotes = {}
+        tickers = list(tickers)
+        for i in range(0, len(tickers), self.batch_size):
+            batch = tickers[i:i + self.batch_size]
+            try:
+                res = requests.get(self.URL, params={"ex_ch": "|".join(self.channel(t) for t in batch),
+                                                     "json": "1", "delay": "0"},
+                                   headers={"User-Agent": "Mozilla/5.0"}, timeout=self.timeout)
+                if res.status_code != 200:
+                    continue
+                for item in res.json().get("msgArray", []):
+                    parsed = self.parse(item)
+                    if parsed is not None:
+                        quotes[parsed[0]] = parsed[1]
+            except Exception as e:
+                print(f"[TwseMisSource.fetch] {len(batch)} 檔失敗: {e}")
+        return quotes
+
+
+class StaticQuoteSource:
+    """本地替身：回傳建構時給的報價表（{ticker: Quote}），可隨時改 quotes 模擬跳價"""
+
+    def __init__(self, quotes=None):
+        self.quotes = dict(quotes or {})
+        self.calls = 0
+
+    def fetch(self, tickers):
+        self.calls += 1
+        return {t: self.quotes[t] for t in tickers if t in self.quotes}
+
+
+def apply_quotes(states, quotes):
+    """把報價推進各檔狀態：同一天覆寫最後一根，新的一天收進一根新的；回傳更新的檔數
+
+    參考價（indicative，只有委買價、還沒成交）不是成交，不推進指標。
+    """
+    patched = 0
+    for t, q in quotes.items():
+        state = states.get(t)
+        if state is None or q.date is None or q.indicative:
+            continue
+        state.advance(q.price, q.volume, q.date)
+        patched += 1
+    return patched
+
+
+class LiveBoard:
+    """盤中模式的共用看板：各檔 IndicatorState 與最後一次輪詢時間，所有使用者共用一份。
+
+    輪詢間隔至少 min_interval 秒，不管多少人同時開著頁面，對報價來源的請求數都一樣；
+    每次輪詢都查看板上所有的股票（不只是觸發這次輪詢的名單），誰先刷新都不會讓別人的自選股停在舊價。
+    """
+
+    def __init__(self, source, min_interval=10):
+        self.source = source
+        self.min_interval = min_interval
+        self.states = {}
+        self.polled_at = None
+        self._lock = threading.Lock()
+
+    def missing(self, tickers):
+        return [t for t in tickers if t not in self.states]
+
+    def seed(self, data, tickers):
+        """用 fetch_data 的日 K 替還沒有狀態的代號建立狀態"""
+        with self._lock:
+            for t in self.missing(tickers):
+                df = radar.ticker_frame(data, t)
+                if df is not None and not df.empty:
+                    self.states[t] = IndicatorState.from_frame(df)
+
+    def refresh(self, tickers):
+        """距離上次輪詢超過 min_interval 才查報價；回傳本次更新的檔數（沒有輪詢時為 0）
+
+        查的是 tickers 與看板上其他所有股票的聯集（tickers 排前面），輪詢時間是整個看板共用的。
+        """
+        with self._lock:
+            now = time.time()
+            if self.polled_at is not None and now - self.polled_at < self.min_interval:
+                return 0
+            self.polled_at = now
+            tickers = list(dict.fromkeys(t for t in [*tickers, *self.states] if t in self.states))
+        try:
+            quotes = self.source.fetch(tickers)
+        except Exception as e:
+            print(f"[LiveBoard.refresh] 失敗: {e}")
+            return 0
+        with self._lock:
+            return apply_quotes(self.states, quotes)
+
+    def rank(self, stock_dict, strategy="short", fundamentals_fn=radar.fetch_fundamentals, top_n=None, keep=None,
+             rs_reference=None):
+        """與 radar.process_display 相同的 rows，指標直接取自盤中狀態；
+        盤中只有最新價在動，相對強度的期間起點不變，每次只重排一次價格向量"""
+        prepared = []
+        with self._lock:
+            for t in stock_dict:
+                state = self.states.get(t)
+                p = state_indicators(state) if state is not None else None
+                if p is not None:
+                    prepared.append((t, p))
+        rs = relative_strength.rs_map(prepared, rs_reference)
+        rated = radar.rate_prepared(prepared, strategy, keep, rs)
+        return radar.rank_rated(stock_dict, rated, fundamentals_fn, top_n)
@@ -0,0 +1,139 @@
+"""全市場掃描：上市櫃約 1,800 檔分批處理，每批算完指標就丟，只保留各策略分數前 K 名。
+
+流程：
+1. 代號依成交量排序後切成固定大小的批次。
+2. 本地歷史倉庫（HistoryStore）裡都還新鮮的批次直接讀；其餘批次丟給 thread pool，
+   過期的代號只補最近一個月、缺少的代號才抓 2 年，各合併成一次下載；
+   下載一律經過 download_scheduler（程序共用的限流、只重試失敗的代號、斷路器），避免被 Yahoo 擋 IP。
+3. 每檔只保留指標狀態（indicators.IndicatorState），新 K 棒 O(1) 推進。
+4. 相對強度要跟全市場比，所以先留下每檔的（最多 241 根收盤, 指標），全市場約 3.5 MB，
+   一次向量化排名（relative_strength）後，評級結果才推進大小為 K 的 heap。
+5. 最後只對入選的 K 檔補上走勢圖與基本面。
+"""
+import heapq
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import radar
+import download_scheduler
+import relative_strength
+from indicators import IndicatorState, state_indicators, sync_state
+
+STRATEGIES = ("short", "medium", "long")
+# 過期的代號只補最近一個月的 K 棒；最後一根距今超過這麼多天就整段重抓
+INCREMENTAL_PERIOD = "1mo"
+INCREMENTAL_MAX_GAP = 20
+
+
+def chunked(seq, size):
+    return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+
+def _can_increment(state):
+    last = pd.Timestamp(state.last_date) if state.last_date else None
+    return last is not None and (pd.Timestamp.now() - last).days <= INCREMENTAL_MAX_GAP
+
+
+def load_chunk(chunk, store=None, scheduler=None, max_age=None):
+    """一批代號 → {ticker: IndicatorState}
+
+    倉庫裡新鮮的直接讀指標狀態；過期但狀態夠新的只下載最近一個月，把新 K 棒 O(1) 推進狀態；
+    完全沒有資料（或斷太久）的才下載 2 年重建。下載（含重試後）仍失敗時沿用倉庫裡的舊狀態，
+    所以不向排程器要最後已知資料，免得把舊資料當成剛下載的寫回倉庫。
+    """
+    scheduler = scheduler or download_scheduler.SCHEDULER
+    states, stale, missing = {}, [], []
+    for t in chunk:
+        state = store.load_state(t) if store is not None else None
+        if state is None and store is not None:
+            # 舊版倉庫只有 K 線檔：讀一次建好狀態
+            df = store.load(t, float("inf"))
+            if df is not None:
+                state = IndicatorState.from_frame(df)
+                store.save_state(t, state)
+        if state is None:
+            missing.append(t)
+            continue
+        states[t] = state
+        if not store.is_fresh(t, max_age):
+            (stale if _can_increment(state) else missing).append(t)
+
+    for tickers, period in ((stale, INCREMENTAL_PERIOD), (missing, "2y")):
+        if not tickers:
+            continue
+        for t, df in scheduler.fetch_frames(tickers, period, fallback=False).items():
+            if period == INCREMENTAL_PERIOD:
+                sync_state(states[t], df)
+                if store is not None:
+                    store.append(t, df)
+            else:
+                states[t] = IndicatorState.from_frame(df)
+                if store is not None:
+                    store.save(t, df)
+            if store is not None:
+                store.save_state(t, states[t])
+    return states
+
+
+def iter_states(tickers, store=None, chunk_size=100, max_workers=8, scheduler=None, max_age=None):
+    """依批次載入 tickers 的 IndicatorState，逐批 yield {ticker: state}
+
+    倉庫已有的批次直接在主執行緒讀，需要下載的批次丟背景執行緒，不必跟下載搶 GIL；
+    請求頻率由 scheduler（預設為程序共用的 download_scheduler.SCHEDULER）的 token bucket 控制。
+    """
+    chunks = chunked(list(tickers), chunk_size)
+    warm = [c for c in chunks if store is not None and all(store.is_fresh(t, max_age) for t in c)]
+    cold = [c for c in chunks if c not in warm]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(load_chunk, c, store, scheduler, max_age) for c in cold]
+        for c in warm:
+            yield load_chunk(c, store, scheduler, max_age)
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+def market_indicators(listings, store=None, **kwargs):
+    """listings 每一檔的 (ticker, (收盤 trend, 指標 dict))，資料不足的略過；給 screener.build_table 用"""
+    names = [item[0] for item in listings]
+    prepared = []
+    for states in iter_states(names, store, **kwargs):
+        for t, state in states.items():
+            try:
+                p = state_indicators(state)
+            except Exception as e:
+                print(f"[market_indicators] 處理 {t} 失敗: {e}")
+                continue
+            if p is not None:
+                prepared.append((t, p))
+    return prepared
+
+
+def scan_market(listings, k=50, strategies=STRATEGIES, store=None, chunk_size=100, max_workers=8,
+                scheduler=None, max_age=None, fundamentals_fn=radar.fetch_fundamentals, keep=None):
+    """掃描 listings（fetch_market_listings() 的結果或 [(code, name)]），回傳 {strategy: 前 k 名 rows}
+
+    rows 格式與 process_display 相同；同分時依相對強度，再同分依 listings 順序（成交量大的在前）。
+    keep 為 radar.make_row_filter() 的篩選條件，在進 heap 前套用（相對強度仍以全市場為準）。
+    """
+    names = {item[0]: item[1] for item in listings}
+    seq = {t: i for i, t in enumerate(names)}
+    heaps = {s: [] for s in strategies}
+    prepared = market_indicators(listings, store, chunk_size=chunk_size, max_workers=max_workers,
+                                 scheduler=scheduler, max_age=max_age)
+
+    rs = relative_strength.rs_map(prepared)
+    for s in strategies:
+        heap = heaps[s]
+        for t, r in radar.rate_prepared(prepared, s, keep, rs):
+            item = (*radar.rank_key(r), -seq[t], t, r)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item[:3] > heap[0][:3]:
+                heapq.heapreplace(heap, item)
+
+    result = {}
+    for s, heap in heaps.items():
+        top = sorted(heap, key=lambda item: item[:3], reverse=True)
+        result[s] = [radar.finish_row(t, names[t], r, fundamentals_fn) for *_, t, r in top]
+    return result
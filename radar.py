@@ -0,0 +1,593 @@
+"""台股 AI 趨勢雷達：與 Streamlit 無關的資料抓取、指標與評級邏輯。
+
+app.py 負責介面與快取；這裡的函式不依賴 Streamlit runtime，
+可直接給 benchmark、批次工具或回測腳本 import 使用。
+
+yfinance 載入要數百毫秒，只在真的要連 Yahoo 時才 import（快取、快照命中時整個程序都不必載入）。
+"""
+import heapq
+import requests
+import re
+import weakref
+import numpy as np
+import pandas as pd
+
+import download_scheduler
+import relative_strength
+
+# --- 策略參數常數 ---
+VOL_SURGE_THRESHOLD = 1.2
+BIAS_STRONG_PCT     = 5.0
+NEAR_MA_RANGE       = 0.05
+SHORT_TARGET_MULT   = 1.10
+MEDIUM_TARGET_MULT  = 1.15
+LONG_TARGET_MULT    = 1.30
+
+# --- 靜態保底百大清單 ---
+MEGA_STOCKS = [
+    ("2330.TW", "台積電"), ("2317.TW", "鴻海"), ("2454.TW", "聯發科"), ("2382.TW", "廣達"), ("2308.TW", "台達電"),
+    ("2881.TW", "富邦金"), ("2882.TW", "國泰金"), ("2891.TW", "中信金"), ("2303.TW", "聯電"), ("3711.TW", "日月光投控"),
+    ("2886.TW", "兆豐金"), ("3231.TW", "緯創"), ("2884.TW", "玉山金"), ("2357.TW", "華碩"), ("2892.TW", "第一金"),
+    ("5880.TW", "合庫金"), ("2885.TW", "元大金"), ("2880.TW", "華南金"), ("2890.TW", "永豐金"), ("2883.TW", "凱基金"),
+    ("2887.TW", "台新金"), ("2801.TW", "彰銀"), ("2834.TW", "臺企銀"), ("2412.TW", "中華電"), ("3045.TW", "台灣大"),
+    ("4904.TW", "遠傳"), ("2603.TW", "長榮"), ("2609.TW", "陽明"), ("2615.TW", "萬海"), ("1216.TW", "統一"),
+    ("2002.TW", "中鋼"), ("1303.TW", "南亞"), ("1301.TW", "台塑"), ("1326.TW", "台化"), ("3008.TW", "大立光"),
+    ("2327.TW", "國巨"), ("2379.TW", "瑞昱"), ("3034.TW", "聯詠"), ("2376.TW", "技嘉"), ("2356.TW", "英業達"),
+    ("6669.TW", "緯穎"), ("3661.TW", "世芯-KY"), ("3443.TW", "創意"), ("2207.TW", "和泰車"), ("2912.TW", "統一超"),
+    ("1519.TW", "華城"), ("5871.TW", "中租-KY"), ("2301.TW", "光寶科"), ("3017.TW", "奇鋐"), ("2383.TW", "台光電"),
+    ("4953.TWO", "緯軟"), ("3293.TWO", "鈊象"), ("5274.TWO", "信驊"), ("3529.TWO", "力旺"), ("8299.TWO", "群聯"),
+    ("5347.TWO", "世界先進"), ("6488.TWO", "環球晶"), ("5483.TWO", "中美晶"), ("3105.TWO", "穩懋"), ("3324.TWO", "雙鴻"),
+    ("6274.TWO", "台燿"), ("8069.TWO", "元太"), ("2453.TW", "凌群"), ("1618.TW", "合機"), ("1513.TW", "中興電"),
+    ("1503.TW", "士電"), ("1514.TW", "亞力"), ("3583.TW", "辛耘"), ("8210.TW", "勤誠"), ("3533.TW", "嘉澤"),
+    ("0050.TW", "元大台灣50"), ("006208.TW", "富邦台50"), ("0056.TW", "元大高股息"), ("00878.TW", "國泰永續高股息"),
+    ("00919.TW", "群益台灣精選高息"), ("00929.TW", "復華台灣科技優息"), ("00940.TW", "元大台灣價值高息"),
+    ("00713.TW", "元大台灣高息低波"), ("00915.TW", "凱基優選高股息30"), ("00679B.TWO", "元大美債20年")
+]
+
+LOCAL_NAME_DICT = {n: (c, n) for c, n in MEGA_STOCKS}
+LOCAL_DICT = {c.split('.')[0]: (c, n) for c, n in MEGA_STOCKS}
+
+# --- 動態抓取 0050 成分股 ---
+def fetch_0050_constituents():
+    fallback_0050 = MEGA_STOCKS[:50]
+    try:
+        url = "https://www.yuantaetfs.com/api/StkWeights?date=&fundid=1066"
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        r = requests.get(url, headers=headers, timeout=5)
+        if r.status_code == 200:
+            data = r.json()
+            dynamic_0050 = []
+            for item in data:
+                code = str(item.get("stkCd", "")).strip()
+                name = str(item.get("stkNm", "")).strip()
+                if code.isdigit():
+                    dynamic_0050.append((f"{code}.TW", name))
+            if len(dynamic_0050) >= 40:
+                return dynamic_0050
+    except Exception as e:
+        print(f"[fetch_0050_constituents] 失敗: {e}")
+    return fallback_0050
+
+# --- 動態抓取上市櫃全部清單 / 百大熱門股 ---
+def fetch_market_listings():
+    """抓取上市 + 上櫃全部個股與 ETF，依成交量由大到小排序；回傳 [(code, name, vol)]，失敗回傳 None"""
+    stocks = []
+    try:
+        r_twse = requests.get("https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL", timeout=5)
+        if r_twse.status_code == 200:
+            for item in r_twse.json():
+                code = str(item.get("Code", ""))
+                if len(code) == 4 or code.startswith('00'):
+                    vol_str = str(item.get("TradeVolume", "0")).replace(',', '')
+                    if vol_str.isdigit():
+                        stocks.append({"code": f"{code}.TW", "name": str(item.get("Name", "")), "vol": int(vol_str)})
+
+        r_tpex = requests.get("https://www.tpex.org.tw/openapi/v1/tpex_mainboard_quotes", timeout=5)
+        if r_tpex.status_code == 200:
+            for item in r_tpex.json():
+                code = str(item.get("SecuritiesCompanyCode", ""))
+                if len(code) == 4 or code.startswith('00'):
+                    vol_str = str(item.get("TradingVolume", "0")).replace(',', '')
+                    if vol_str.isdigit():
+                        # TPEX 成交量單位為「千股」，TWSE 為「股」，統一換算為股才能公平排序
+                        stocks.append({"code": f"{code}.TWO", "name": str(item.get("CompanyName", "")), "vol": int(vol_str) * 1000})
+
+        if not stocks:
+            return None
+        stocks = sorted(stocks, key=lambda x: x['vol'], reverse=True)
+        return [(s["code"], s["name"], s["vol"]) for s in stocks]
+    except Exception as e:
+        print(f"[fetch_market_listings] 失敗: {e}")
+        return None
+
+def fetch_dynamic_hot_stocks(listings=None):
+    """成交量前 100 名；listings 可傳入已快取的 fetch_market_listings() 結果"""
+    if listings is None:
+        listings = fetch_market_listings()
+    if not listings:
+        return None
+    return [(c, n) for c, n, _ in listings[:100]]
+
+def build_watch_list(constituents, hot=None, extra=None):
+    """系統 Tab 的預設名單：0050 成分股 + 保底清單 + 百大熱門股（+ 自選股），後面的覆蓋前面的股名"""
+    watch = {c: n for c, n in list(constituents) + MEGA_STOCKS[50:]}
+    watch.update({c: n for c, n in hot or []})
+    watch.update(extra or {})
+    return watch
+
+# --- 搜尋系統 ---
+def probe_yfinance(symbol):
+    import yfinance as yf
+    try:
+        t = yf.Ticker(symbol)
+        hist = t.history(period="1d")
+        if not hist.empty:
+            return True
+    except Exception as e:
+        print(f"[probe_yfinance] {symbol} 失敗: {e}")
+    return False
+
+def search_yahoo_api(query):
+    url = "https://tw.stock.yahoo.com/_td-stock/api/resource/AutocompleteService"
+    try:
+        r = requests.get(url, params={"query": query, "limit": 5}, headers={'User-Agent': 'Mozilla/5.0'}, timeout=3)
+        data = r.json()
+        for res in data.get('data', {}).get('result', []):
+            sym = str(res.get('symbol', '')).strip().upper()
+            name = str(res.get('name', '')).strip()
+            if query in sym or query in name:
+                if sym.endswith('.TW') or sym.endswith('.TWO'):
+                    return sym, name
+                exch = str(res.get('exchange', '')).upper()
+                if exch == 'TAI':
+                    return f"{sym}.TW", name
+                if 'TWO' in exch or 'TPEX' in exch or 'GRE TAI' in exch:
+                    return f"{sym}.TWO", name
+    except Exception as e:
+        print(f"[search_yahoo_api] 查詢 {query} 失敗: {e}")
+    return None, None
+
+def scrape_yahoo_name(symbol):
+    url = f"https://tw.stock.yahoo.com/quote/{symbol}"
+    try:
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        r = requests.get(url, headers=headers, timeout=3)
+        if r.status_code == 200:
+            match = re.search(r'<title>(.*?)[\(（]', r.text)
+            if match and "Yahoo" not in match.group(1):
+                return match.group(1).strip()
+    except Exception as e:
+        print(f"[scrape_yahoo_name] {symbol} 失敗: {e}")
+    return None
+
+def validate_and_add(query, custom_list=None, resolve=None):
+    """查詢輸入的代號或股名 → (symbol, name, 錯誤訊息)；resolve 讓 app.py 傳入帶共用快取的 resolve_symbol"""
+    raw_query = query.strip()  # 保留原始輸入（含中文）
+    query = raw_query.upper()  # 大寫版本用於英文/數字比對
+
+    for c, n in (custom_list or {}).items():
+        if query == c or raw_query == n or query == c.split('.')[0]:
+            return c, n, None
+
+    found = (resolve or resolve_symbol)(raw_query)
+    if found:
+        return found[0], found[1], None
+    return None, None, f"在所有市場資料庫中都找不到「{query}」。請確認股票代碼是否正確。"
+
+def resolve_symbol(raw_query):
+    """代號或股名 → (symbol, name)；找不到回傳 None。結果與使用者無關，可以跨使用者快取"""
+    query = raw_query.upper()
+
+    # 先用數字代碼查保底字典
+    if query in LOCAL_DICT:
+        return LOCAL_DICT[query]
+
+    # 再用中文名稱查保底字典（支援輸入「鴻海」、「台積電」等）
+    if raw_query in LOCAL_NAME_DICT:
+        return LOCAL_NAME_DICT[raw_query]
+
+    s, n = search_yahoo_api(raw_query)
+    if s and n:
+        if probe_yfinance(s):
+            return s, n
+        alt_s = s.replace('.TW', '.TWO') if '.TW' in s else s.replace('.TWO', '.TW')
+        if probe_yfinance(alt_s):
+            return alt_s, n
+
+    if query.isdigit():
+        for ext in [".TW", ".TWO"]:
+            target = f"{query}{ext}"
+            if probe_yfinance(target):
+                name = scrape_yahoo_name(target)
+                if name:
+                    return target, name
+                return target, f"{query} (系統抓取)"
+
+    if probe_yfinance(query):
+        return query, query
+
+    return None
+
+# --- 分析與繪圖組件 ---
+def calculate_rsi(series, period=14):
+    delta = series.diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
+    rs = np.where(loss == 0, np.inf, gain / loss)
+    return pd.Series(np.where(loss == 0, 100, 100 - (100 / (1 + rs))), index=series.index)
+
+def analyze_logic(cur_p, ma20, ma60, ma120, ma240, vol_ratio, rsi, strategy="short"):
+    if ma60 is None:
+        return "觀察", "tag-hold", 40, "資料不足", cur_p
+    bias_20 = ((cur_p - ma20) / ma20) * 100
+    if strategy == "short":
+        if cur_p > ma20 and bias_20 > BIAS_STRONG_PCT and vol_ratio > VOL_SURGE_THRESHOLD:
+            return "強力推薦", "tag-strong", 90, "站上月線且爆量攻擊", cur_p * SHORT_TARGET_MULT
+        return ("買進", "tag-buy", 70, "月線附近震盪", cur_p * SHORT_TARGET_MULT) if cur_p > ma20 else ("觀察", "tag-hold", 50, "月線附近震盪", cur_p * SHORT_TARGET_MULT)
+    elif strategy == "medium":
+        if ma120 and cur_p > ma120 and ma60 > ma120:
+            return "強力推薦", "tag-strong", 95, "中長多格局", cur_p * MEDIUM_TARGET_MULT
+        return "回檔佈局", "tag-buy", 80, "季線支撐", ma60
+    else:
+        if ma240 and abs((cur_p - ma240) / ma240) < NEAR_MA_RANGE:
+            return "長線買點", "tag-strong", 95, "年線價值區", ma240 * LONG_TARGET_MULT
+        return "長多續抱", "tag-buy", 80, "站穩年線", cur_p * LONG_TARGET_MULT
+
+def strategy_params(**overrides):
+    """策略常數打包成 dict；回測、參數掃描用 overrides 換掉個別常數"""
+    params = {
+        "VOL_SURGE_THRESHOLD": VOL_SURGE_THRESHOLD, "BIAS_STRONG_PCT": BIAS_STRONG_PCT,
+        "NEAR_MA_RANGE": NEAR_MA_RANGE, "SHORT_TARGET_MULT": SHORT_TARGET_MULT,
+        "MEDIUM_TARGET_MULT": MEDIUM_TARGET_MULT, "LONG_TARGET_MULT": LONG_TARGET_MULT,
+    }
+    unknown = set(overrides) - set(params)
+    if unknown:
+        raise KeyError(f"未知的策略參數: {sorted(unknown)}")
+    params.update(overrides)
+    return params
+
+# analyze_vectorized 回傳的評級代碼 → (評級, 樣式, 分數)，順序與 analyze_logic 的分支相同
+VECTOR_RATINGS = {
+    "short": (("強力推薦", "tag-strong", 90), ("買進", "tag-buy", 70), ("觀察", "tag-hold", 50)),
+    "medium": (("強力推薦", "tag-strong", 95), ("回檔佈局", "tag-buy", 80)),
+    "long": (("長線買點", "tag-strong", 95), ("長多續抱", "tag-buy", 80)),
+}
+
+def analyze_vectorized(cur_p, ma20, ma60, ma120, ma240, vol_ratio, strategy="short", params=None):
+    """analyze_logic 的陣列版（改規則時兩邊要一起改）：輸入同形狀的 numpy 陣列，回傳 (評級代碼, 目標價)。
+
+    評級代碼對應 VECTOR_RATINGS[strategy]；NaN 參與比較一律為 False，結果與逐筆呼叫 analyze_logic 相同。
+    """
+    p = params or strategy_params()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if strategy == "short":
+            above = cur_p > ma20
+            bias_20 = ((cur_p - ma20) / ma20) * 100
+            strong = above & (bias_20 > p["BIAS_STRONG_PCT"]) & (vol_ratio > p["VOL_SURGE_THRESHOLD"])
+            code = np.where(strong, 0, np.where(above, 1, 2))
+            target = cur_p * p["SHORT_TARGET_MULT"]
+        elif strategy == "medium":
+            strong = (ma120 != 0) & (cur_p > ma120) & (ma60 > ma120)
+            code = np.where(strong, 0, 1)
+            target = np.where(strong, cur_p * p["MEDIUM_TARGET_MULT"], ma60)
+        else:
+            strong = (ma240 != 0) & (np.abs((cur_p - ma240) / ma240) < p["NEAR_MA_RANGE"])
+            code = np.where(strong, 0, 1)
+            target = np.where(strong, ma240 * p["LONG_TARGET_MULT"], cur_p * p["LONG_TARGET_MULT"])
+    return code.astype(np.int8), target
+
+def fetch_fundamentals(ticker: str) -> dict:
+    """抓取單一股票的基本面資料（快取由呼叫端負責）"""
+    import yfinance as yf
+    try:
+        info = yf.Ticker(ticker).info
+        def fmt(val, suffix="", decimals=2):
+            if val is None or val != val:  # None or NaN
+                return "N/A"
+            if isinstance(val, float):
+                return f"{val:.{decimals}f}{suffix}"
+            return f"{val}{suffix}"
+
+        # 營收年增率：用 trailingAnnualRevenue 和 revenueGrowth
+        rev_growth = info.get("revenueGrowth")
+        rev_str = f"{rev_growth*100:.1f}%" if rev_growth is not None else "N/A"
+
+        eps = info.get("trailingEps")
+        pe  = info.get("trailingPE")
+        pb  = info.get("priceToBook")
+        dy  = info.get("dividendYield")
+        mc  = info.get("marketCap")
+        gm  = info.get("grossMargins")
+        om  = info.get("operatingMargins")
+        eps_fwd = info.get("forwardEps")
+        pe_fwd  = info.get("forwardPE")
+
+        mc_str = "N/A"
+        if mc:
+            if mc >= 1e12:
+                mc_str = f"{mc/1e12:.2f}兆"
+            elif mc >= 1e8:
+                mc_str = f"{mc/1e8:.0f}億"
+            else:
+                mc_str = f"{mc:,.0f}"
+
+        return {
+            "EPS（近4季）":    fmt(eps, " 元"),
+            "EPS（預估）":     fmt(eps_fwd, " 元"),
+            "本益比（近4季）": fmt(pe, "x", 1),
+            "本益比（預估）":  fmt(pe_fwd, "x", 1),
+            "股價淨值比":      fmt(pb, "x", 2),
+            "殖利率":          f"{dy*100:.2f}%" if dy else "N/A",
+            "毛利率":          f"{gm*100:.1f}%" if gm else "N/A",
+            "營業利益率":      f"{om*100:.1f}%" if om else "N/A",
+            "營收年增率":      rev_str,
+            "市值":            mc_str,
+            "產業":            info.get("sector") or "N/A",
+        }
+    except Exception as e:
+        print(f"[fetch_fundamentals] {ticker} 失敗: {e}")
+        return {}
+
+def fetch_data(tickers: tuple):
+    """2 年日 K，(ticker, field) 欄位；經過 download_scheduler：分批、限流、只重試失敗的代號，
+    Yahoo 不健康時以最後已知資料補上，不會默默少掉幾檔"""
+    if not tickers:
+        return None
+    return download_scheduler.SCHEDULER.fetch(tickers, "2y")
+
+# 大盤圖的週期選項 → (period, interval)
+TAIEX_PERIODS = {"日線": ("2y", "1d"), "週線": ("10y", "1wk"), "月線": ("20y", "1mo")}
+
+def fetch_taiex(period="2y", interval="1d"):
+    """加權指數 K 線，欄位攤平成單層（Open / High / Low / Close / Volume）"""
+    import yfinance as yf
+    # 與日 K 下載共用同一個 token bucket 與斷路器；Yahoo 不健康時回傳空表
+    df = download_scheduler.SCHEDULER.call(yf.download, "^TWII", period=period, interval=interval, progress=False)
+    if df is None:
+        return pd.DataFrame()
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.droplevel(1)
+    return df
+
+# 各策略走勢圖取的天數
+TREND_LEN = {"short": 60, "medium": 120, "long": 240}
+
+def latest_indicators(closes, vols):
+    """只取最後一筆需要的指標：MA 用尾端平均、RSI 用最後 15 根，不必對整段 2 年資料做 rolling。
+
+    closes / vols 為已去除 NaN 的 numpy 陣列，結果與 rolling().mean().iloc[-1]、calculate_rsi(...).iloc[-1] 相同。
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cur_p = closes[-1]
+        change = ((closes[-1] - closes[-2]) / closes[-2]) * 100
+        ma20, ma60, ma120, ma240 = [closes[-m:].mean() if len(closes) >= m else np.nan for m in (20, 60, 120, 240)]
+        delta = np.diff(closes[-15:])
+        gain = delta.clip(min=0).mean()
+        loss = (-delta).clip(min=0).mean()
+        rsi = 100.0 if loss == 0 else 100 - (100 / (1 + gain / loss))
+        v_ratio = vols[-1] / vols[-5:].mean() if len(vols) >= 5 else 1.0
+    return {"price": cur_p, "change": change, "ma20": ma20, "ma60": ma60, "ma120": ma120, "ma240": ma240,
+            "rsi": rsi, "vol_ratio": v_ratio}
+
+def frame_indicators(df):
+    """單檔日 K → (去掉 NaN 的收盤陣列, latest_indicators 結果)；收盤資料不足 20 筆回傳 None"""
+    closes = df['Close'].dropna().to_numpy(dtype=float)
+    if len(closes) < 20:
+        return None
+    vols = df['Volume'].dropna().to_numpy(dtype=float)
+    return closes, latest_indicators(closes, vols)
+
+def rate_indicators(closes, ind, strategy="short", rs=None):
+    """套用 analyze_logic，回傳評級結果（不含股名、基本面）；同一檔換策略時不必重算指標。
+    rs 為 relative_strength 算好的相對強度（1～99，算不出來為 None），同分時的第二排序鍵"""
+    rating, cls, score, reason, target = analyze_logic(
+        ind["price"], ind["ma20"], ind["ma60"], ind["ma120"], ind["ma240"], ind["vol_ratio"], ind["rsi"], strategy)
+    return {
+        "price": ind["price"], "change": ind["change"], "target": target, "rating": rating, "cls": cls,
+        "reason": reason, "score": score, "rs": rs, "trend": closes[-TREND_LEN[strategy]:],
+    }
+
+def rate_frame(df, strategy="short"):
+    """單檔日 K → 評級結果；收盤資料不足 20 筆回傳 None"""
+    prepared = frame_indicators(df)
+    if prepared is None:
+        return None
+    return rate_indicators(*prepared, strategy)
+
+def finish_row(ticker, name, rated, fundamentals_fn=fetch_fundamentals):
+    """補上顯示用欄位（股名、連結、走勢 list、基本面），只對真的要顯示的列呼叫"""
+    row = {"ticker": ticker, "code": ticker.split('.')[0], "name": name, **rated}
+    row["trend"] = rated["trend"].tolist()
+    row["url"] = f"https://tw.stock.yahoo.com/quote/{ticker}"
+    row["fundamentals"] = fundamentals_fn(ticker)
+    return row
+
+# id(panel) → {ticker: 欄位位置}；面板被回收時由 weakref.finalize 移除
+_PANEL_COLUMNS = {}
+
+
+def _panel_columns(data):
+    """整張面板只掃一次第一層欄名，之後每檔查詢都是 O(1)；欄位連續時存 slice，取出來不必複製"""
+    key = id(data)
+    groups = _PANEL_COLUMNS.get(key)
+    if groups is None:
+        positions = {}
+        for i, t in enumerate(data.columns.get_level_values(0)):
+            positions.setdefault(t, []).append(i)
+        groups = {t: slice(p[0], p[-1] + 1) if p[-1] - p[0] + 1 == len(p) else p
+                  for t, p in positions.items()}
+        _PANEL_COLUMNS[key] = groups
+        weakref.finalize(data, _PANEL_COLUMNS.pop, key, None)
+    return groups
+
+
+def ticker_frame(data, ticker):
+    """從 yf.download(group_by='ticker') 的結果（或 {ticker: 日 K}）取出單檔；不存在回傳 None
+
+    MultiIndex 面板的欄位索引每張面板只建一次（面板視為唯讀），逐檔取幾千檔也不會變成 O(N²)。
+    """
+    if isinstance(data, dict):
+        return data.get(ticker)
+    if isinstance(data.columns, pd.MultiIndex):
+        cols = _panel_columns(data).get(ticker)
+        if cols is None:
+            return None
+        df = data.iloc[:, cols]
+        df.columns = data.columns[cols].droplevel(0)
+        return df
+    return data
+
+# analyze_logic 可能給出的評級，依強弱排列（給篩選器用）
+RATINGS = ("強力推薦", "長線買點", "買進", "回檔佈局", "長多續抱", "觀察")
+
+def make_row_filter(ratings=None, change_range=None, price_range=None):
+    """伺服器端篩選條件 → rated -> bool；參數為 None / 空值表示不限制"""
+    def keep(r):
+        if ratings and r["rating"] not in ratings:
+            return False
+        if change_range and not (change_range[0] <= r["change"] <= change_range[1]):
+            return False
+        if price_range and not (price_range[0] <= r["price"] <= price_range[1]):
+            return False
+        return True
+    return keep
+
+def rate_prepared(prepared, strategy="short", keep=None, rs=None):
+    """[(ticker, (收盤陣列, 指標))] → [(ticker, 評級結果)]
+
+    相對強度在 keep 篩選之前、對整個 prepared 一次排名，篩選掉的股票仍算在百分位的分母裡；
+    多種策略共用同一個股票池時先用 relative_strength.rs_map 算好傳進 rs，不必每種策略各排一次。
+    """
+    if rs is None:
+        rs = relative_strength.rs_map(prepared)
+    rated = []
+    for t, p in prepared:
+        r = rate_indicators(*p, strategy, rs=rs[t])
+        if keep is None or keep(r):
+            rated.append((t, r))
+    return rated
+
+def process_display(stock_dict, strategy="short", fetch=fetch_data, fundamentals_fn=fetch_fundamentals,
+                    top_n=None, keep=None, rs_reference=None):
+    """計算評級並依分數（同分再依相對強度）排序；fetch / fundamentals_fn 讓 app.py 傳入帶快取的版本。
+    rs_reference 為相對強度的基準（relative_strength.reference_scores），None 表示以 stock_dict 自己為準
+
+    先對全部股票只算評級，套用 keep 篩選並用 heap 取前 top_n 名，
+    走勢圖與基本面只替最後要顯示的列補上，成本跟著顯示筆數走而不是跟著股票池大小。
+    """
+    tickers = list(stock_dict.keys())
+    if not tickers:
+        return []
+    data = fetch(tuple(sorted(tickers)))
+    prepared = []
+    for t in tickers:
+        try:
+            df = ticker_frame(data, t)
+            p = frame_indicators(df) if df is not None else None
+            if p is not None:
+                prepared.append((t, p))
+        except Exception as e:
+            print(f"[process_display] 處理 {t} 失敗: {e}")
+            continue
+    rated = rate_prepared(prepared, strategy, keep, relative_strength.rs_map(prepared, rs_reference))
+    return rank_rated(stock_dict, rated, fundamentals_fn, top_n)
+
+def rank_key(rated):
+    """排行的排序鍵：分數，同分再比相對強度（算不出來的排在同分的最後）"""
+    rs = rated.get("rs")
+    return rated["score"], -1 if rs is None else rs
+
+def rank_rated(stock_dict, rated, fundamentals_fn=fetch_fundamentals, top_n=None):
+    """[(ticker, 評級結果)] 依 rank_key 排序、取前 top_n 名，只替入選的列補上顯示欄位"""
+    if top_n is None:
+        chosen = sorted(rated, key=lambda x: rank_key(x[1]), reverse=True)
+    else:
+        # nlargest 與 sorted(..., reverse=True)[:n] 結果相同（同分維持原順序），但只需 O(N log n)
+        chosen = heapq.nlargest(top_n, rated, key=lambda x: rank_key(x[1]))
+    return [finish_row(t, stock_dict[t], r, fundamentals_fn) for t, r in chosen]
+
+def render_table(rows, date_label):
+    html = f"""
+    <style>
+        table {{ width: 100%; border-collapse: collapse; font-family: sans-serif; font-size: 14px; }}
+        th {{ background: #f2f2f2; padding: 10px; text-align: left; position: sticky; top: 0; border-bottom: 2px solid #ddd; z-index: 10; }}
+        td {{ padding: 10px; border-bottom: 1px solid #eee; vertical-align: middle; }}
+        .up {{ color: #d62728; font-weight: bold; }} .down {{ color: #2ca02c; font-weight: bold; }}
+        .tag-strong {{ background: #ffebeb; color: #d62728; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
+        .tag-buy {{ background: #e6ffe6; color: #2ca02c; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
+        .tag-sell {{ background: #f1f3f5; color: #495057; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
+        .tag-hold {{ background: #fff; border: 1px solid #eee; color: #868e96; padding: 4px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor:pointer;}}
+        .tooltip-wrap {{ position: relative; display: inline-block; }}
+        .tooltip-box {{
+            display: none; position: fixed; z-index: 9999;
+            background: #1e2a3a; color: #f0f4f8;
+            padding: 12px 16px; border-radius: 10px;
+            font-size: 13px; line-height: 1.8;
+            box-shadow: 0 4px 20px rgba(0,0,0,0.5);
+            min-width: 220px; pointer-events: none;
+            border: 1px solid #3a4f63;
+        }}
+        .tooltip-box table {{ background: transparent; width: 100%; font-size: 13px; }}
+        .tooltip-box td {{ padding: 2px 6px; border: none; color: #f0f4f8; }}
+        .tooltip-box td:first-child {{ color: #a0b4c8; white-space: nowrap; }}
+        .tooltip-box td:last-child {{ font-weight: bold; text-align: right; }}
+        .tooltip-title {{ font-size: 14px; font-weight: bold; color: #fff; margin-bottom: 6px; border-bottom: 1px solid #3a4f63; padding-bottom: 4px; }}
+    </style>
+    <div id="tt" class="tooltip-box"></div>
+    <script>
+    function bindTooltips() {{
+        var tt = document.getElementById("tt");
+        if (!tt) return;
+        document.querySelectorAll(".has-tip").forEach(function(el) {{
+            if (el._tipBound) return;
+            el._tipBound = true;
+            el.addEventListener("mouseenter", function(e) {{
+                tt.innerHTML = this.getAttribute("data-tip");
+                tt.style.display = "block";
+            }});
+            el.addEventListener("mousemove", function(e) {{
+                var x = e.clientX + 16;
+                var y = e.clientY + 8;
+                if (x + 220 > window.innerWidth) x = e.clientX - 236;
+                if (y + 260 > window.innerHeight) y = e.clientY - 270;
+                tt.style.left = x + "px";
+                tt.style.top  = y + "px";
+            }});
+            el.addEventListener("mouseleave", function() {{
+                tt.style.display = "none";
+            }});
+        }});
+    }}
+    // 確保 DOM 完全載入後才綁定
+    if (document.readyState === "loading") {{
+        document.addEventListener("DOMContentLoaded", bindTooltips);
+    }} else {{
+        bindTooltips();
+    }}
+    // 額外保險：用 MutationObserver 偵測動態插入的元素
+    var observer = new MutationObserver(function() {{ bindTooltips(); }});
+    observer.observe(document.body, {{ childList: true, subtree: true }});
+    </script>
+    <p style="font-family:sans-serif; font-size:12px; color:#888; margin:4px 0 8px;">
+        ⚠️ 以下評級與目標價為演算法估算，非投資建議，投資人應自行判斷。
+    </p>
+    <table>
+        <thead><tr><th>代號</th><th>股名</th><th>現價</th><th>漲跌</th><th>目標價({date_label})</th><th>AI評級</th><th>趨勢</th></tr></thead>
+        <tbody>
+    """
+    for r in rows:
+        color = "up" if r['change'] > 0 else "down"
+        mn, mx = min(r['trend']), max(r['trend'])
+        if mx == mn:
+            spark = '<svg width="150" height="40"><line x1="0" y1="20" x2="150" y2="20" stroke="#aaa" stroke-width="2"/></svg>'
+        else:
+            pts = " ".join([f"{(i / (len(r['trend']) - 1)) * 150},{40 - ((v - mn) / (mx - mn)) * 30 - 5}" for i, v in enumerate(r['trend'])])
+            spark = f'<svg width="150" height="40"><polyline points="{pts}" fill="none" stroke="{"#d62728" if r["trend"][-1] > r["trend"][0] else "#2ca02c"}" stroke-width="2"/></svg>'
+
+        # 建立浮動視窗的 HTML 內容
+        fund = r.get("fundamentals", {})
+        tip_rows = "".join([f"<tr><td>{k}</td><td>{v}</td></tr>" for k, v in fund.items()])
+        tip_html = f'''<div class="tooltip-title">{r["code"]} {r["name"]}</div><table>{tip_rows}</table>'''
+        tip_html = tip_html.replace('"', '&quot;')
+        html += f"<tr><td><a href='{r['url']}' target='_blank'>{r['code']}</a></td><td>{r['name']}</td><td class='{color}'>{r['price']:.1f}</td><td class='{color}'>{r['change']:.2f}%</td><td>{r['target']:.1f}</td><td><span class='{r['cls']} has-tip' data-tip='{tip_html}'>{r['rating']}</span><br><small>{r['reason']}</small></td><td>{spark}</td></tr>"
+    return html + "</tbody></table>"
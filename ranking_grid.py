@@ -0,0 +1,291 @@
+"""排行表的瀏覽器端元件：伺服器只送精簡的 JSON，列、走勢圖、浮動視窗都在瀏覽器畫。
+
+radar.render_table 把每一列展開成 HTML（每列一段 SVG、一整張跳脫後塞進 data-tip 的基本面表格，
+再加上掃整份文件的 MutationObserver），幾百列就是幾百 KB。這裡改成：
+
+- 每列只送數值、文字與量化過的走勢（0~100 的整數，最多 SPARK_POINTS 點），基本面欄名只送一次
+- 只畫捲動範圍內看得到的列（虛擬捲動），走勢圖在畫列的時候才產生
+- 點欄位標題在瀏覽器排序，不會觸發 Streamlit 重跑
+- 浮動視窗用事件委派，整張表只掛一組監聽
+
+用法與 render_table 相同：components.html(render_grid(rows, date_label), height=800)；
+app 用 render_cached，內容相同的表格直接取用上次的 HTML（見 RenderCache）。
+"""
+import hashlib
+import json
+import math
+import pickle
+import threading
+from collections import OrderedDict
+
+# 走勢圖寬 150px，超過這個點數看不出差別，長線 240 天的走勢先抽樣再送
+SPARK_POINTS = 150
+SPARK_LEVELS = 100
+ROW_HEIGHT = 56
+# 每列送出的欄位順序（瀏覽器端的常數要跟著改）
+FIELDS = ("ticker", "code", "name", "price", "change", "target", "rating", "cls", "reason", "up", "spark", "fund",
+          "rs")
+
+
+def _quantize(trend):
+    """走勢 → (0~SPARK_LEVELS 的整數 list, 是否上漲)；是否上漲用原始值判斷，量化不影響顏色"""
+    values = list(trend)
+    if not values:
+        return [], 0
+    up = 1 if values[-1] > values[0] else 0
+    if len(values) > SPARK_POINTS:
+        step = (len(values) - 1) / (SPARK_POINTS - 1)
+        values = [values[round(i * step)] for i in range(SPARK_POINTS)]
+    lo, hi = min(values), max(values)
+    if hi == lo:
+        return [SPARK_LEVELS // 2] * len(values), up
+    return [round((v - lo) / (hi - lo) * SPARK_LEVELS) for v in values], up
+
+
+def _num(value, digits=2):
+    """JSON 沒有 NaN，資料不足算不出來的值送 null"""
+    value = float(value)
+    return round(value, digits) if math.isfinite(value) else None
+
+
+def compact_payload(rows, date_label):
+    """process_display 的 rows → 精簡的 dict（欄位順序見 FIELDS）"""
+    fund_keys = []
+    for r in rows:
+        for k in r.get("fundamentals") or {}:
+            if k not in fund_keys:
+                fund_keys.append(k)
+    packed = []
+    for r in rows:
+        spark, up = _quantize(r["trend"])
+        fund = r.get("fundamentals") or {}
+        packed.append([
+            r.get("ticker") or r["url"].rsplit("/", 1)[-1], r["code"], r["name"],
+            _num(r["price"]), _num(r["change"]), _num(r["target"]),
+            r["rating"], r["cls"], r["reason"], up, spark,
+            [fund.get(k, "") for k in fund_keys] if fund else [],
+            # 舊版快照的列沒有相對強度
+            r.get("rs"),
+        ])
+    return {"date": date_label, "fund_keys": fund_keys, "rows": packed}
+
+
+def payload_json(rows, date_label):
+    """可以直接放進 <script type="application/json"> 的 JSON 字串（< 一律跳脫，內容不會提早結束 script）"""
+    text = json.dumps(compact_payload(rows, date_label), ensure_ascii=False, separators=(",", ":"))
+    return text.replace("<", "\\u003c")
+
+
+_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<style>
+    html, body { margin: 0; height: 100%; font-family: sans-serif; font-size: 14px; }
+    body { display: flex; flex-direction: column; }
+    .note { font-size: 12px; color: #888; margin: 4px 0 8px; }
+    .grid-row { display: grid; grid-template-columns: 70px 1.2fr 80px 80px 110px 50px 1.8fr 160px; align-items: center; }
+    .grid-row > div { padding: 0 10px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+    #head { background: #f2f2f2; border-bottom: 2px solid #ddd; font-weight: bold; height: 40px; user-select: none; }
+    #head > div { cursor: pointer; }
+    #head > div.nosort { cursor: default; }
+    #vp { flex: 1; overflow-y: auto; position: relative; }
+    #rows { position: absolute; left: 0; right: 0; top: 0; }
+    .row { position: absolute; left: 0; right: 0; height: __ROW_HEIGHT__px; border-bottom: 1px solid #eee; box-sizing: border-box; }
+    .row small { color: #666; }
+    .up { color: #d62728; font-weight: bold; } .down { color: #2ca02c; font-weight: bold; }
+    .tag-strong, .tag-buy, .tag-sell, .tag-hold { padding: 2px 8px; border-radius: 4px; font-weight: bold; text-align: center; display: inline-block; min-width: 60px; cursor: pointer; }
+    .tag-strong { background: #ffebeb; color: #d62728; }
+    .tag-buy { background: #e6ffe6; color: #2ca02c; }
+    .tag-sell { background: #f1f3f5; color: #495057; }
+    .tag-hold { background: #fff; border: 1px solid #eee; color: #868e96; }
+    .tooltip-box {
+        display: none; position: fixed; z-index: 9999;
+        background: #1e2a3a; color: #f0f4f8;
+        padding: 12px 16px; border-radius: 10px;
+        font-size: 13px; line-height: 1.8;
+        box-shadow: 0 4px 20px rgba(0,0,0,0.5);
+        min-width: 220px; pointer-events: none;
+        border: 1px solid #3a4f63;
+    }
+    .tooltip-box table { width: 100%; font-size: 13px; border-collapse: collapse; }
+    .tooltip-box td { padding: 2px 6px; }
+    .tooltip-box td:first-child { color: #a0b4c8; white-space: nowrap; }
+    .tooltip-box td:last-child { font-weight: bold; text-align: right; }
+    .tooltip-title { font-size: 14px; font-weight: bold; color: #fff; margin-bottom: 6px; border-bottom: 1px solid #3a4f63; padding-bottom: 4px; }
+</style></head>
+<body>
+<p class="note">⚠️ 以下評級與目標價為演算法估算，非投資建議，投資人應自行判斷。</p>
+<div id="head" class="grid-row"></div>
+<div id="vp"><div id="spacer"></div><div id="rows"></div></div>
+<div id="tt" class="tooltip-box"></div>
+<script id="data" type="application/json">__PAYLOAD__</script>
+<script>
+(function() {
+    var data = JSON.parse(document.getElementById("data").textContent);
+    // 欄位順序與 ranking_grid.compact_payload 相同
+    var TICKER = 0, CODE = 1, NAME = 2, PRICE = 3, CHANGE = 4, TARGET = 5,
+        RATING = 6, CLS = 7, REASON = 8, UP = 9, SPARK = 10, FUND = 11, RS = 12;
+    var ROW_H = __ROW_HEIGHT__, OVERSCAN = 8, LEVELS = __SPARK_LEVELS__;
+    var rows = data.rows.map(function(r, i) { r.rank = i; return r; });
+    var COLUMNS = [
+        ["代號", CODE], ["股名", NAME], ["現價", PRICE], ["漲跌", CHANGE],
+        ["目標價(" + data.date + ")", TARGET], ["RS", RS], ["AI評級", "rank"], ["趨勢", null]
+    ];
+    var sortKey = "rank", sortDir = 1;
+    var head = document.getElementById("head"), vp = document.getElementById("vp"),
+        spacer = document.getElementById("spacer"), body = document.getElementById("rows"),
+        tt = document.getElementById("tt");
+
+    function esc(s) {
+        return String(s).replace(/[&<>"']/g, function(c) {
+            return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}[c];
+        });
+    }
+    function num(v, d) { return v === null ? "-" : v.toFixed(d); }
+    function spark(r) {
+        var pts = r[SPARK];
+        if (pts.length < 2) return "";
+        var color = r[UP] ? "#d62728" : "#2ca02c";
+        var d = pts.map(function(v, i) {
+            return (i / (pts.length - 1) * 150).toFixed(1) + "," + (35 - v / LEVELS * 30).toFixed(1);
+        }).join(" ");
+        return '<svg width="150" height="40"><polyline points="' + d + '" fill="none" stroke="' + color + '" stroke-width="2"/></svg>';
+    }
+    function rowHtml(r, i) {
+        var cls = r[CHANGE] > 0 ? "up" : "down";
+        return '<div class="grid-row row" style="top:' + (i * ROW_H) + 'px">' +
+            '<div><a href="https://tw.stock.yahoo.com/quote/' + esc(r[TICKER]) + '" target="_blank">' + esc(r[CODE]) + '</a></div>' +
+            '<div>' + esc(r[NAME]) + '</div>' +
+            '<div class="' + cls + '">' + num(r[PRICE], 1) + '</div>' +
+            '<div class="' + cls + '">' + num(r[CHANGE], 2) + '%</div>' +
+            '<div>' + num(r[TARGET], 1) + '</div>' +
+            '<div title="相對強度：3/6/12 個月加權報酬在股票池中的百分位">' + (r[RS] == null ? "-" : r[RS]) + '</div>' +
+            '<div><span class="' + esc(r[CLS]) + ' has-tip" data-i="' + i + '">' + esc(r[RATING]) + '</span><br><small>' + esc(r[REASON]) + '</small></div>' +
+            '<div>' + spark(r) + '</div></div>';
+    }
+    function renderHead() {
+        head.innerHTML = COLUMNS.map(function(c, j) {
+            // 評級欄依名次排：名次由小到大就是分數由高到低
+            var ascending = c[1] === "rank" ? sortDir < 0 : sortDir > 0;
+            var mark = c[1] === sortKey ? (ascending ? " ▲" : " ▼") : "";
+            return '<div data-c="' + j + '"' + (c[1] === null ? ' class="nosort"' : '') + '>' + esc(c[0]) + mark + '</div>';
+        }).join("");
+    }
+    var pending = false;
+    function renderRows() {
+        pending = false;
+        var first = Math.max(0, Math.floor(vp.scrollTop / ROW_H) - OVERSCAN);
+        var last = Math.min(rows.length, Math.ceil((vp.scrollTop + vp.clientHeight) / ROW_H) + OVERSCAN);
+        var html = "";
+        for (var i = first; i < last; i++) html += rowHtml(rows[i], i);
+        body.innerHTML = html;
+    }
+    function schedule() {
+        if (!pending) { pending = true; window.requestAnimationFrame(renderRows); }
+    }
+    head.addEventListener("click", function(e) {
+        var cell = e.target.closest("[data-c]");
+        if (!cell) return;
+        var key = COLUMNS[+cell.getAttribute("data-c")][1];
+        if (key === null) return;
+        sortDir = key === sortKey ? -sortDir : (key === CODE || key === NAME || key === "rank" ? 1 : -1);
+        sortKey = key;
+        rows.sort(function(a, b) {
+            var x = a[key], y = b[key];
+            var c = typeof x === "string" ? x.localeCompare(y)
+                : (x === null ? -Infinity : x) - (y === null ? -Infinity : y);
+            return c * sortDir || a.rank - b.rank;
+        });
+        renderHead();
+        renderRows();
+    });
+    vp.addEventListener("scroll", schedule);
+    window.addEventListener("resize", schedule);
+
+    // 浮動視窗：整張表只掛一組監聽，內容在滑入時才組
+    body.addEventListener("mouseover", function(e) {
+        var el = e.target.closest(".has-tip");
+        if (!el) return;
+        var r = rows[+el.getAttribute("data-i")];
+        var fund = r[FUND];
+        var cells = data.fund_keys.map(function(k, j) {
+            return fund[j] ? "<tr><td>" + esc(k) + "</td><td>" + esc(fund[j]) + "</td></tr>" : "";
+        }).join("");
+        tt.innerHTML = '<div class="tooltip-title">' + esc(r[CODE]) + " " + esc(r[NAME]) + "</div><table>" + cells + "</table>";
+        tt.style.display = "block";
+    });
+    body.addEventListener("mousemove", function(e) {
+        if (tt.style.display !== "block") return;
+        var x = e.clientX + 16, y = e.clientY + 8;
+        if (x + 220 > window.innerWidth) x = e.clientX - 236;
+        if (y + 260 > window.innerHeight) y = e.clientY - 270;
+        tt.style.left = x + "px";
+        tt.style.top = y + "px";
+    });
+    body.addEventListener("mouseout", function(e) {
+        if (e.target.closest(".has-tip")) tt.style.display = "none";
+    });
+
+    spacer.style.height = (rows.length * ROW_H) + "px";
+    renderHead();
+    renderRows();
+})();
+</script>
+</body></html>
+"""
+
+
+def render_grid(rows, date_label):
+    """rows（process_display 的結果）→ 完整的 HTML 文件，交給 components.html 顯示"""
+    return (_TEMPLATE.replace("__ROW_HEIGHT__", str(ROW_HEIGHT))
+            .replace("__SPARK_LEVELS__", str(SPARK_LEVELS))
+            .replace("__PAYLOAD__", payload_json(rows, date_label)))
+
+
+class RenderCache:
+    """依（顯示的列, 日期標籤）的內容雜湊記住 render_grid 的結果，所有 session 共用，最多 max_entries 份。
+
+    資料沒變時（確認暱稱、別的 Tab 刪自選等造成的整頁重跑）不必重組 HTML；
+    而且同一份內容的 HTML 逐位元組相同，Streamlit 對 10KB 以上的元素只送雜湊參照，
+    瀏覽器已經有的就不會重收，iframe 內容不變也不會重載。
+    """
+
+    def __init__(self, max_entries=64, render=render_grid):
+        self.max_entries = max_entries
+        self.render = render
+        self.hits = 0
+        self.misses = 0
+        self._html = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(rows, date_label):
+        return hashlib.sha1(pickle.dumps((rows, date_label), protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def get(self, rows, date_label):
+        try:
+            key = self.key(rows, date_label)
+        except Exception as e:
+            print(f"[RenderCache] 無法計算雜湊: {e}")
+            return self.render(rows, date_label)
+        with self._lock:
+            html = self._html.get(key)
+            if html is not None:
+                self._html.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = self.render(rows, date_label)
+        with self._lock:
+            self._html[key] = html
+            while len(self._html) > self.max_entries:
+                self._html.popitem(last=False)
+        return html
+
+
+# 整個程序共用一份
+render_cache = RenderCache()
+
+
+def render_cached(rows, date_label):
+    """render_grid 加上內容雜湊快取"""
+    return render_cache.get(rows, date_label)
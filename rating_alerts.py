@@ -0,0 +1,209 @@
+"""評級變動偵測：記住每檔 × 策略目前的評級，每次刷新只重評輸入有變的股票，產生變動紀錄。
+
+以前 analyze_logic 的評級每次刷新算完就丟，某檔從「觀察」翻成「強力推薦」沒有人會發現。
+RatingBook 吃條件選股用的指標表（screener.build_table，一檔一列），輸入欄位與上次相同的股票
+直接沿用舊評級，其餘用 radar.analyze_vectorized 一次判完，全市場一次刷新只要幾毫秒。
+
+落地格式（目錄預設 .cache/ratings，可用環境變數 RADAR_RATINGS_DIR 改掉）：
+- state-<範圍>.json：目前的輸入與評級代碼（一檔一列的精簡快照，float 原值、缺值為 NaN），重啟後接著比對；
+- changes-<範圍>.jsonl：只記變動的事件，超過 max_events 的兩倍時壓回最近 max_events 筆；
+- ratings-<範圍>.lock：多個程序 / 副本共用同一個目錄時，update() 整段持有這個檔案鎖，
+  先重讀別人寫過的狀態與事件再比對、寫入，同一個變動不會被記兩次，壓縮也不會吃掉別人剛寫的事件。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import file_lock
+import radar
+
+DEFAULT_RATINGS_DIR = os.environ.get("RADAR_RATINGS_DIR", os.path.join(".cache", "ratings"))
+STRATEGIES = ("short", "medium", "long")
+# analyze_vectorized 的輸入欄位（指標表的欄位名稱）
+INPUTS = ("price", "ma20", "ma60", "ma120", "ma240", "vol_ratio")
+
+
+def _write_json(path, payload):
+    """先寫暫存檔再 rename，讀的一方不會看到寫一半的檔案；dumps 走 C 編碼器，比 dump 串流快得多"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json.dumps(payload, ensure_ascii=False))
+    os.replace(tmp, path)
+
+
+def rate_codes(inputs, strategy):
+    """輸入矩陣（N × len(INPUTS)）→ 評級代碼陣列（對應 radar.VECTOR_RATINGS[strategy]）"""
+    cols = dict(zip(INPUTS, inputs.T))
+    code, _ = radar.analyze_vectorized(cols["price"], cols["ma20"], cols["ma60"], cols["ma120"], cols["ma240"],
+                                       cols["vol_ratio"], strategy)
+    return code
+
+
+def rating_name(strategy, code):
+    return radar.VECTOR_RATINGS[strategy][code][0]
+
+
+class RatingBook:
+    """一個範圍（watch / market）的評級帳本；update() 回傳這次刷新產生的變動事件"""
+
+    def __init__(self, universe="watch", root=DEFAULT_RATINGS_DIR, max_events=5000):
+        self.universe = universe
+        self.root = root
+        self.max_events = max_events
+        self.tickers = []
+        self.inputs = np.empty((0, len(INPUTS)))
+        self.codes = {s: np.empty(0, dtype=np.int8) for s in STRATEGIES}
+        self.updated_at = None
+        self.events = deque(maxlen=max_events)
+        self._logged = 0
+        self._last_table = None
+        # 上次讀寫時兩個檔案的 (mtime, 大小)；不一樣表示別的程序寫過，要重讀
+        self._state_stamp = self._log_stamp = None
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        with file_lock.locked(self.lock_path):
+            self._sync()
+
+    @property
+    def state_path(self):
+        return os.path.join(self.root, f"state-{self.universe}.json")
+
+    @property
+    def changes_path(self):
+        return os.path.join(self.root, f"changes-{self.universe}.jsonl")
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.root, f"ratings-{self.universe}.lock")
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def _sync(self):
+        """檔案跟上次讀寫時不一樣（別的程序寫過）才重讀；呼叫端要持有檔案鎖"""
+        stamp = self._stamp(self.state_path)
+        if stamp is not None and stamp != self._state_stamp:
+            try:
+                with open(self.state_path, encoding="utf-8") as f:
+                    state = json.load(f)
+                self.tickers = state["tickers"]
+                self.inputs = np.array(state["inputs"], dtype=float).reshape(len(self.tickers), len(INPUTS))
+                self.codes = {s: np.array(state["codes"][s], dtype=np.int8) for s in STRATEGIES}
+                self.updated_at = state["updated_at"]
+                self._state_stamp = stamp
+            except Exception as e:
+                print(f"[RatingBook] 讀取 {self.state_path} 失敗: {e}")
+        stamp = self._stamp(self.changes_path)
+        if stamp is not None and stamp != self._log_stamp:
+            try:
+                with open(self.changes_path, encoding="utf-8") as f:
+                    lines = f.readlines()
+                self._logged = len(lines)
+                self.events.clear()
+                self.events.extend(json.loads(line) for line in lines[-self.max_events:])
+                self._log_stamp = stamp
+            except Exception as e:
+                print(f"[RatingBook] 讀取 {self.changes_path} 失敗: {e}")
+
+    def _save(self, events):
+        _write_json(self.state_path, {
+            "universe": self.universe, "updated_at": self.updated_at, "inputs_fields": INPUTS,
+            "tickers": self.tickers, "inputs": self.inputs.tolist(),
+            "codes": {s: c.tolist() for s, c in self.codes.items()},
+        })
+        self._state_stamp = self._stamp(self.state_path)
+        if not events:
+            return
+        if self._logged + len(events) > 2 * self.max_events:
+            # 壓縮：只留最近 max_events 筆（self.events 已經包含這次的事件）
+            tmp = f"{self.changes_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in self.events)
+            os.replace(tmp, self.changes_path)
+            self._logged = len(self.events)
+        else:
+            with open(self.changes_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in events)
+            self._logged += len(events)
+        self._log_stamp = self._stamp(self.changes_path)
+
+    def update(self, table, now=None):
+        """拿新的指標表比對，回傳變動事件 list（新出現的股票只建立基準，不算變動）
+
+        同一張表（同一個物件）重複傳入時直接回傳空 list，app 每次重跑都可以放心呼叫。
+        比對之前先在檔案鎖內重讀別的程序寫過的狀態，已經被別人記過的變動不會再記一次。
+        """
+        with self._lock:
+            if table is self._last_table:
+                return []
+            self._last_table = table
+            with file_lock.locked(self.lock_path):
+                self._sync()
+                return self._update(table, now)
+
+    def _update(self, table, now):
+        """update() 的本體：呼叫端持有執行緒鎖與檔案鎖"""
+        now = time.time() if now is None else now
+        tickers = table["tickers"].tolist()
+        inputs = np.column_stack([table["columns"][c] for c in INPUTS]) if tickers else np.empty((0, len(INPUTS)))
+
+        index = {t: i for i, t in enumerate(self.tickers)}
+        pos = np.fromiter((index.get(t, -1) for t in tickers), dtype=np.int64, count=len(tickers))
+        known = pos >= 0
+        old_inputs = np.full_like(inputs, np.nan)
+        old_inputs[known] = self.inputs[pos[known]]
+        same = (inputs == old_inputs) | (np.isnan(inputs) & np.isnan(old_inputs))
+        dirty = ~same.all(axis=1) | ~known
+
+        events, codes = [], {}
+        changed_rows = np.flatnonzero(dirty)
+        for s in STRATEGIES:
+            code = np.full(len(tickers), -1, dtype=np.int8)
+            code[known] = self.codes[s][pos[known]]
+            fresh = rate_codes(inputs[changed_rows], s) if len(changed_rows) else code[:0]
+            before = code[changed_rows]
+            code[changed_rows] = fresh
+            codes[s] = code
+            for i, old, new in zip(changed_rows, before, fresh):
+                if old >= 0 and old != new:
+                    events.append({
+                        "time": now, "ticker": tickers[i], "strategy": s,
+                        "from": rating_name(s, old), "to": rating_name(s, new),
+                        "price": round(float(inputs[i, 0]), 2),
+                    })
+
+        self.tickers, self.inputs, self.codes, self.updated_at = tickers, inputs, codes, now
+        self.events.extend(events)
+        if len(changed_rows):
+            try:
+                self._save(events)
+            except Exception as e:
+                print(f"[RatingBook] 寫入失敗: {e}")
+        return events
+
+    def feed(self, tickers=None, strategies=None, since=None, limit=50):
+        """最近的變動事件（新的在前）；tickers / strategies / since 為篩選條件"""
+        wanted = set(tickers) if tickers is not None else None
+        picked = []
+        with self._lock:
+            for e in reversed(self.events):
+                if since is not None and e["time"] <= since:
+                    break
+                if wanted is not None and e["ticker"] not in wanted:
+                    continue
+                if strategies is not None and e["strategy"] not in strategies:
+                    continue
+                picked.append(e)
+                if len(picked) >= limit:
+                    break
+        return picked
+
@@ -0,0 +1,144 @@
+"""自訂篩選條件：使用者輸入像 `close > ma60 and rsi < 30 and vol_ratio > 2` 的運算式，
+編譯一次成 numpy 向量運算，對整張指標表（全市場一檔一列）一次算完。
+
+只接受白名單內的語法：比較（可連寫，如 `30 < rsi < 70`）、and / or / not、加減乘除、數字、
+指標名稱與 abs / min / max；不經過 eval，使用者輸入碰不到任何 Python 物件。
+編譯結果依運算式文字快取，同一條件之後每次篩選只剩幾個陣列運算（全市場約 1 毫秒）。
+"""
+import ast
+import functools
+
+import numpy as np
+
+import relative_strength
+
+# 指標表的欄位（與 radar.latest_indicators 的 key 相同）
+COLUMNS = ("price", "change", "ma20", "ma60", "ma120", "ma240", "rsi", "vol_ratio")
+# 運算式可用的名稱 → 欄位；rs 為整張表內的相對強度百分位（relative_strength）
+VARIABLES = {"close": "price", **{c: c for c in COLUMNS}, "rs": "rs"}
+MAX_LENGTH = 300
+
+_COMPARE = {ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less,
+            ast.LtE: np.less_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal}
+_BINARY = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+# 函式名稱 → (參數個數, numpy 函式)
+_FUNCTIONS = {"abs": (1, np.abs), "min": (2, np.minimum), "max": (2, np.maximum)}
+
+
+class ScreenError(ValueError):
+    """運算式不合法；訊息可直接顯示給使用者"""
+
+
+def _numeric(node):
+    fn, kind = _build(node)
+    if kind != "num":
+        raise ScreenError(f"「{ast.unparse(node)}」不是數值")
+    return fn
+
+
+def _condition(node):
+    fn, kind = _build(node)
+    if kind != "bool":
+        raise ScreenError(f"「{ast.unparse(node)}」不是條件（缺少比較，例如 > 或 <）")
+    return fn
+
+
+def _build(node):
+    """AST 節點 → (fn(columns) -> 陣列或數字, "num" / "bool")"""
+    if isinstance(node, ast.BoolOp):
+        parts = [_condition(v) for v in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return (lambda cols: functools.reduce(combine, (p(cols) for p in parts))), "bool"
+
+    if isinstance(node, ast.UnaryOp):
+        if isinstance(node.op, ast.Not):
+            inner = _condition(node.operand)
+            return (lambda cols: np.logical_not(inner(cols))), "bool"
+        if isinstance(node.op, (ast.USub, ast.UAdd)):
+            inner = _numeric(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return inner, "num"
+            return (lambda cols: np.negative(inner(cols))), "num"
+
+    if isinstance(node, ast.Compare):
+        operands = [_numeric(n) for n in [node.left, *node.comparators]]
+        ops = []
+        for op in node.ops:
+            if type(op) not in _COMPARE:
+                raise ScreenError(f"不支援的比較：{type(op).__name__}")
+            ops.append(_COMPARE[type(op)])
+
+        def compare(cols):
+            values = [o(cols) for o in operands]
+            return functools.reduce(np.logical_and,
+                                    (op(a, b) for op, a, b in zip(ops, values, values[1:])))
+        return compare, "bool"
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        op = _BINARY[type(node.op)]
+        left, right = _numeric(node.left), _numeric(node.right)
+        return (lambda cols: op(left(cols), right(cols))), "num"
+
+    if isinstance(node, ast.Name):
+        if node.id not in VARIABLES:
+            raise ScreenError(f"未知的指標「{node.id}」，可用：{', '.join(VARIABLES)}")
+        column = VARIABLES[node.id]
+        return (lambda cols: cols[column]), "num"
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        value = float(node.value)
+        return (lambda cols: value), "num"
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS and not node.keywords:
+        arity, fn = _FUNCTIONS[node.func.id]
+        if len(node.args) != arity:
+            raise ScreenError(f"{node.func.id}() 需要 {arity} 個參數")
+        args = [_numeric(a) for a in node.args]
+        return (lambda cols: fn(*(a(cols) for a in args))), "num"
+
+    raise ScreenError(f"不支援的語法：「{ast.unparse(node)}」")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_screen(text):
+    """運算式文字 → fn(table) -> 布林陣列（與 table["tickers"] 等長）；不合法時丟 ScreenError"""
+    text = " ".join(text.split())
+    if not text:
+        raise ScreenError("請輸入條件")
+    if len(text) > MAX_LENGTH:
+        raise ScreenError(f"條件太長（上限 {MAX_LENGTH} 字）")
+    try:
+        tree = ast.parse(text, mode="eval")
+    except SyntaxError as e:
+        raise ScreenError(f"語法錯誤：{e.msg}") from None
+    predicate = _condition(tree.body)
+
+    def run(table):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # NaN 參與的比較一律為 False，缺資料的股票自然不會入選
+            mask = predicate(table["columns"])
+        return np.broadcast_to(np.asarray(mask, dtype=bool), table["tickers"].shape)
+    return run
+
+
+def build_table(prepared):
+    """[(ticker, (收盤 trend, 指標 dict))] → 指標表
+
+    {"tickers": 代號陣列, "columns": {欄位: float64 陣列}, "prepared": {ticker: (trend, 指標)},
+     "rs_reference": 排序好的加權報酬}；prepared 留著給入選的股票評分、畫走勢用，
+    rs_reference 讓別的名單（例如自選股）的相對強度也以這張表為基準。
+    """
+    prepared = dict(prepared)
+    tickers = np.array(list(prepared), dtype=object)
+    columns = {c: np.fromiter((ind[c] for _, ind in prepared.values()), dtype=np.float64, count=len(prepared))
+               for c in COLUMNS}
+    _, scores = relative_strength.prepared_scores(prepared.items())
+    reference = relative_strength.reference_scores(scores)
+    columns["rs"] = relative_strength.percentile_ranks(scores, reference)
+    return {"tickers": tickers, "columns": columns, "prepared": prepared, "rs_reference": reference}
+
+
+def screen(table, text):
+    """指標表中符合運算式的代號 list（依指標表順序）"""
+    mask = compile_screen(text)(table)
+    return table["tickers"][mask].tolist()
@@ -0,0 +1,261 @@
+"""跨程序、跨副本共用的快取層：同一份資料不管有幾個 Streamlit 程序在跑，每個區間只向上游抓一次。
+
+st.cache_data / st.cache_resource 只存在單一程序的記憶體裡，N 個副本就會各自下載 N 次，
+彼此看到的資料也可能不同。這裡在它們底下多墊一層所有副本都讀得到的存放處：
+
+- SQLiteBackend：單機多程序（或共用磁碟）用，預設 .cache/shared.sqlite；每 PURGE_EVERY 次寫入清一次過期資料
+- RedisBackend：多台機器用，任何有 get / set(ex=, nx=) / delete 的 Redis 相容客戶端都可以（測試用 bench.fixtures.FakeRedis）
+
+鍵為「命名空間:v版本:資料集:參數雜湊」，格式（SCHEMA_VERSION）變動時舊資料自然失效；
+值以 pickle 儲存並帶上寫入時間，到期由 TTL 決定。只給自己的副本共用，不要指向不受信任的 Redis。
+
+防止快取同時到期時一擁而上（cache stampede）：
+- 同一程序內，同一份資料同時只有一個執行緒在抓（SingleFlight），其他人等同一個結果
+- 跨副本以租約鍵（SET NX）決定誰去抓；沒搶到的人有舊值就先拿舊值，沒有舊值才等
+  （對方放掉租約卻沒寫回時就不再等，自己抓）
+- 資料過了 TTL 之後還會多留 TTL × STALE_GRACE 當「舊值」，所以到期那一刻上游請求數是固定的
+
+環境變數 RADAR_CACHE_URL：
+    sqlite:///path/to/cache.sqlite   （預設 sqlite:///.cache/shared.sqlite）
+    redis://host:6379/0
+    off                               （關閉，只用各程序自己的快取）
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# rows、panel 等資料格式變動時加一，所有副本的舊快取一起作廢
+SCHEMA_VERSION = 2
+DEFAULT_CACHE_URL = "sqlite:///" + os.path.join(".cache", "shared.sqlite")
+# 過期的資料再保留 TTL × STALE_GRACE 秒，別人正在重抓時先拿來用
+STALE_GRACE = 1.0
+# 租約最長秒數：拿到租約的程序掛掉時，過了這段時間別人才能接手
+LEASE_SECONDS = 120
+# 沒有舊值可用時，等別的副本抓完的最長秒數；逾時就自己抓
+WAIT_SECONDS = 60
+# SQLite 每寫入這麼多次就清一次過期資料（面板依名單、基本面與查詢依參數各存一筆，不清會一直長）
+PURGE_EVERY = 200
+
+
+class SingleFlight:
+    """程序內的請求合併：同一個 key 同時只有一個呼叫真的執行，其他呼叫等同一個結果。
+
+    stale_ok=True 的呼叫在有人正在抓、且手上有上一次結果時直接回傳上一次的結果，不必等。
+    上一次結果只保留最近 max_entries 個 key。
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._last = OrderedDict()
+
+    def do(self, key, fn, *args, stale_ok=False):
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+            elif stale_ok and key in self._last:
+                return self._last[key]
+        if not leader:
+            return fut.result()
+        try:
+            value = fn(*args)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._last[key] = value
+            self._last.move_to_end(key)
+            while len(self._last) > self.max_entries:
+                self._last.popitem(last=False)
+        fut.set_result(value)
+        return value
+
+
+# 整個程序共用一個，app 的所有 session 與背景執行緒都經過它
+flight = SingleFlight()
+
+
+class SQLiteBackend:
+    def __init__(self, path, purge_every=PURGE_EVERY):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ? AND expires > ?",
+                                     (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                               (key, value, time.time() + ttl))
+            self._writes += 1
+            due = self.purge_every and self._writes % self.purge_every == 0
+        if due:
+            self.purge()
+
+    def add(self, key, value, ttl):
+        """key 不存在或已過期才寫入（租約用），單一敘述所以跨程序也是原子的；寫入成功回傳 True"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                "WHERE cache.expires <= ?", (key, value, now + ttl, now))
+        return cur.rowcount == 1
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def purge(self):
+        """刪掉已過期的資料，回傳刪除筆數"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),)).rowcount
+
+
+class RedisBackend:
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        import redis  # 選用套件，只有設定 redis:// 時才需要
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, value, ex=max(1, int(ttl)), nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def purge(self):
+        return 0  # Redis 自己依 TTL 清除
+
+
+class SharedCache:
+    def __init__(self, backend, namespace="radar", version=SCHEMA_VERSION):
+        self.backend = backend
+        self.namespace = namespace
+        self.version = version
+
+    def key(self, dataset, args=()):
+        digest = hashlib.sha1(repr(args).encode("utf-8")).hexdigest()
+        return f"{self.namespace}:v{self.version}:{dataset}:{digest}"
+
+    def get_entry(self, dataset, args=()):
+        """回傳 (值, 寫入時間)，可能已超過 TTL（舊值）；沒有或讀取失敗回傳 None"""
+        try:
+            raw = self.backend.get(self.key(dataset, args))
+            return pickle.loads(raw) if raw is not None else None
+        except Exception as e:
+            print(f"[SharedCache.get] {dataset} 失敗: {e}")
+            return None
+
+    def set(self, dataset, args, value, ttl):
+        """後端多留 TTL × STALE_GRACE 秒，過期之後還能當舊值用"""
+        try:
+            self.backend.set(self.key(dataset, args), pickle.dumps((value, time.time())), ttl * (1 + STALE_GRACE))
+        except Exception as e:
+            print(f"[SharedCache.set] {dataset} 失敗: {e}")
+
+    def call(self, dataset, ttl, fn, *args, cache_if=None):
+        """先查共用快取，沒有或過期才呼叫 fn(*args) 並寫回；同一份資料同時只會有一個呼叫連上游。
+
+        cache_if(value) 為 False 的結果不寫（預設為 None 不寫），上游失敗時的空結果或保底清單
+        才不會被所有副本共用一整個 TTL。
+        """
+        entry = self.get_entry(dataset, args)
+        if entry is not None and time.time() - entry[1] < ttl:
+            return entry[0]
+        return flight.do(self.key(dataset, args), self._refresh, dataset, args, ttl, fn, cache_if, entry,
+                         stale_ok=entry is not None)
+
+    def _refresh(self, dataset, args, ttl, fn, cache_if, stale):
+        lease = self.key(dataset, args) + ":lease"
+        leased = self._try_lease(lease)
+        if not leased:
+            # 別的副本正在抓：有舊值先用舊值，沒有就等它寫回，等不到才自己抓
+            if stale is not None:
+                return stale[0]
+            fresh = self._wait(dataset, args, ttl, lease)
+            if fresh is not None:
+                return fresh[0]
+        try:
+            value = fn(*args)
+            if cache_if(value) if cache_if is not None else value is not None:
+                self.set(dataset, args, value, ttl)
+            elif stale is not None:
+                return stale[0]  # 上游失敗時繼續用舊值
+            return value
+        finally:
+            if leased:
+                try:
+                    self.backend.delete(lease)
+                except Exception as e:
+                    print(f"[SharedCache] 釋放租約失敗: {e}")
+
+    def _try_lease(self, lease):
+        try:
+            return self.backend.add(lease, b"1", LEASE_SECONDS)
+        except Exception as e:
+            print(f"[SharedCache] 取得租約失敗: {e}")
+            return True  # 後端有問題時各自抓，至少不會卡住
+
+    def _wait(self, dataset, args, ttl, lease, timeout=WAIT_SECONDS, interval=0.2):
+        """等拿到租約的一方寫回新值；它放掉租約卻沒寫（上游失敗、cache_if 不通過）時立刻不等，回傳 None"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(interval)
+            entry = self.get_entry(dataset, args)
+            if entry is not None and time.time() - entry[1] < ttl:
+                return entry
+            try:
+                if self.backend.get(lease) is None:
+                    return None
+            except Exception as e:
+                print(f"[SharedCache] 查詢租約失敗: {e}")
+                return None
+        return None
+
+
+def from_url(url=None):
+    """依 RADAR_CACHE_URL 建立 SharedCache；設為 off 或連線失敗回傳 None（退回各程序自己的快取）"""
+    url = url or os.environ.get("RADAR_CACHE_URL", DEFAULT_CACHE_URL)
+    if url == "off":
+        return None
+    try:
+        if url.startswith("redis://") or url.startswith("rediss://"):
+            return SharedCache(RedisBackend.from_url(url))
+        if url.startswith("sqlite:///"):
+            return SharedCache(SQLiteBackend(url[len("sqlite:///"):]))
+        raise ValueError(f"不支援的快取位址 {url}")
+    except Exception as e:
+        print(f"[shared_cache.from_url] 失敗: {e}")
+        return None
@@ -0,0 +1,190 @@
+"""所有使用者共用的日 K：系統名單一份面板，名單以外的股票收進共用的延伸集合。
+
+自選清單以前各自用整份名單呼叫 fetch_data，每個使用者一個 2 年下載、一個快取項目，
+即使自選的每一檔都已經在系統名單裡。現在自選（以及任何名單）都是共用面板的子集合：
+系統名單有的直接取，沒有的才下載，下載結果以代號為單位併入延伸集合，之後所有人共用。
+跨程序、跨副本的共用快取（shared_cache）也以代號為單位存放（cached_frames），
+名單不同但有重疊的 session 只會下載彼此沒有的那幾檔。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import download_scheduler
+import radar
+
+
+def cached_frames(cache, tickers, ttl=300, fetch=radar.fetch_data, dataset="bars"):
+    """與 radar.fetch_data 相同格式的面板，共用快取以代號為單位：(dataset, (ticker,)) 一檔一筆。
+
+    快取裡沒有或過期的代號合併成一次 fetch；下載不到的代號有舊值就用舊值。cache 為 None 時直接 fetch。
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if cache is None:
+        return fetch(tuple(tickers))
+    now = time.time()
+    frames, stale, missing = {}, {}, []
+    for t in tickers:
+        entry = cache.get_entry(dataset, (t,))
+        if entry is not None and now - entry[1] < ttl:
+            frames[t] = entry[0]
+        else:
+            missing.append(t)
+            if entry is not None:
+                stale[t] = entry[0]
+    if missing:
+        try:
+            data = fetch(tuple(missing))
+        except Exception as e:
+            print(f"[cached_frames] {len(missing)} 檔失敗: {e}")
+            data = None
+        has_data = data is not None and not data.empty
+        for t in missing:
+            df = radar.ticker_frame(data, t) if has_data else None
+            if df is not None and not df['Close'].dropna().empty:
+                cache.set(dataset, (t,), df, ttl)
+                frames[t] = df
+            elif t in stale:
+                frames[t] = stale[t]
+    return download_scheduler.join_frames({t: frames[t] for t in tickers if t in frames})
+
+
+class ExtensionPanel:
+    """系統名單以外的股票日 K，以代號為單位保存；沒有或過期的代號合併成一次批次下載。
+
+    fetch(tickers: tuple) 與 radar.fetch_data 相同介面（app 傳入走共用快取的版本）；
+    超過 max_tickers 檔時丟掉最久沒被用到的。
+    """
+
+    def __init__(self, fetch=radar.fetch_data, ttl=300, max_tickers=2000):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_tickers = max_tickers
+        self._frames = OrderedDict()  # ticker -> (日 K, 下載時間)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def tickers(self):
+        with self._lock:
+            return list(self._frames)
+
+    def stale(self, tickers, now=None):
+        """tickers 中沒有或已超過 ttl 的代號"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [t for t in tickers if t not in self._frames or now - self._frames[t][1] >= self.ttl]
+
+    def load(self, tickers):
+        """一次批次下載 tickers 併入延伸集合；回傳取得的檔數（下載失敗時舊資料照用）"""
+        tickers = sorted(set(tickers))
+        if not tickers:
+            return 0
+        try:
+            data = self.fetch(tuple(tickers))
+        except Exception as e:
+            print(f"[ExtensionPanel.load] {len(tickers)} 檔失敗: {e}")
+            return 0
+        if data is None or data.empty:
+            return 0
+        now = time.time()
+        got = 0
+        with self._lock:
+            for t in tickers:
+                df = radar.ticker_frame(data, t)
+                if df is None or df['Close'].dropna().empty:
+                    continue
+                self._frames[t] = (df, now)
+                self._frames.move_to_end(t)
+                got += 1
+            while len(self._frames) > self.max_tickers:
+                self._frames.popitem(last=False)
+        return got
+
+    def frames(self, tickers):
+        """tickers 的日 K {ticker: DataFrame}；沒有或過期的先下載（一次批次），下載不到的代號不出現在結果裡"""
+        tickers = list(dict.fromkeys(tickers))
+        missing = self.stale(tickers)
+        if missing:
+            self.load(missing)
+        with self._lock:
+            result = {}
+            for t in tickers:
+                if t in self._frames:
+                    result[t] = self._frames[t][0]
+                    self._frames.move_to_end(t)
+            return result
+
+
+def subset_frames(panel, extension, tickers):
+    """tickers 的日 K {ticker: DataFrame}：共用面板有的直接取，其餘向延伸集合要（必要時下載）
+
+    回傳值可直接交給 radar.ticker_frame / process_display，與 fetch_data 的面板通用。
+    """
+    frames, missing = {}, []
+    has_panel = panel is not None and not panel.empty
+    for t in tickers:
+        df = radar.ticker_frame(panel, t) if has_panel else None
+        if df is None:
+            missing.append(t)
+        else:
+            frames[t] = df
+    if missing:
+        frames.update(extension.frames(missing))
+    return frames
+
+
+class WatchlistPrefetcher:
+    """背景執行緒：每 interval 秒讀一次所有使用者自選股的聯集，預先抓好日 K 與基本面。
+
+    list_tickers() 回傳所有使用者的自選代號（app 從 Sheets 的 watchlist 分頁讀），
+    universe() 回傳系統名單：名單內的日 K 已在共用面板裡，只有名單外的才以 chunk_size 檔為一批
+    下載進延伸集合。會在下一輪之前過期的也一併重抓，登入與切換 Tab 時就不必等行情資料。
+    """
+
+    def __init__(self, extension, list_tickers, universe=tuple, fundamentals_fn=None,
+                 interval=240, chunk_size=200, max_workers=8):
+        self.extension = extension
+        self.list_tickers = list_tickers
+        self.universe = universe
+        self.fundamentals_fn = fundamentals_fn
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """預抓一輪，回傳 {"tickers": 自選聯集檔數, "downloaded": 下載檔數, "batches": 批次數}"""
+        tickers = sorted(set(self.list_tickers()))
+        in_universe = set(self.universe())
+        outside = [t for t in tickers if t not in in_universe]
+        # 下一輪之前就會過期的也算進來，保持延伸集合一直是新的
+        due = self.extension.stale(outside, now=time.time() + self.interval)
+        batches = [due[i:i + self.chunk_size] for i in range(0, len(due), self.chunk_size)]
+        downloaded = sum(self.extension.load(batch) for batch in batches)
+        if self.fundamentals_fn is not None and tickers:
+            import snapshot
+            snapshot.prefetch_fundamentals(tickers, self.fundamentals_fn, self.max_workers)
+        self.last_run = time.time()
+        return {"tickers": len(tickers), "downloaded": downloaded, "batches": len(batches)}
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[WatchlistPrefetcher] 失敗: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="watchlist-prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
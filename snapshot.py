@@ -0,0 +1,182 @@
+"""背景批次排名：在請求路徑之外算好三種策略的排行，發佈成帶版本的快照檔給 app 直接讀。
+
+每次執行寫出一個不可變的 ranking-<時間>-<範圍>.json，再以原子替換更新 manifest.json
+指向最新版本；app 只讀 manifest 與快照檔，不管多少人在看，下載與計算都只在這裡跑一次。
+
+範圍（universe）：
+- watch：系統 Tab 的預設名單（0050 成分股 + 保底清單 + 百大熱門股），三種策略的完整排行
+- market：全市場掃描，各策略前 --top 名（讀寫 HistoryStore）
+
+用法：
+    python snapshot.py                      # 發佈一次 watch 快照
+    python snapshot.py --market --top 200   # 全市場快照
+    python snapshot.py --loop 300           # 每 5 分鐘發佈一次
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import file_lock
+import radar
+
+DEFAULT_SNAPSHOT_DIR = os.environ.get("RADAR_SNAPSHOT_DIR", os.path.join(".cache", "snapshots"))
+MANIFEST = "manifest.json"
+MANIFEST_LOCK = "manifest.lock"
+STRATEGIES = ("short", "medium", "long")
+
+
+def _write_json(path, payload):
+    """先寫暫存檔再 rename，讀的一方不會看到寫一半的檔案"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_manifest(root=DEFAULT_SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"latest": {}, "snapshots": []}
+    except Exception as e:
+        print(f"[load_manifest] 失敗: {e}")
+        return {"latest": {}, "snapshots": []}
+
+
+def latest_path(universe="watch", root=DEFAULT_SNAPSHOT_DIR, max_age=None):
+    """最新快照的路徑；沒有或超過 max_age 秒回傳 None"""
+    entry = load_manifest(root)["latest"].get(universe)
+    if entry is None:
+        return None
+    if max_age is not None and time.time() - entry["created_at"] > max_age:
+        return None
+    return os.path.join(root, entry["file"])
+
+
+def read_snapshot(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def covers(snap, stock_dict):
+    """快照是否算過 stock_dict 的每一檔"""
+    return set(stock_dict) <= set(snap["tickers"])
+
+
+def select_rows(rows, stock_dict=None, top_n=None, keep=None):
+    """從快照的排行挑出 stock_dict 內的股票，套用 keep 篩選後取前 top_n 名。
+
+    快照裡的 rows 已依分數排好（同分維持名單順序），結果與 process_display 相同。
+    """
+    picked = []
+    for r in rows:
+        if stock_dict is not None and r["ticker"] not in stock_dict:
+            continue
+        if keep is not None and not keep(r):
+            continue
+        picked.append(r)
+        if top_n is not None and len(picked) >= top_n:
+            break
+    return picked
+
+
+def prefetch_fundamentals(tickers, fundamentals_fn=radar.fetch_fundamentals, max_workers=8):
+    """基本面一檔一個請求，用 thread pool 併發抓好，回傳查表用的 fundamentals_fn"""
+    tickers = list(tickers)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = dict(zip(tickers, pool.map(fundamentals_fn, tickers)))
+    return lambda t: results[t] if t in results else fundamentals_fn(t)
+
+
+def compute_watch(fetch=radar.fetch_data, fundamentals_fn=radar.fetch_fundamentals):
+    """watch 範圍：與 app 預設名單相同的股票池，三種策略完整排行（不截斷、不篩選）"""
+    stock_dict = radar.build_watch_list(radar.fetch_0050_constituents(), radar.fetch_dynamic_hot_stocks())
+    data = fetch(tuple(sorted(stock_dict)))
+    fund = prefetch_fundamentals(stock_dict, fundamentals_fn)
+    return stock_dict, {s: radar.process_display(stock_dict, s, lambda _: data, fund) for s in STRATEGIES}
+
+
+def compute_market(top=200, store=None, fundamentals_fn=radar.fetch_fundamentals):
+    """market 範圍：全市場掃描，各策略前 top 名"""
+    import market_scan
+    from history_store import HistoryStore
+    listings = radar.fetch_market_listings()
+    if not listings:
+        raise RuntimeError("無法取得上市櫃清單")
+    result = market_scan.scan_market(listings, k=top, store=store or HistoryStore(), fundamentals_fn=fundamentals_fn)
+    return {c: n for c, n, _ in listings}, result
+
+
+def publish(universe, stock_dict, strategies, root=DEFAULT_SNAPSHOT_DIR, keep_versions=10, top=None):
+    """寫出新版本快照並更新 manifest，只保留最近 keep_versions 份；回傳快照路徑
+
+    tickers 記下這次算過的完整名單（含資料不足、沒出現在排行裡的），app 據此判斷快照涵不涵蓋自己的名單；
+    top 為全市場模式每種策略保留的名次，None 表示完整排行。
+    """
+    os.makedirs(root, exist_ok=True)
+    created_at = time.time()
+    name = f"ranking-{datetime.fromtimestamp(created_at).strftime('%Y%m%dT%H%M%S%f')}-{universe}.json"
+    payload = {"universe": universe, "created_at": created_at, "top": top, "tickers": list(stock_dict),
+               "strategies": strategies}
+    _write_json(os.path.join(root, name), payload)
+
+    entry = {"file": name, "universe": universe, "created_at": created_at,
+             "rows": {s: len(rows) for s, rows in strategies.items()}}
+    # 讀改寫 manifest 全程持有檔案鎖：watch 與 market 兩個 --loop 同時發佈時，不會拿舊的 manifest 蓋掉對方的 latest
+    with file_lock.locked(os.path.join(root, MANIFEST_LOCK)):
+        manifest = load_manifest(root)
+        manifest["latest"][universe] = entry
+        snapshots = [e for e in manifest["snapshots"] if e["file"] != name] + [entry]
+        expired = [e for e in snapshots if e["universe"] == universe][:-keep_versions]
+        manifest["snapshots"] = [e for e in snapshots if e not in expired]
+        _write_json(os.path.join(root, MANIFEST), manifest)
+    # 舊版本在 manifest 換掉之後才刪，讀 manifest 的一方不會拿到已刪的檔名
+    for e in expired:
+        try:
+            os.remove(os.path.join(root, e["file"]))
+        except OSError:
+            pass
+    return os.path.join(root, name)
+
+
+def run_once(args):
+    start = time.perf_counter()
+    if args.market:
+        stock_dict, strategies = compute_market(args.top)
+        universe, top = "market", args.top
+    else:
+        stock_dict, strategies = compute_watch()
+        universe, top = "watch", None
+    path = publish(universe, stock_dict, strategies, args.out, args.keep, top)
+    print(f"[snapshot] {universe}：{len(stock_dict)} 檔，耗時 {time.perf_counter() - start:.1f} 秒 → {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="背景計算排行並發佈快照")
+    parser.add_argument("--out", default=DEFAULT_SNAPSHOT_DIR, help="快照目錄")
+    parser.add_argument("--market", action="store_true", help="改跑全市場掃描")
+    parser.add_argument("--top", type=int, default=200, help="全市場模式每種策略保留幾名")
+    parser.add_argument("--keep", type=int, default=10, help="每種範圍保留幾個版本")
+    parser.add_argument("--loop", type=float, help="每隔幾秒重跑一次（不給就只跑一次）")
+    args = parser.parse_args(argv)
+
+    while True:
+        try:
+            run_once(args)
+        except Exception as e:
+            print(f"[snapshot] 失敗: {e}")
+            if not args.loop:
+                return 1
+        if not args.loop:
+            return 0
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""策略常數的參數掃描：grid 或隨機搜尋，多程序平行跑 backtest，輸出排名表。
+
+價格與指標只在主程序算一次，存成 .npy 後各 worker 用 np.load(mmap_mode="r") 映射，
+同一份唯讀資料由作業系統的 page cache 共用，不會每個任務都 pickle 一整個面板過去。
+
+排名依據：三種策略「最強評級」（強力推薦 / 長線買點）訊號的平均報酬
+（到價以目標價出場、沒到價以觀察期最後收盤出場），任一策略訊號數少於 --min-signals 的組合排最後。
+
+用法：
+    python sweep.py --random 64
+    python sweep.py --grid VOL_SURGE_THRESHOLD=1.2,1.5,2 BIAS_STRONG_PCT=3,5,7 --workers 8
+    python sweep.py --store .cache/history --random 200 --out sweep.csv
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import radar
+
+# 隨機搜尋的範圍（均勻分布）
+SEARCH_SPACE = {
+    "VOL_SURGE_THRESHOLD": (1.0, 3.0),
+    "BIAS_STRONG_PCT": (2.0, 10.0),
+    "NEAR_MA_RANGE": (0.02, 0.10),
+    "SHORT_TARGET_MULT": (1.03, 1.20),
+    "MEDIUM_TARGET_MULT": (1.05, 1.30),
+    "LONG_TARGET_MULT": (1.10, 1.50),
+}
+STRATEGIES = ("short", "medium", "long")
+
+# worker 端映射進來的唯讀陣列
+_ARRAYS = None
+_IND = None
+
+
+def share_arrays(arrays, ind, folder):
+    """把回測要用的陣列存成 .npy，回傳給 worker 的路徑表"""
+    paths = {}
+    for group, source, names in (("arrays", arrays, ("Close", "High", "Low")),
+                                 ("ind", ind, ("ma20", "ma60", "ma120", "ma240", "vol_ratio"))):
+        for name in names:
+            path = os.path.join(folder, f"{group}_{name}.npy")
+            np.save(path, source[name])
+            paths[(group, name)] = path
+    return paths
+
+
+def _init_worker(paths):
+    global _ARRAYS, _IND
+    _ARRAYS, _IND = {}, {}
+    for (group, name), path in paths.items():
+        (_ARRAYS if group == "arrays" else _IND)[name] = np.load(path, mmap_mode="r")
+    _IND["price"] = _ARRAYS["Close"]
+
+
+def summarize_params(overrides, rows, min_signals):
+    """一組參數的回測結果壓成排名表的一列"""
+    record = dict(radar.strategy_params(**overrides))
+    # VECTOR_RATINGS 每種策略的第一個評級就是最強的那個
+    strong = {r["strategy"]: r for r in rows if r["rating"] == radar.VECTOR_RATINGS[r["strategy"]][0][0]}
+    returns = []
+    enough = True
+    for s in STRATEGIES:
+        r = strong.get(s)
+        record[f"{s}_signals"] = r["signals"] if r else 0
+        record[f"{s}_hit_rate"] = r["hit_rate"] if r else np.nan
+        record[f"{s}_avg_return"] = r["avg_return"] if r else np.nan
+        enough &= bool(r) and r["signals"] >= min_signals
+        returns.append(record[f"{s}_avg_return"])
+    record["objective"] = float(np.nanmean(returns)) if enough else np.nan
+    return record
+
+
+def _evaluate(task):
+    overrides, min_signals = task
+    rows = backtest.backtest_arrays(_ARRAYS, _IND, STRATEGIES, radar.strategy_params(**overrides))
+    return summarize_params(overrides, rows, min_signals)
+
+
+def grid_candidates(specs):
+    """["NAME=v1,v2", ...] → 所有組合；沒列到的常數維持 app 預設值"""
+    axes = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in SEARCH_SPACE or not values:
+            raise SystemExit(f"無法解析 --grid {spec!r}，可用的參數：{', '.join(SEARCH_SPACE)}")
+        axes[name] = [float(v) for v in values.split(",")]
+    return [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+
+
+def random_candidates(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{name: round(float(rng.uniform(lo, hi)), 4) for name, (lo, hi) in SEARCH_SPACE.items()} for _ in range(n)]
+
+
+def run_sweep(panel, candidates, workers=None, min_signals=100):
+    """平行評估每組參數，回傳依 objective 排序的 DataFrame（第一列是目前預設值作為對照）"""
+    _, _, arrays = backtest.panel_arrays(panel)
+    ind = backtest.indicator_arrays(arrays)
+    tasks = [({}, min_signals)] + [(c, min_signals) for c in candidates]
+    with tempfile.TemporaryDirectory(prefix="radar-sweep-") as folder:
+        paths = share_arrays(arrays, ind, folder)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(paths,)) as pool:
+            records = list(pool.map(_evaluate, tasks))
+    for i, record in enumerate(records):
+        record["label"] = "目前預設" if i == 0 else ""
+    table = pd.DataFrame(records)
+    return table.sort_values("objective", ascending=False, na_position="last", kind="stable").reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="策略常數的平行參數掃描")
+    backtest.add_source_args(parser)
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument("--grid", nargs="+", metavar="NAME=v1,v2", help="格點搜尋")
+    search.add_argument("--random", type=int, default=32, help="隨機搜尋的組數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="程序數，預設為 CPU 核心數")
+    parser.add_argument("--min-signals", type=int, default=100, help="每種策略最強評級至少要有幾筆訊號才列入排名")
+    parser.add_argument("--top", type=int, default=20, help="印出前幾名")
+    parser.add_argument("--out", help="完整排名另存 CSV")
+    args = parser.parse_args(argv)
+
+    candidates = grid_candidates(args.grid) if args.grid else random_candidates(args.random, args.seed)
+    panel = backtest.load_panel(args)
+    start = time.perf_counter()
+    table = run_sweep(panel, candidates, args.workers, args.min_signals)
+    elapsed = time.perf_counter() - start
+
+    with pd.option_context("display.width", 200, "display.max_columns", 30):
+        print(table.head(args.top).to_string(float_format=lambda v: f"{v:.4f}"))
+    print(f"[sweep] {len(candidates)} 組參數，耗時 {elapsed:.1f} 秒")
+    if args.out:
+        table.to_csv(args.out, index=False, encoding="utf-8-sig")
+        print(f"[sweep] 已寫入 {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""K 線 + MA5～MA240 技術圖的共用建構（大盤圖與個股 drill-down 共用，與 Streamlit 無關）。
+
+以前大盤圖每次重跑都從頭建 Figure，把下載到的整段序列（日線 2 年、週線 10 年、月線 20 年）
+分成 7 條 trace 全部送給瀏覽器，但畫面上只看得到最後 150 根。現在：
+- 均線用完整歷史算好之後才開窗：預設只送最後 DEFAULT_BARS 根，要往回看再由使用者延長；
+- 選「全部」時超過 MAX_POINTS 的較舊部分合併成較粗的 K 棒（抽稀），最近的部分保持原解析度；
+- x 軸送日期字串、均線去掉開頭的 NaN，均線可改用 Scattergl（WebGL）畫；
+- 建好的圖以序列化後的 JSON 由呼叫端依（週期, 資料版本, 長度, WebGL）快取，重跑時用 load_figure
+  直接還原（不再逐欄驗證），不必重算均線、重建 trace，也沒有共用的可變 Figure。
+
+個股圖另外加一個 RSI 子圖（add_mas(df, rsi=True) 時 build_figure 自動畫出）。
+plotly 很重，只在 build_figure / load_figure 裡才 import。
+"""
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+import radar
+
+MAS = (5, 10, 20, 60, 120, 240)
+MA_COLORS = ('#f39c12', '#3498db', '#9b59b6', '#2ecc71', '#e74c3c', '#7f8c8d')
+UP_COLOR, DOWN_COLOR = '#dc3545', '#28a745'
+# 一打開看得到的根數
+VISIBLE_POINTS = 150
+# 往回看的長度選項（根數）；None 為全部
+HISTORY_OPTIONS = {"近 300 根": 300, "近 600 根": 600, "全部": None}
+DEFAULT_BARS = 300
+# 「全部」時最多送幾根；超過時較舊的部分抽稀
+MAX_POINTS = 600
+RSI_COLOR = '#8e44ad'
+RSI_BANDS = (30, 70)
+
+
+def add_mas(df, rsi=False):
+    """加上 MA5～MA240（rsi=True 時再加 RSI）欄位；用完整歷史算，開窗之後最前面的值才正確"""
+    df = df.copy()
+    for ma in MAS:
+        df[f'MA{ma}'] = df['Close'].rolling(window=ma).mean()
+    if rsi:
+        df['RSI'] = radar.calculate_rsi(df['Close'])
+    return df
+
+
+def summary(df):
+    """最新收盤、漲跌、漲跌幅與各均線最新值 → dict"""
+    current, prev_close = float(df['Close'].iloc[-1]), float(df['Close'].iloc[-2])
+    return {
+        "current": current, "change": current - prev_close,
+        "change_pct": (current - prev_close) / prev_close * 100,
+        "ma": {ma: float(df[f'MA{ma}'].iloc[-1]) for ma in MAS},
+    }
+
+
+def decimate_ohlc(df, factor):
+    """每 factor 根合併成一根（開盤取第一根、高低取極值、收盤與均線取最後一根、量相加）；
+    從最後一根往前分組，最靠近現在的那組一定是完整的"""
+    if factor <= 1 or df.empty:
+        return df
+    # 第一組補位成不滿 factor 根，其餘每組剛好 factor 根
+    groups = (np.arange(len(df)) + (-len(df)) % factor) // factor
+    agg = {c: "last" for c in df.columns}
+    agg.update({"Open": "first", "High": "max", "Low": "min"})
+    if "Volume" in df:
+        agg["Volume"] = "sum"
+    out = df.groupby(groups).agg(agg)
+    out.index = pd.DatetimeIndex(df.index.to_series().groupby(groups).last().to_numpy())
+    return out
+
+
+def window(df, bars=DEFAULT_BARS, max_points=MAX_POINTS):
+    """最後 bars 根（None 為全部）；超過 max_points 時只保留最近 max_points // 2 根原解析度，
+    更舊的部分抽稀成剩下的根數"""
+    if bars is not None:
+        df = df.iloc[-bars:]
+    if len(df) <= max_points:
+        return df
+    keep = max(max_points // 2, VISIBLE_POINTS)
+    older, recent = df.iloc[:-keep], df.iloc[-keep:]
+    factor = math.ceil(len(older) / max(max_points - keep, 1))
+    return pd.concat([decimate_ohlc(older, factor), recent])
+
+
+def _dates(index):
+    """x 軸用日期字串，比完整的 ISO 時間戳短一半"""
+    return pd.DatetimeIndex(index).strftime("%Y-%m-%d").tolist()
+
+
+def _round(values):
+    return np.round(np.asarray(values, dtype=float), 2)
+
+
+def build_figure(df, webgl=False, height=300, visible=VISIBLE_POINTS):
+    """已加上均線、開好窗的日 K → plotly Figure（K 線 + 六條均線，y 軸範圍貼齊可見的 visible 根）；
+    df 有 RSI 欄位時下方加一個 RSI 子圖"""
+    import plotly.graph_objects as go
+    x = _dates(df.index)
+    with_rsi = 'RSI' in df
+    if with_rsi:
+        from plotly.subplots import make_subplots
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.75, 0.25], vertical_spacing=0.03)
+    else:
+        fig = go.Figure()
+    main = {"row": 1, "col": 1} if with_rsi else {}
+    fig.add_trace(go.Candlestick(
+        x=x, open=_round(df['Open']), high=_round(df['High']), low=_round(df['Low']), close=_round(df['Close']),
+        name='K線', increasing_line_color=UP_COLOR, increasing_fillcolor=UP_COLOR,
+        decreasing_line_color=DOWN_COLOR, decreasing_fillcolor=DOWN_COLOR), **main)
+    scatter = go.Scattergl if webgl else go.Scatter
+    for ma, color in zip(MAS, MA_COLORS):
+        series = df[f'MA{ma}']
+        valid = series.notna().to_numpy()
+        if not valid.any():
+            continue
+        first = int(valid.argmax())
+        fig.add_trace(scatter(x=x[first:], y=_round(series.iloc[first:]), mode='lines', name=f'MA{ma}',
+                              line=dict(color=color, width=1.2), hoverinfo='y'), **main)
+    if with_rsi:
+        fig.add_trace(scatter(x=x, y=_round(df['RSI']), mode='lines', name='RSI',
+                              line=dict(color=RSI_COLOR, width=1.2), hoverinfo='y'), row=2, col=1)
+        for level in RSI_BANDS:
+            fig.add_hline(y=level, line=dict(color='rgba(150,150,150,0.6)', width=1, dash='dot'), row=2, col=1)
+        fig.update_yaxes(range=[0, 100], side="right", showgrid=False, row=2, col=1)
+
+    shown = df.iloc[-visible:]
+    y_min, y_max = float(shown['Low'].min()), float(shown['High'].max())
+    y_pad = (y_max - y_min) * 0.05
+    x_end = (pd.Timestamp(df.index[-1]) + pd.Timedelta(days=5)).strftime("%Y-%m-%d")
+    fig.update_layout(
+        margin=dict(l=10, r=40, t=10, b=10), height=height, paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)", xaxis_rangeslider_visible=False, showlegend=False,
+        yaxis=dict(showgrid=True, gridcolor='rgba(200,200,200,0.2)', side="right", tickformat=",",
+                   range=[y_min - y_pad, y_max + y_pad]),
+        hovermode="x unified")
+    # 有子圖時兩個 x 軸一起設定，拖曳、縮放保持對齊
+    fig.update_xaxes(showgrid=True, gridcolor='rgba(200,200,200,0.2)', range=[x[-min(visible, len(x))], x_end],
+                     type="date")
+    return fig
+
+
+def load_figure(payload):
+    """build_figure(...).to_json() 的結果 → Figure；內容建立時已驗證過，還原時略過 plotly 的逐欄驗證"""
+    import plotly.graph_objects as go
+    return go.Figure(json.loads(payload), _validate=False)
+
+
+def data_version(df):
+    """資料版本：最後一根的日期與收盤、總根數；快取的 key 用這個，不必雜湊整個 DataFrame"""
+    if df is None or df.empty:
+        return None
+    return f"{pd.Timestamp(df.index[-1]).isoformat()}|{float(df['Close'].iloc[-1]):.4f}|{len(df)}"